@@ -0,0 +1,208 @@
+"""
+Successive halving (ASHA) early termination across the runs of a sweep
+
+Every run writes its val_loss per epoch to val_history.json (solpred_common.ValLossHistory).  At each
+milestone epoch (rung) a run is compared with every run of its group that has also reached that epoch, using the
+best val_loss up to the milestone.  Runs outside the best 1/eta of the comparison are pruned: prune.json is written
+into the run folder with the reason, the run stops at the end of its current epoch and is not tested, and the
+launchers and sweep_scheduler.py skip it from then on.  The decisions are asynchronous as in ASHA, a run is judged
+as soon as it reaches a milestone, against the runs that got there before it.
+
+Milestones default to min_epochs * eta^k, eg. 2, 6, 18 with --min-epochs 2 --eta 3.
+Runs are only compared within a group (by default the same horizon and fold) so validation losses are comparable.
+
+python3 asha.py conv-run --eta 3 --min-epochs 2
+python3 asha.py conv-run --eta 3 --min-epochs 2 --watch 300
+"""
+# Standard Library Modules
+from pathlib import Path
+import argparse
+import datetime
+import json
+import math
+import os
+import time
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+VAL_HISTORY_FILE = "val_history.json"
+PRUNE_FILE = "prune.json"
+GROUP_BY = ["horizon", "fold"]
+
+
+def milestones(min_epochs: int, eta: int, max_epochs: int = 100) -> list:
+    '''Rung epochs min_epochs * eta^k below max_epochs, eg. [2, 6, 18, 54]'''
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= eta
+    return rungs
+
+
+def read_json(path: Path, default=None):
+    '''Contents of a json file, or default if it is missing or can't be parsed (eg. written by an older version in place)'''
+    if not path.exists():
+        return default
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Could not read {path}, treating it as missing: {e}")
+        return default
+
+
+def write_json(path: Path, data):
+    '''Write then rename, so readers never see a half written file'''
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_run(run_folder: Path) -> dict:
+    '''Run params, val_loss history (epoch -> loss, epochs counted from 1) and prune record of one run folder'''
+    with open(run_folder / "run-params.json") as f:
+        params = json.load(f)
+    history = {int(epoch) + 1: loss for epoch, loss in read_json(run_folder / VAL_HISTORY_FILE, {}).items()}
+    pruned = None
+    if (run_folder / PRUNE_FILE).exists():
+        # A prune.json that can't be read still means the run was pruned
+        pruned = read_json(run_folder / PRUNE_FILE, {"reason": "unreadable prune.json"})
+    return {"folder": run_folder, "params": params, "history": history, "pruned": pruned,
+            "finished": (run_folder / params["out-file"]).exists()}
+
+
+def best_until(history: dict, epoch: int) -> float:
+    '''Best val_loss in the first epoch epochs, the number early stopping and checkpointing would keep'''
+    losses = [loss for e, loss in history.items() if e <= epoch and math.isfinite(loss)]
+    return min(losses) if losses else math.inf
+
+
+def group_key(run: dict, group_by: list) -> tuple:
+    return tuple(str(run["params"].get(key)) for key in group_by)
+
+
+def decide(runs: list, rungs: list, eta: int) -> list:
+    '''
+    ASHA rule for one group of runs.
+    :param runs: runs of one group, from read_run
+    :return: list of (run, prune record) for the runs to prune now
+    '''
+    decisions = []
+    pruned = set()
+    for rung, epoch in enumerate(rungs):
+        reached = [run for run in runs if max(run["history"], default=0) >= epoch]
+        if len(reached) < eta:
+            continue
+        losses = sorted((best_until(run["history"], epoch), str(run["folder"])) for run in reached)
+        keep = max(1, len(reached) // eta)
+        cutoff = losses[keep - 1][0]
+        for run in reached:
+            if run["pruned"] is not None or run["finished"] or str(run["folder"]) in pruned:
+                continue
+            loss = best_until(run["history"], epoch)
+            rank = [name for _, name in losses].index(str(run["folder"])) + 1
+            if rank > keep:
+                pruned.add(str(run["folder"]))
+                decisions.append((run, {"time": str(datetime.datetime.now()),
+                                        "rung": rung,
+                                        "epoch": epoch,
+                                        "val_loss": loss,
+                                        "rank": rank,
+                                        "compared": len(reached),
+                                        "kept": keep,
+                                        "cutoff_val_loss": cutoff,
+                                        "reason": f"best val_loss {loss:.4g} by epoch {epoch} ranked {rank} of {len(reached)}, only the best {keep} (1/{eta}) continue past rung {rung}"}))
+    return decisions
+
+
+class Controller:
+    '''
+    Applies the ASHA rule to the runs under some folders, see the module docstring.
+    '''
+    def __init__(self, paths, eta: int = 3, min_epochs: int = 2, max_epochs: int = 100, group_by: list = GROUP_BY, dry_run: bool = False):
+        self.paths = [Path(p) for p in paths]
+        self.eta = eta
+        self.rungs = milestones(min_epochs, eta, max_epochs)
+        self.group_by = list(group_by)
+        self.dry_run = dry_run
+
+    def run_folders(self) -> list:
+        folders = []
+        for path in self.paths:
+            folders += [p.parent for p in sorted(path.rglob("run-params.json"))] if path.is_dir() else [path.parent]
+        return folders
+
+    def step(self) -> list:
+        '''
+        Reads every run once and prunes the runs the ASHA rule rejects.
+        :return: the prune records written
+        '''
+        groups = {}
+        for folder in self.run_folders():
+            run = read_run(folder)
+            groups.setdefault(group_key(run, self.group_by), []).append(run)
+        records = []
+        for key, runs in groups.items():
+            for run, record in decide(runs, self.rungs, self.eta):
+                logger.info(f"Pruning {run['folder']}: {record['reason']}")
+                if not self.dry_run:
+                    write_json(run["folder"] / PRUNE_FILE, {"group": dict(zip(self.group_by, key)), **record})
+                records.append(record)
+        return records
+
+    def summary(self) -> dict:
+        runs = [read_run(folder) for folder in self.run_folders()]
+        pruned = [run for run in runs if run["pruned"] is not None]
+        return {"runs": len(runs),
+                "pruned": len(pruned),
+                "finished": sum(run["finished"] for run in runs),
+                "epochs_trained": sum(max(run["history"], default=0) for run in runs),
+                "epochs_trained_by_pruned_runs": sum(max(run["history"], default=0) for run in pruned)}
+
+    def watch(self, interval: float, stop=None):
+        '''Steps every interval seconds until every run is finished or pruned, or stop() returns True'''
+        summary = None
+        while True:
+            try:
+                self.step()
+                summary = self.summary()
+                logger.info(f"ASHA: {summary}")
+                if summary["runs"] == summary["pruned"] + summary["finished"]:
+                    return summary
+            except Exception:
+                # Keep watching, a bad check must not silently end pruning for the rest of the sweep
+                logger.exception("ASHA check failed, trying again next interval")
+            if stop is not None and stop():
+                return summary
+            time.sleep(interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prune the worst runs of a sweep at milestone epochs (successive halving / ASHA)")
+    parser.add_argument('paths', type=Path, nargs='+', help="Run folders (searched for run-params.json)")
+    parser.add_argument('--eta', type=int, default=3, help="Reduction factor, the best 1/eta of the runs at each rung continue")
+    parser.add_argument('--min-epochs', type=int, default=2, help="First milestone epoch")
+    parser.add_argument('--max-epochs', type=int, default=100, help="No milestones at or after this epoch")
+    parser.add_argument('--group-by', type=str, nargs='*', default=GROUP_BY, help="run-params keys, runs are only compared with runs that share them")
+    parser.add_argument('--watch', type=float, default=None, help="Keep checking every this many seconds until the sweep is done")
+    parser.add_argument('--dry-run', action='store_true', help="Log what would be pruned without writing prune.json")
+    return parser.parse_args()
+
+
+def main(args):
+    controller = Controller(args.paths, args.eta, args.min_epochs, args.max_epochs, args.group_by, args.dry_run)
+    logger.info(f"Milestones at epochs {controller.rungs}")
+    if args.watch is None:
+        controller.step()
+        logger.info(f"ASHA: {controller.summary()}")
+    else:
+        controller.watch(args.watch)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main(parse_args())
@@ -0,0 +1,128 @@
+""" Execution mode benchmark
+
+Train and inference samples/s of each convolutional Solpred architecture on random inputs, in eager fp32, with
+channels_last, with --compile (channels_last + torch.compile, torch 2+ only, see solpred_common.optimise_model)
+and with --precision bf16 autocast, with and without channels_last.
+Every mode starts from the same weights, the inference outputs are compared to eager fp32 to catch layout bugs and
+show the bf16 error.  Each mode runs in a fresh process so its peak memory (max rss) can be reported.
+Runs on cpu by default, set the threads the same as a run would get (eg. sweep_scheduler.py --threads).
+
+python3 benchmark_compile.py --threads 8
+python3 benchmark_compile.py --models fully_conv sunset --input_terms 16 --batch_size 32 --output benchmark_compile.csv
+python3 benchmark_compile.py --modes eager bf16 --threads 8
+"""
+
+
+# Imports
+from argparse import ArgumentParser, Namespace
+import importlib
+import multiprocessing
+import resource
+import time
+
+import torch
+import torch.nn.functional as F
+import pandas as pd
+
+import solpred_common
+
+MODELS = ["fully_conv", "sunset", "leaky_sunset", "model3", "model4", "model6", "model7", "model8", "model9"]
+MODES = {"eager": {},
+         "channels_last": {"channels_last": True},
+         "compile": {"compile": True},
+         "bf16": {"precision": "bf16"},
+         "channels_last_bf16": {"channels_last": True, "precision": "bf16"}}
+
+def model_class(module_name):
+    """The SolpredModule subclass defined in a model script"""
+    module = importlib.import_module(module_name)
+    return [c for c in vars(module).values() if isinstance(c, type) and issubclass(c, solpred_common.SolpredModule) and c.__module__ == module.__name__][0]
+
+def random_batch(args, device):
+    """Model inputs and target of the shapes SolpredDataModule produces"""
+    n, terms = args.batch_size, args.input_terms
+    return ([torch.rand(n, 3 * terms, args.img_width, args.img_width, device=device),
+             1000 * torch.rand(n, terms, device=device),
+             1000 * torch.rand(n, 2 * terms, device=device),
+             1000 * torch.rand(n, 1, device=device),
+             1000 * torch.rand(n, 1, device=device)],
+            1000 * torch.rand(n, 1, device=device))
+
+def samples_per_second(step, batch_size, steps, warmup):
+    for i in range(warmup):
+        step()
+    start = time.perf_counter()
+    for i in range(steps):
+        step()
+    return steps * batch_size / (time.perf_counter() - start)
+
+def benchmark(module_name, mode, args):
+    """One model in one mode, run in its own process"""
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    options = dict(MODES[mode])
+    precision = options.pop("precision", "32")
+    torch.manual_seed(0)
+    model = model_class(module_name)(Namespace(model_name=module_name, input_terms=args.input_terms, learning_rate=1e-5, batch_size=args.batch_size, img_width=args.img_width)).to(device)
+    inputs, target = random_batch(args, device)
+    model.eval()
+    with torch.no_grad():
+        reference = model(*inputs)
+    solpred_common.optimise_model(model, **options)
+    inputs = solpred_common.channels_last_batch(inputs) if model.channels_last else inputs
+    optimizer = model.configure_optimizers()
+
+    def train_step():
+        optimizer.zero_grad()
+        with solpred_common.autocast(device, precision):
+            loss = F.mse_loss(model(*inputs).float(), target)
+        loss.backward()
+        optimizer.step()
+
+    def inference_step():
+        with torch.no_grad(), solpred_common.autocast(device, precision):
+            return model(*inputs)
+
+    max_abs_diff = (inference_step().float() - reference).abs().max().item()
+    model.train()
+    train = samples_per_second(train_step, args.batch_size, args.steps, args.warmup)
+    model.eval()
+    inference = samples_per_second(inference_step, args.batch_size, args.steps, args.warmup)
+    result = {"model": module_name, "mode": mode, "precision": precision, "compiled": "compile" in options and hasattr(torch, "compile"),
+              "train_samples_per_second": train, "inference_samples_per_second": inference, "max_abs_diff": max_abs_diff,
+              "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    print(f"{module_name} {mode}: train {train:.1f} samples/s, inference {inference:.1f} samples/s, max abs diff vs eager {max_abs_diff:.3g}, peak rss {result['peak_rss_mb']:.0f}MB")
+    return result
+
+def main(args):
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for module_name in args.models:
+        for mode in args.modes:
+            try:
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(benchmark, (module_name, mode, args)))
+            except RuntimeError as e:
+                # eg. the model's linear layer does not fit this --img_width
+                print(f"{module_name} {mode} failed: {e}")
+    df = pd.DataFrame(results)
+    for column in ["train_samples_per_second", "inference_samples_per_second"]:
+        df[column.replace("samples_per_second", "speedup")] = df[column] / df.groupby("model")[column].transform("first")
+    print(df.to_string(index=False))
+    df.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--models', type=str, nargs='+', default=MODELS, help="Model scripts to benchmark")
+    parser.add_argument('--modes', type=str, nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--input_terms', type=int, default=2)
+    parser.add_argument('--img_width', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=50, help="Timed batches per mode")
+    parser.add_argument('--warmup', type=int, default=5, help="Untimed batches per mode, compile happens here")
+    parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads")
+    parser.add_argument('--device', type=str, default="cpu")
+    parser.add_argument('--output', type=str, default="benchmark_compile.csv")
+    main(parser.parse_args())
@@ -8,6 +8,11 @@ python3 fully_conv.py --ds_dir /data/blackmountain/shards_1m_7m_15m --train_ds "
 python3 fully_conv.py --ds_dir /data/blackmountain/shards_1m_7m_15m --train_ds "train_{0000..0036}.tar" --val_ds "val_{0000..0003}.tar" --test_ds "test_{0000..0014}.tar" --batch_size 8  --gpus 1 --test --load_checkpoint tb_logs/my_sunset_model/version_0/checkpoints/epoch=3-step=510222.ckpt
 
 python3 fully_conv.py --model_name fully-conv --train_ds "/work/blackmountain/shards_2_20s/train_{0000..0036}.tar" --val_ds "/work/blackmountain/shards_2_20s/val_{0000..0003}.tar" --test_ds "/work/blackmountain/shards_2_20s/test_{0000..0014}.tar" --batch_size 8 --test_output "2_20s_out.csv.gz" --input_terms 2 --gpus 1 --benchmark True
+python3 fully_conv.py --model_name fully-conv --test_ds "/work/blackmountain/shards_2_20s/test_{0000..0014}.tar" --test_output "2_20s_folds_out.csv.gz" --input_terms 2 --learning_rate 3e-6 --img_width 64 --gpus 1 --eval_checkpoints fold*/2x20s_420s/latest_best.ckpt
+python3 fully_conv.py --model_name fully-conv --train_ds "/work/blackmountain/shards_2_20s/fold0/train_{0000..0036}.tar" --val_ds "/work/blackmountain/shards_2_20s/fold0/val_{0000..0003}.tar" --test_ds "/work/blackmountain/shards_2_20s/test_{0000..0014}.tar" --test_output "2x20s_420s_fully-conv_out.csv.gz" --input_terms 2 --learning_rate 3e-6 --img_width 64 --gpus 1 --learning_rates 3.0E-6 3.0E-5 3.0E-4 --member_dir "../../lr_{lr}/fold0/2x20s_420s"
+
+python3 fully_conv.py --model_name fully-conv --train_ds "/work/blackmountain/shards_2_20s/fold0/train_{0000..0036}.tar" --val_ds "/work/blackmountain/shards_2_20s/fold0/val_{0000..0003}.tar" --test_ds "/work/blackmountain/shards_2_20s/test_{0000..0014}.tar" --test_output "2x20s_420s_fully-conv_out.csv.gz" --input_terms 2 --learning_rate auto --img_width 64 --gpus 1
+python3 fully_conv.py --model_name fully-conv --train_ds "/work/blackmountain/shards_2_20s/fold0/train_{0000..0036}.tar" --val_ds "/work/blackmountain/shards_2_20s/fold0/val_{0000..0003}.tar" --test_ds "/work/blackmountain/shards_2_20s/test_{0000..0014}.tar" --input_terms 2 --learning_rate auto --img_width 64 --gpus 1 --lr_find --lr_find_steps 500
 
 tensorboard --logdir lightning_logs/
 """
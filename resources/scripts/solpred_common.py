@@ -5,23 +5,118 @@ Common code for running pytorch lightning modules in the solpred project
 
 # Imports
 from pathlib import Path
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+import contextlib
+import copy
 import datetime
 import json
+import math
+import multiprocessing
+import os
+import re
+import resource
+import time
 
+import numpy as np
+import torch
 import torch.nn.functional as F
 import pytorch_lightning as pl
 import pandas as pd
 
 from solpreddatamodule import SolpredDataModule
 
+class StreamingMetrics:
+    """
+    Running MAE, MSE, RMSE and R2 for one prediction series, updated a sample at a time so the
+    headline numbers are available at the end of testing without re-reading the exported csv
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum_abs_error = 0.0
+        self.sum_sq_error = 0.0
+        self.mean_actual = 0.0
+        self.m2_actual = 0.0 # Sum of squared deviations of actual from its mean (Welford), the total sum of squares for R2
+
+    def update(self, actual, pred):
+        if not (math.isfinite(actual) and math.isfinite(pred)):
+            return
+        error = pred - actual
+        self.count += 1
+        self.sum_abs_error += abs(error)
+        self.sum_sq_error += error * error
+        delta = actual - self.mean_actual
+        self.mean_actual += delta / self.count
+        self.m2_actual += delta * (actual - self.mean_actual)
+
+    def compute(self):
+        if self.count == 0:
+            return {"count": 0, "mae": math.nan, "mse": math.nan, "rmse": math.nan, "r2": math.nan}
+        mse = self.sum_sq_error / self.count
+        return {"count": self.count,
+                "mae": self.sum_abs_error / self.count,
+                "mse": mse,
+                "rmse": math.sqrt(mse),
+                "r2": 1 - self.sum_sq_error / self.m2_actual if self.m2_actual > 0 else math.nan}
+
+def skill(reference, forecast):
+    """Skill vs a reference metric (e.g. skill vs persistence)"""
+    return 1 - forecast / reference if reference > 0 else math.nan
+
+# Two sided 95% t critical values for 1 to 10 degrees of freedom, as used in make_ensembles.clj
+T_CRIT_TABLE = [12.71, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228]
+
+def t_crit(n):
+    if n - 1 <= len(T_CRIT_TABLE):
+        return T_CRIT_TABLE[n - 2]
+    from scipy import stats
+    return stats.t.ppf(0.975, n - 1)
+
+def learning_rate_arg(value):
+    return "auto" if value == "auto" else float(value)
+
+def channels_last_batch(batch):
+    """The batch with its image in channels_last (NHWC) memory format, the shape and everything else unchanged"""
+    return [batch[0].contiguous(memory_format=torch.channels_last), *batch[1:]]
+
+def optimise_model(model, channels_last=False, compile=False):
+    """
+    channels_last: the conv weights, and the image of every batch (in on_after_batch_transfer), in NHWC memory format,
+    the layout the oneDNN cpu and tensor core conv kernels are fastest with
+    compile: channels_last, and the forward of every SolpredModule in model compiled with torch.compile.
+    torch.compile needs torch 2, with an older torch this warns and stays eager with channels_last
+    """
+    if channels_last or compile:
+        model.to(memory_format=torch.channels_last)
+        for module in model.modules():
+            if hasattr(module, "channels_last"):
+                module.channels_last = True
+    if compile:
+        if hasattr(torch, "compile"):
+            for module in model.modules():
+                if isinstance(module, SolpredModule):
+                    module.forward = torch.compile(module.forward)
+        else:
+            print(f"torch {torch.__version__} has no torch.compile, running eager with channels_last")
+    return model
+
+def autocast(device, precision):
+    """
+    Autocast for running a model outside the Trainer the way --precision runs it inside:
+    bf16 on cpu or gpu, 16 on gpu, anything else full precision
+    """
+    if str(precision) == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    if str(precision) == "16" and device.type == "cuda":
+        return torch.autocast(device_type="cuda", dtype=torch.float16)
+    return contextlib.nullcontext()
+
 class SolpredModule(pl.LightningModule):
     @staticmethod
     def add_model_specific_args(parent_parser):
         parser = ArgumentParser(parents=[parent_parser], add_help=False)
         parser.add_argument('--input_terms', type=int, required=True)
         parser.add_argument('--model_name', type=str, required=True)
-        parser.add_argument('--learning_rate', type=float, required=True)
+        parser.add_argument('--learning_rate', type=learning_rate_arg, required=True, help="A float, or auto to pick one with a learning rate range test first")
         return parser
 
     def __init__(self, args):
@@ -30,8 +125,23 @@ class SolpredModule(pl.LightningModule):
         self.batch_size = args.batch_size
         self.learning_rate = args.learning_rate
         self.test_results = []
+        self.test_metrics = {"model": StreamingMetrics(), "persist": StreamingMetrics()}
+        self.step_timer = None # Set by the StepTimer callback when --step_timing is on
+        self.channels_last = False # Set by optimise_model
         self.save_hyperparameters()
 
+    def on_before_batch_transfer(self, batch, dataloader_idx):
+        if self.step_timer is not None:
+            self.step_timer.mark(self, "fetched")
+        return batch
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.channels_last:
+            batch = channels_last_batch(batch)
+        if self.step_timer is not None:
+            self.step_timer.mark(self, "transferred")
+        return batch
+
     def training_step(self, batch, batch_idx):
         img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
         pred = self(img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky)
@@ -57,6 +167,8 @@ class SolpredModule(pl.LightningModule):
             result = {"actual": target[i].item(), # The value we were trying to predict
                      self.model_name + "_pred": pred[i].item(), # the prediction from our model
                      "persist_pred": json_data[i]["inputs"][0][ghi_label]} # Taking the most recent observed value as persistence
+            self.test_metrics["model"].update(result["actual"], result[self.model_name + "_pred"])
+            self.test_metrics["persist"].update(result["actual"], result["persist_pred"])
             for key, value in result.items():
                 # For each series in result
                 self.test_results.append(
@@ -67,11 +179,847 @@ class SolpredModule(pl.LightningModule):
         #step_df.set_index("time") # I think we throw away the index at csv export anyway
         return loss
 
+    def on_test_epoch_start(self):
+        self.test_metrics = {"model": StreamingMetrics(), "persist": StreamingMetrics()}
+
+    def on_test_epoch_end(self):
+        metrics = self.summarise_test_metrics()
+        for series in ["model", "persist"]:
+            print(f"Test {series}: " + ", ".join(f"{name}={value:.4g}" for name, value in metrics[series].items()))
+        print("Test skill vs persistence: " + ", ".join(f"{name}={value:.4f}" for name, value in metrics["skill"].items()))
+        self.log_dict({f"test_{series}_{name}": float(value) for series in ["model", "persist", "skill"] for name, value in metrics[series].items() if name != "count"}, batch_size=1)
+
+    def summarise_test_metrics(self):
+        model_metrics = self.test_metrics["model"].compute()
+        persist_metrics = self.test_metrics["persist"].compute()
+        return {"model": model_metrics,
+                "persist": persist_metrics,
+                "skill": {f"{name}_skill": skill(persist_metrics[name], model_metrics[name]) for name in ["mae", "mse", "rmse"]}}
+
+    def export_test_metrics(self, output_path):
+        with open(output_path, "w") as f:
+            json.dump({"model_name": self.model_name, **self.summarise_test_metrics()}, f, indent=2)
+
     def export_test_csv(self, output_path):
         pd.DataFrame(self.test_results, columns=["time", "series", "value"]).to_csv(output_path, index=False)
         #pd.concat(self.test_results, axis="index", ignore_index=True).to_csv(output_path, index=False)
 
 
+class MultiCheckpointModule(pl.LightningModule):
+    """
+    Runs several checkpoints of the same architecture (e.g. every fold of a run) on each test batch,
+    so the test shards are read and decoded once for all of them instead of once per fold
+    """
+    def __init__(self, models, labels):
+        super().__init__()
+        self.models = torch.nn.ModuleList(models)
+        self.labels = labels
+        self.model_name = models[0].model_name
+        self.test_results = []
+        self.test_metrics = {}
+        self.channels_last = False
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        return channels_last_batch(batch) if self.channels_last else batch
+
+    def series_names(self):
+        return [f"{self.model_name}_{label}" for label in self.labels] + [f"{self.model_name}_ensemble", "persist"]
+
+    def on_test_epoch_start(self):
+        self.test_results = []
+        self.test_metrics = {name: StreamingMetrics() for name in self.series_names()}
+
+    def test_step(self, batch, batch_idx):
+        img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
+        preds = torch.stack([model(img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky).reshape(-1) for model in self.models], dim=1)
+        k = preds.shape[1]
+        mean = preds.mean(dim=1)
+        half_width = t_crit(k) * preds.std(dim=1) / math.sqrt(k) if k > 1 else torch.zeros_like(mean)
+        ghi_label = "globalcmp11physical" if "globalcmp11physical" in json_data[0]["inputs"][0] else "value"
+        ensemble = f"{self.model_name}_ensemble"
+        for i, d in enumerate(json_data):
+            actual = target[i].item()
+            result = {"time": d["id"], "actual": actual}
+            for label, value in zip(self.labels, preds[i].tolist()):
+                result[f"{self.model_name}_{label}_pred"] = value
+                self.test_metrics[f"{self.model_name}_{label}"].update(actual, value)
+            result[ensemble + "_pred"] = mean[i].item()
+            result[ensemble + "_upper"] = mean[i].item() + half_width[i].item()
+            result[ensemble + "_lower"] = mean[i].item() - half_width[i].item()
+            result["persist_pred"] = d["inputs"][0][ghi_label]
+            self.test_metrics[ensemble].update(actual, result[ensemble + "_pred"])
+            self.test_metrics["persist"].update(actual, result["persist_pred"])
+            self.test_results.append(result)
+
+    def on_test_epoch_end(self):
+        metrics = self.summarise_test_metrics()
+        for series, values in metrics.items():
+            print(f"Test {series}: " + ", ".join(f"{name}={value:.4g}" for name, value in values.items()))
+
+    def summarise_test_metrics(self):
+        persist_metrics = self.test_metrics["persist"].compute()
+        metrics = {}
+        for series, streaming in self.test_metrics.items():
+            metrics[series] = streaming.compute()
+            if series != "persist":
+                metrics[series].update({f"{name}_skill": skill(persist_metrics[name], metrics[series][name]) for name in ["mae", "mse", "rmse"]})
+        return metrics
+
+    def export_test_metrics(self, output_path):
+        with open(output_path, "w") as f:
+            json.dump({"model_name": self.model_name, "labels": self.labels, **self.summarise_test_metrics()}, f, indent=2)
+
+    def export_test_csv(self, output_path):
+        """One row per sample: time, actual, a prediction column per checkpoint, the ensemble mean and 95% t band, persistence"""
+        pd.DataFrame(self.test_results).to_csv(output_path, index=False)
+
+    def export_member_csv(self, label, output_path):
+        """One checkpoint's results in the long format of SolpredModule.export_test_csv, as if it had been tested on its own"""
+        df = pd.DataFrame(self.test_results)
+        df = df[["time", "actual", f"{self.model_name}_{label}_pred", "persist_pred"]].rename(columns={f"{self.model_name}_{label}_pred": self.model_name + "_pred"})
+        df.melt(id_vars="time", var_name="series", value_name="value").to_csv(output_path, index=False)
+
+def checkpoint_labels(checkpoints):
+    """fold label for each checkpoint from its path (e.g. .../fold3/16x60s_420s/latest_best.ckpt -> fold_3), or its position"""
+    labels = []
+    for i, checkpoint in enumerate(checkpoints):
+        match = re.search(r"fold_?(\d+)", str(checkpoint))
+        labels.append(f"fold_{match.group(1)}" if match else f"ckpt_{i}")
+    return labels if len(set(labels)) == len(labels) else [f"ckpt_{i}" for i in range(len(checkpoints))]
+
+def multi_checkpoint_test(model_class, checkpoints, trainer, data, test_output, labels=None, member_outputs=None, channels_last=False, compile=False):
+    """
+    Test every checkpoint in one pass over the test set, see MultiCheckpointModule
+    member_outputs optionally gives each checkpoint its own test csv (and metrics json) as well
+    """
+    models = [model_class.load_from_checkpoint(checkpoint) for checkpoint in checkpoints]
+    model = MultiCheckpointModule(models, checkpoint_labels(checkpoints) if labels is None else labels)
+    optimise_model(model, channels_last, compile)
+    print(f"Testing {len(models)} checkpoints: " + ", ".join(model.labels))
+    trainer.test(model, datamodule=data)
+    print("exporting")
+    model.export_test_csv(test_output)
+    model.export_test_metrics(metrics_output_path(test_output))
+    metrics = model.summarise_test_metrics()
+    for label, member_output in zip(model.labels, member_outputs or []):
+        model.export_member_csv(label, member_output)
+        # Same layout as SolpredModule.export_test_metrics
+        member_metrics = dict(metrics[f"{model.model_name}_{label}"])
+        member_skill = {name: member_metrics.pop(name) for name in list(member_metrics) if name.endswith("_skill")}
+        with open(metrics_output_path(member_output), "w") as f:
+            json.dump({"model_name": model.model_name, "model": member_metrics, "persist": metrics["persist"], "skill": member_skill}, f, indent=2)
+    return model
+
+class SharedDataModule(pl.LightningModule):
+    """
+    Trains several models of the same architecture (e.g. a learning rate sweep) on one data stream,
+    so each training batch is read and decoded once for all of them.
+    Each member keeps its own optimizer, early stopping and best checkpoint (member_dir/latest_best.ckpt,
+    loadable with the model class's load_from_checkpoint), and stops training on its own.
+    """
+    def __init__(self, models, labels, member_dirs, patience):
+        super().__init__()
+        self.members = torch.nn.ModuleList(models)
+        self.labels = labels
+        self.member_dirs = [Path(d) for d in member_dirs]
+        self.patience = patience
+        self.batch_size = models[0].batch_size
+        self.automatic_optimization = False
+        self.best = [math.inf] * len(models)
+        self.wait = [0] * len(models)
+        self.active = [True] * len(models)
+        self.val_sums = [0.0] * len(models)
+        self.val_count = 0
+        self.member_samples = [0] * len(models)
+        self.member_epochs = [0] * len(models)
+        self.channels_last = False
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        return channels_last_batch(batch) if self.channels_last else batch
+
+    def configure_optimizers(self):
+        return [member.configure_optimizers() for member in self.members]
+
+    def training_step(self, batch, batch_idx):
+        img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
+        optimizers = self.optimizers()
+        optimizers = optimizers if isinstance(optimizers, list) else [optimizers]
+        for i, (member, optimizer) in enumerate(zip(self.members, optimizers)):
+            if not self.active[i]:
+                continue
+            pred = member(img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky)
+            loss = F.mse_loss(pred, target)
+            optimizer.zero_grad()
+            self.manual_backward(loss)
+            optimizer.step()
+            self.member_samples[i] += len(target)
+            self.member_epochs[i] = self.current_epoch + 1
+            self.log(f"train_loss_{self.labels[i]}", loss, batch_size=self.batch_size)
+
+    def on_validation_epoch_start(self):
+        self.val_sums = [0.0] * len(self.members)
+        self.val_count = 0
+
+    def validation_step(self, batch, batch_idx):
+        img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
+        for i, member in enumerate(self.members):
+            if self.active[i]:
+                pred = member(img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky)
+                self.val_sums[i] += F.mse_loss(pred, target, reduction="sum").item()
+        self.val_count += target.numel()
+
+    def on_validation_epoch_end(self):
+        if self.trainer.sanity_checking or self.val_count == 0:
+            return
+        for i, label in enumerate(self.labels):
+            if not self.active[i]:
+                continue
+            val_loss = self.val_sums[i] / self.val_count
+            self.log(f"val_loss_{label}", val_loss, batch_size=self.batch_size)
+            if val_loss < self.best[i]:
+                print(f"{label}: val_loss improved to {val_loss:.4f}, saving {self.member_dirs[i] / 'latest_best.ckpt'}")
+                self.best[i] = val_loss
+                self.wait[i] = 0
+                self.save_member(i)
+            else:
+                self.wait[i] += 1
+                if self.wait[i] >= self.patience:
+                    print(f"{label}: no improvement in {self.patience} epochs, best val_loss {self.best[i]:.4f}, stopping this model")
+                    self.active[i] = False
+        if not any(self.active):
+            self.trainer.should_stop = True
+
+    def save_member(self, i):
+        member = self.members[i]
+        self.member_dirs[i].mkdir(parents=True, exist_ok=True)
+        torch.save({"epoch": self.current_epoch,
+                    "global_step": self.global_step,
+                    "pytorch-lightning_version": pl.__version__,
+                    "state_dict": member.state_dict(),
+                    "hyper_parameters": dict(member.hparams)},
+                   self.member_dirs[i] / "latest_best.ckpt")
+
+def shared_data_train(model_class, args, data):
+    """Train one model per --learning_rates value on one data stream, then test the best checkpoint of each in one pass"""
+    labels, member_dirs, models = [], [], []
+    for learning_rate in args.learning_rates:
+        member_args = Namespace(**vars(args))
+        member_args.learning_rate = float(learning_rate)
+        labels.append(f"lr_{learning_rate}")
+        member_dirs.append(Path(args.member_dir.format(lr=learning_rate)))
+        models.append(model_class(member_args))
+    model = SharedDataModule(models, labels, member_dirs, args.stopping_patience)
+    optimise_model(model, args.channels_last, args.compile)
+    run_cost = RunCost()
+    trainer = pl.Trainer.from_argparse_args(args, enable_checkpointing=False, callbacks=[run_cost] + ([StepTimer()] if args.step_timing else []))
+    print(f"Training {len(models)} models on one data stream: " + ", ".join(labels))
+    trainer.fit(model, data)
+    with open("started_testing.json", "w") as f:
+        print("Starting Testing")
+        json.dump({"start_time": str(datetime.datetime.now()), "best_val_loss": dict(zip(labels, model.best))}, f)
+    trained = [i for i, d in enumerate(member_dirs) if (d / "latest_best.ckpt").exists()]
+    tested = multi_checkpoint_test(model_class, [member_dirs[i] / "latest_best.ckpt" for i in trained], trainer, data, args.test_output,
+                                   labels=[labels[i] for i in trained], member_outputs=[member_dirs[i] / Path(args.test_output).name for i in trained],
+                                   channels_last=args.channels_last, compile=args.compile)
+    run_cost.write_members(model, tested, trainer)
+
+def forward_peak_memory(model, inputs, precision):
+    """
+    Pool function: memory of one forward pass of model under a precision, run in a fresh process on cpu because max
+    rss never goes down, so a precision measured after another would report the larger of the two
+    :return: (peak memory of the process in MB, MB added by the forward pass)
+    """
+    device = torch.device("cpu")
+    before = peak_memory_mb(device)
+    with torch.no_grad(), autocast(device, precision):
+        model(*inputs)
+    after = peak_memory_mb(device)
+    return after, after - before
+
+class PrecisionCompareModule(pl.LightningModule):
+    """
+    Runs one model in fp32 and under bf16 autocast on each test batch, to check bf16 accuracy against fp32 over the
+    whole test set and time both. Run it with the Trainer at --precision 32, the bf16 pass does its own autocast.
+    The memory of each precision is measured on its own: per forward pass on gpu, in a separate process on the first
+    test batch on cpu
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.model_name = model.model_name
+        self.channels_last = False
+        self.precisions = {"fp32": "32", "bf16": "bf16"}
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        return channels_last_batch(batch) if self.channels_last else batch
+
+    def on_test_epoch_start(self):
+        self.test_metrics = {name: StreamingMetrics() for name in [*self.precisions, "persist"]}
+        self.seconds = {name: 0.0 for name in self.precisions}
+        self.sum_abs_diff = 0.0
+        self.max_abs_diff = 0.0
+        self.count = 0
+        self.memory = {name: {"peak_memory_mb": math.nan, "forward_memory_mb": math.nan} for name in self.precisions}
+        self.memory_inputs = None
+
+    def test_step(self, batch, batch_idx):
+        img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
+        if self.memory_inputs is None:
+            self.memory_inputs = [x.detach().cpu().clone() for x in [img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky]]
+        preds = {}
+        for name, precision in self.precisions.items():
+            if self.device.type == "cuda":
+                torch.cuda.synchronize(self.device)
+                torch.cuda.reset_peak_memory_stats(self.device)
+                allocated = torch.cuda.memory_allocated(self.device) / 2**20
+            start = time.perf_counter()
+            with autocast(self.device, precision):
+                preds[name] = self.model(img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky).float().reshape(-1)
+            if self.device.type == "cuda":
+                torch.cuda.synchronize(self.device)
+                peak = peak_memory_mb(self.device)
+                self.memory[name] = {"peak_memory_mb": max(peak, self.memory[name]["peak_memory_mb"]) if batch_idx else peak,
+                                     "forward_memory_mb": max(peak - allocated, self.memory[name]["forward_memory_mb"]) if batch_idx else peak - allocated}
+            self.seconds[name] += time.perf_counter() - start
+        diff = (preds["bf16"] - preds["fp32"]).abs()
+        self.sum_abs_diff += diff.sum().item()
+        self.max_abs_diff = max(self.max_abs_diff, diff.max().item())
+        self.count += diff.numel()
+        ghi_label = "globalcmp11physical" if "globalcmp11physical" in json_data[0]["inputs"][0] else "value"
+        for i, d in enumerate(json_data):
+            actual = target[i].item()
+            for name in self.precisions:
+                self.test_metrics[name].update(actual, preds[name][i].item())
+            self.test_metrics["persist"].update(actual, d["inputs"][0][ghi_label])
+
+    def measure_cpu_memory(self):
+        """Memory of each precision on the first test batch, each in its own process"""
+        model = copy.deepcopy(self.model).cpu()
+        context = multiprocessing.get_context("spawn")
+        for name, precision in self.precisions.items():
+            try:
+                with context.Pool(1) as pool:
+                    peak, forward = pool.apply(forward_peak_memory, (model, self.memory_inputs, precision))
+                self.memory[name] = {"peak_memory_mb": peak, "forward_memory_mb": forward}
+            except Exception as e:
+                print(f"Could not measure the memory of {name}: {e!r}")
+
+    def on_test_epoch_end(self):
+        if self.device.type != "cuda" and self.memory_inputs is not None:
+            self.measure_cpu_memory()
+        summary = self.summarise_test_metrics()
+        for name in self.precisions:
+            print(f"Test {name}: rmse={summary[name]['rmse']:.4g}, rmse_skill={summary[name]['rmse_skill']:.4f}, {summary[name]['samples_per_second']:.1f} samples/s, "
+                  f"peak memory {summary[name]['peak_memory_mb']:.0f}MB ({summary[name]['forward_memory_mb']:.0f}MB for the forward pass)")
+        print("bf16 vs fp32: " + ", ".join(f"{name}={value:.4g}" for name, value in summary["bf16_vs_fp32"].items()))
+
+    def summarise_test_metrics(self):
+        persist_metrics = self.test_metrics["persist"].compute()
+        summary = {"persist": persist_metrics}
+        for name in self.precisions:
+            summary[name] = self.test_metrics[name].compute()
+            summary[name].update({f"{metric}_skill": skill(persist_metrics[metric], summary[name][metric]) for metric in ["mae", "mse", "rmse"]})
+            summary[name]["seconds"] = self.seconds[name]
+            summary[name]["samples_per_second"] = self.count / self.seconds[name] if self.seconds[name] > 0 else math.nan
+            summary[name].update(self.memory[name])
+        summary["bf16_vs_fp32"] = {"mean_abs_diff": self.sum_abs_diff / self.count if self.count else math.nan,
+                                   "max_abs_diff": self.max_abs_diff,
+                                   "rmse_change": summary["bf16"]["rmse"] - summary["fp32"]["rmse"],
+                                   "speedup": self.seconds["fp32"] / self.seconds["bf16"] if self.seconds["bf16"] > 0 else math.nan}
+        summary["bf16_vs_fp32"]["memory_ratio"] = (summary["bf16"]["forward_memory_mb"] / summary["fp32"]["forward_memory_mb"]
+                                                   if summary["fp32"]["forward_memory_mb"] > 0 else math.nan)
+        return summary
+
+    def export_test_metrics(self, output_path):
+        with open(output_path, "w") as f:
+            json.dump({"model_name": self.model_name, **self.summarise_test_metrics()}, f, indent=2)
+
+def precision_compare_test(model, args, data):
+    """--compare_precision: fp32 vs bf16 over the test set in one pass, written to test_out_precision.json"""
+    trainer = pl.Trainer.from_argparse_args(args, precision=32, logger=False)
+    compare = optimise_model(PrecisionCompareModule(model), args.channels_last, args.compile)
+    trainer.test(compare, datamodule=data)
+    metrics_path = metrics_output_path(args.test_output)
+    output_path = metrics_path.with_name(metrics_path.name.replace("_metrics.json", "_precision.json"))
+    compare.export_test_metrics(output_path)
+    print(f"Precision comparison written to {output_path}")
+
+LR_FIND_FILE = "lr_find.json"
+
+def suggest_learning_rate(lrs, losses, skip_begin=10, skip_end=1):
+    """
+    Learning rates picked from a range test curve (smoothed loss against exponentially increasing lr)
+    steepest: where the loss falls fastest, Lightning's suggestion
+    valley: a tenth of the lr with the lowest loss, safely below where the loss starts to diverge
+    chosen: the smaller of the two
+    """
+    lrs = np.asarray(lrs, dtype=float)[skip_begin:len(lrs) - skip_end]
+    losses = np.asarray(losses, dtype=float)[skip_begin:len(losses) - skip_end]
+    finite = np.isfinite(losses)
+    lrs, losses = lrs[finite], losses[finite]
+    if len(losses) < 3:
+        return {"steepest": None, "valley": None, "chosen": None}
+    steepest = float(lrs[np.argmin(np.gradient(losses))])
+    valley = float(lrs[np.argmin(losses)] / 10)
+    return {"steepest": steepest, "valley": valley, "chosen": min(steepest, valley)}
+
+def set_learning_rate(model, args, learning_rate):
+    """Sets the lr on the model and in its saved hyperparameters, so checkpoints reload with the lr that was used"""
+    model.learning_rate = learning_rate
+    args.learning_rate = learning_rate
+    if "args" in model.hparams:
+        model.hparams["args"].learning_rate = learning_rate
+
+def lr_range_test(model, args, data, output_path=LR_FIND_FILE):
+    """
+    Trains for --lr_find_steps batches with the lr increasing exponentially from --lr_find_min to --lr_find_max
+    (stopping early once the loss diverges), then restores the initial weights.
+    The curve and the suggestions are written to lr_find.json, with a plot in lr_find.png
+    :return: the chosen learning rate, or None if the curve was too short to pick one
+    """
+    trainer = pl.Trainer.from_argparse_args(args, logger=False, enable_checkpointing=False, callbacks=[])
+    model.learning_rate = args.lr_find_min
+    lr_finder = trainer.tuner.lr_find(model, datamodule=data, min_lr=args.lr_find_min, max_lr=args.lr_find_max,
+                                      num_training=args.lr_find_steps, mode="exponential", update_attr=False)
+    suggestions = suggest_learning_rate(lr_finder.results["lr"], lr_finder.results["loss"])
+    print("Learning rate range test: " + ", ".join(f"{name}={value}" for name, value in suggestions.items()))
+    with open(output_path, "w") as f:
+        json.dump({"time": str(datetime.datetime.now()),
+                   "model_name": model.model_name,
+                   "min_lr": args.lr_find_min,
+                   "max_lr": args.lr_find_max,
+                   "num_training": args.lr_find_steps,
+                   **suggestions,
+                   "lr": [float(x) for x in lr_finder.results["lr"]],
+                   "loss": [float(x) for x in lr_finder.results["loss"]]}, f, indent=2)
+    fig = lr_finder.plot()
+    for name, value in suggestions.items():
+        if name != "chosen" and value is not None:
+            fig.axes[0].axvline(value, linestyle="--", color="red" if value == suggestions["chosen"] else "grey", label=name)
+    fig.axes[0].legend()
+    fig.savefig(Path(output_path).with_suffix(".png"))
+    return suggestions["chosen"]
+
+def auto_learning_rate(model, args, data, output_path=LR_FIND_FILE):
+    """
+    --learning_rate auto: runs the range test, or reuses the lr a previous attempt of this run picked,
+    and trains with the chosen lr
+    """
+    if Path(output_path).exists():
+        with open(output_path) as f:
+            learning_rate = json.load(f)["chosen"]
+        print(f"Using the learning rate from {output_path}: {learning_rate}")
+    else:
+        learning_rate = lr_range_test(model, args, data, output_path)
+    if learning_rate is None:
+        raise ValueError(f"The learning rate range test could not pick a learning rate, see {output_path}, try a wider --lr_find_min/--lr_find_max or more --lr_find_steps")
+    set_learning_rate(model, args, learning_rate)
+
+BATCH_SIZE_FILE = "batch_size_search.json"
+
+def memory_budget_mb(device):
+    """Default --memory_budget_mb, 90% of the gpu or 80% of the machine's physical memory"""
+    if device.type == "cuda":
+        return 0.9 * torch.cuda.get_device_properties(device).total_memory / 2**20
+    return 0.8 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20
+
+def peak_memory_mb(device):
+    """Peak memory of this process, gpu allocations on gpu, max rss on cpu (it never goes down, so trials must grow)"""
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+TRIAL_LEARNING_RATE = 1e-5
+
+def throughput_trial(model, data, batch_size, device, precision, steps, warmup=3):
+    """
+    Trains model for warmup + steps batches of batch_size from the real train set
+    :return: (train samples/s over the timed steps, peak memory in MB)
+    """
+    if steps < 1:
+        raise ValueError(f"A throughput trial needs at least one timed batch, got --batch_search_steps {steps}")
+    data.batch_size = batch_size
+    data.setup()
+    learning_rate = model.learning_rate
+    if learning_rate == "auto":
+        # --learning_rate auto is resolved after the search, throughput does not depend on the lr
+        model.learning_rate = TRIAL_LEARNING_RATE
+    try:
+        optimizer = model.configure_optimizers()
+    finally:
+        model.learning_rate = learning_rate
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    batches = iter(data.train_dataloader())
+    samples = 0
+    start = None
+    for i in range(warmup + steps):
+        if i == warmup:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+        batch = [x.to(device) if torch.is_tensor(x) else x for x in next(batches)]
+        if model.channels_last:
+            batch = channels_last_batch(batch)
+        img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
+        optimizer.zero_grad()
+        with autocast(device, precision):
+            loss = F.mse_loss(model(img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky).float(), target)
+        loss.backward()
+        optimizer.step()
+        samples += len(target) if i >= warmup else 0
+    del batches # Shuts down this trial's loader workers
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return samples / (time.perf_counter() - start), peak_memory_mb(device)
+
+def set_batch_size(model, args, data, batch_size):
+    """Sets the batch size on the model, the data and in the saved hyperparameters, so the run can be reproduced"""
+    model.batch_size = batch_size
+    args.batch_size = batch_size
+    data.batch_size = batch_size
+    if "args" in model.hparams:
+        model.hparams["args"].batch_size = batch_size
+
+def batch_size_search(model, args, data, output_path=BATCH_SIZE_FILE, tolerance=0.05):
+    """
+    --batch_size_search: trains --batch_search_steps batches at --batch_size, then doubling up to --max_batch_size,
+    stopping at the first size over --memory_budget_mb or out of memory, and picks the smallest size within 5% of the
+    best train samples/s (smaller batches need less lr retuning). The weights are restored afterwards.
+    With --scale_lr the learning rate is scaled linearly with the batch size (not with --learning_rate auto, the
+    range test then runs at the chosen size).
+    The trials go to batch_size_search.json, a rerun of the same run reuses its choice.
+    """
+    if Path(output_path).exists():
+        with open(output_path) as f:
+            record = json.load(f)
+        print(f"Using the batch size from {output_path}: {record['batch_size']}")
+    else:
+        device = torch.device("cuda" if args.accelerator in ["gpu", "cuda"] and torch.cuda.is_available() else "cpu")
+        budget = args.memory_budget_mb if args.memory_budget_mb is not None else memory_budget_mb(device)
+        state = copy.deepcopy(model.state_dict())
+        model.to(device)
+        model.train()
+        trials = []
+        batch_size = args.batch_size
+        while batch_size <= args.max_batch_size:
+            try:
+                samples_per_second, memory = throughput_trial(model, data, batch_size, device, args.precision, args.batch_search_steps)
+            except RuntimeError as e:
+                if "out of memory" not in str(e):
+                    raise
+                trials.append({"batch_size": batch_size, "status": "out of memory"})
+                break
+            except StopIteration:
+                trials.append({"batch_size": batch_size, "status": "train set too small"})
+                break
+            over = memory > budget
+            trials.append({"batch_size": batch_size, "samples_per_second": samples_per_second, "peak_memory_mb": memory,
+                           "status": "over memory budget" if over else "ok"})
+            print(f"Batch size {batch_size}: {samples_per_second:.1f} samples/s, peak memory {memory:.0f}MB")
+            if over:
+                break
+            batch_size *= 2
+        model.load_state_dict(state)
+        model.cpu()
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+        ok = [trial for trial in trials if trial["status"] == "ok"]
+        best = max(trial["samples_per_second"] for trial in ok) if ok else math.nan
+        chosen = min((trial["batch_size"] for trial in ok if trial["samples_per_second"] >= (1 - tolerance) * best), default=args.batch_size)
+        record = {"time": str(datetime.datetime.now()),
+                  "device": str(device),
+                  "precision": str(args.precision),
+                  "memory_budget_mb": budget,
+                  "base_batch_size": args.batch_size,
+                  "batch_size": chosen,
+                  "base_learning_rate": model.learning_rate,
+                  "learning_rate": model.learning_rate * chosen / args.batch_size if args.scale_lr and model.learning_rate != "auto" else model.learning_rate,
+                  "trials": trials}
+        with open(output_path, "w") as f:
+            json.dump(record, f, indent=2)
+        print(f"Chose batch size {chosen}, see {output_path}")
+    set_batch_size(model, args, data, record["batch_size"])
+    if record["learning_rate"] != model.learning_rate:
+        print(f"Scaling the learning rate from {model.learning_rate} to {record['learning_rate']}")
+        set_learning_rate(model, args, record["learning_rate"])
+
+VAL_HISTORY_FILE = "val_history.json"
+PRUNE_FILE = "prune.json"
+
+class ValLossHistory(pl.Callback):
+    """
+    Writes the val_loss of every epoch to val_history.json in the run folder, so a sweep controller
+    (resources/asha.py) can compare runs, and stops training when the controller writes prune.json
+    """
+    def __init__(self, history_path=VAL_HISTORY_FILE, prune_path=PRUNE_FILE):
+        self.history_path = Path(history_path)
+        self.prune_path = Path(prune_path)
+        self.history = {}
+        if self.history_path.exists():
+            with open(self.history_path) as f:
+                self.history = json.load(f)
+
+    def on_validation_epoch_end(self, trainer, pl_module):
+        if trainer.sanity_checking or "val_loss" not in trainer.callback_metrics:
+            return
+        self.history[str(trainer.current_epoch)] = trainer.callback_metrics["val_loss"].item()
+        # Write then rename, so the controller never reads a half written file
+        tmp_path = self.history_path.with_name(f".{self.history_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.history, f, indent=2)
+        os.replace(tmp_path, self.history_path)
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        if self.prune_path.exists():
+            print(f"Found {self.prune_path}, stopping training")
+            trainer.should_stop = True
+
+STEP_TIMING_FILE = "step_timing.json"
+
+class StepTimer(pl.Callback):
+    """
+    Times each training batch in stages, to tell a data loader bound run from a compute bound one:
+        data_wait   end of the previous batch until the next batch is fetched
+        h2d         host to device transfer (SolpredModule's batch transfer hooks, otherwise counted in data_wait)
+        forward     training_step up to the loss
+        backward    loss.backward()
+        optimizer   optimizer step and the rest of the batch's bookkeeping
+    On gpu every mark synchronises the device so time is attributed to the right stage, that costs some speed,
+    so this is only added by make_callbacks with --step_timing.
+    Percentiles are logged every epoch (step_time/...) and written to step_timing.json in the run folder.
+    """
+    STAGES = ["data_wait", "h2d", "forward", "backward", "optimizer"]
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self, output_path=STEP_TIMING_FILE, warmup=5):
+        self.output_path = Path(output_path)
+        self.warmup = warmup
+        self.times = {}
+        self.batches = 0
+        self.epochs = []
+        self.last = None
+        self.current = {}
+
+    def mark(self, pl_module, name):
+        if not pl_module.trainer.training:
+            return
+        if pl_module.device.type == "cuda":
+            torch.cuda.synchronize(pl_module.device)
+        self.current[name] = time.perf_counter()
+
+    def on_fit_start(self, trainer, pl_module):
+        if hasattr(pl_module, "step_timer"):
+            pl_module.step_timer = self
+
+    def on_fit_end(self, trainer, pl_module):
+        if hasattr(pl_module, "step_timer"):
+            pl_module.step_timer = None
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.times = {stage: [] for stage in self.STAGES + ["step"]}
+        self.mark(pl_module, "end")
+        self.last = self.current["end"]
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx, unused=0):
+        self.mark(pl_module, "start")
+
+    def on_validation_end(self, trainer, pl_module):
+        # Validation in the middle of an epoch is not data wait
+        self.last = time.perf_counter()
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        self.mark(pl_module, "before_backward")
+
+    def on_after_backward(self, trainer, pl_module):
+        self.mark(pl_module, "after_backward")
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, unused=0):
+        self.mark(pl_module, "end")
+        marks = self.current
+        self.current = {}
+        self.batches += 1
+        if self.batches <= self.warmup or "before_backward" not in marks:
+            self.last = marks["end"]
+            return
+        fetched = marks.get("fetched", marks["start"])
+        transferred = marks.get("transferred", fetched)
+        stage_times = {"data_wait": fetched - self.last,
+                       "h2d": transferred - fetched,
+                       "forward": marks["before_backward"] - marks["start"],
+                       "backward": marks.get("after_backward", marks["before_backward"]) - marks["before_backward"],
+                       "optimizer": marks["end"] - marks.get("after_backward", marks["before_backward"]),
+                       "step": marks["end"] - self.last}
+        for stage, seconds in stage_times.items():
+            self.times[stage].append(seconds)
+        self.last = marks["end"]
+
+    def summarise(self):
+        total = sum(self.times["step"])
+        summary = {"batches": len(self.times["step"]), "seconds": total}
+        for stage in self.STAGES + ["step"]:
+            times = np.asarray(self.times[stage])
+            if len(times) == 0:
+                continue
+            summary[stage] = {"mean_ms": 1000 * float(times.mean()),
+                              **{f"p{p}_ms": 1000 * float(np.percentile(times, p)) for p in self.PERCENTILES},
+                              "fraction": float(times.sum() / total) if total > 0 else math.nan}
+        return summary
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        summary = self.summarise()
+        if summary["batches"] == 0:
+            return
+        summary = {"epoch": trainer.current_epoch, **summary}
+        print(f"Step timing epoch {trainer.current_epoch}: " + ", ".join(f"{stage} {summary[stage]['p50_ms']:.1f}ms ({100 * summary[stage]['fraction']:.0f}%)" for stage in self.STAGES))
+        pl_module.log_dict({f"step_time/{stage}_{name}": value for stage in self.STAGES + ["step"] for name, value in summary[stage].items()},
+                           on_step=False, on_epoch=True, batch_size=1)
+        self.epochs.append(summary)
+        with open(self.output_path, "w") as f:
+            json.dump({"stages": self.STAGES, "warmup_batches": self.warmup, "epochs": self.epochs}, f, indent=2)
+
+RUN_COST_FILE = "run_cost.json"
+
+def count_parameters(model):
+    return {"parameters": sum(p.numel() for p in model.parameters()),
+            "trainable_parameters": sum(p.numel() for p in model.parameters() if p.requires_grad)}
+
+class RunCost(pl.Callback):
+    """
+    Records what a run cost in run_cost.json in the run folder, to compare cost against accuracy across a sweep
+    (src/plotting/cost_report.py): epochs, training wall time and samples/s (summed over resumed sessions,
+    validation excluded from samples/s), parameter count, test samples/s and the inference latency of one sample
+    """
+    def __init__(self, output_path=RUN_COST_FILE, latency_repeats=20):
+        self.output_path = Path(output_path)
+        self.latency_repeats = latency_repeats
+        self.record = {}
+        if self.output_path.exists():
+            with open(self.output_path) as f:
+                self.record = json.load(f)
+        self.start = None
+        self.samples = 0
+        self.validation_seconds = 0.0
+        self.validation_start = None
+        self.latency_batch = None
+        self.precision = 32
+
+    def write(self, pl_module, trainer):
+        model = pl_module.models[0] if isinstance(pl_module, MultiCheckpointModule) else pl_module
+        self.record.update({"model_name": getattr(pl_module, "model_name", None),
+                            "device": str(pl_module.device),
+                            "precision": str(trainer.precision),
+                            **count_parameters(model)})
+        if isinstance(pl_module, SharedDataModule):
+            # The cost of every member together, write_members splits it between them
+            self.record["members"] = pl_module.labels
+        with open(self.output_path, "w") as f:
+            json.dump(self.record, f, indent=2)
+
+    def write_members(self, shared, tested, trainer):
+        """
+        Splits the cost of a shared data run (shared_data_train) between its members, into run_cost.json in each
+        member's folder: training and validation time in proportion to the samples each member trained on, test time
+        evenly between the members tested, and each member's own parameter count and latency
+        """
+        total_samples = sum(shared.member_samples)
+        for i, label in enumerate(shared.labels):
+            share = shared.member_samples[i] / total_samples if total_samples > 0 else 0.0
+            train_seconds = self.record.get("train_seconds", math.nan) * share
+            validation_seconds = self.record.get("validation_seconds", math.nan) * share
+            record = {"model_name": shared.members[i].model_name,
+                      "device": str(shared.device),
+                      "precision": str(trainer.precision),
+                      "shared_with": shared.labels,
+                      "epochs": shared.member_epochs[i],
+                      "train_seconds": train_seconds,
+                      "validation_seconds": validation_seconds,
+                      "train_samples": shared.member_samples[i],
+                      "train_samples_per_second": shared.member_samples[i] / (train_seconds - validation_seconds) if train_seconds > validation_seconds else math.nan,
+                      "batch_size": shared.batch_size,
+                      **count_parameters(shared.members[i])}
+            if tested is not None and label in tested.labels and "test_seconds" in self.record:
+                test_seconds = self.record["test_seconds"] / len(tested.labels)
+                record.update({"test_seconds": test_seconds,
+                               "test_samples": self.record["test_samples"],
+                               "test_samples_per_second": self.record["test_samples"] / test_seconds if test_seconds > 0 else math.nan})
+                if self.latency_batch is not None:
+                    record["latency_ms"] = 1000 * self.latency(tested.models[tested.labels.index(label)])
+            shared.member_dirs[i].mkdir(parents=True, exist_ok=True)
+            with open(shared.member_dirs[i] / RUN_COST_FILE, "w") as f:
+                json.dump(record, f, indent=2)
+
+    def on_fit_start(self, trainer, pl_module):
+        self.start = time.perf_counter()
+        self.samples = 0
+        self.validation_seconds = 0.0
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, unused=0):
+        self.samples += len(batch[2])
+
+    def on_validation_start(self, trainer, pl_module):
+        self.validation_start = time.perf_counter()
+
+    def on_validation_end(self, trainer, pl_module):
+        if self.validation_start is not None:
+            self.validation_seconds += time.perf_counter() - self.validation_start
+            self.validation_start = None
+
+    def on_fit_end(self, trainer, pl_module):
+        if self.start is None:
+            return
+        seconds = time.perf_counter() - self.start
+        self.record["train_sessions"] = self.record.get("train_sessions", 0) + 1
+        self.record["epochs"] = trainer.current_epoch
+        self.record["train_seconds"] = self.record.get("train_seconds", 0.0) + seconds
+        self.record["validation_seconds"] = self.record.get("validation_seconds", 0.0) + self.validation_seconds
+        self.record["train_samples"] = self.record.get("train_samples", 0) + self.samples
+        train_only = self.record["train_seconds"] - self.record["validation_seconds"]
+        self.record["train_samples_per_second"] = self.record["train_samples"] / train_only if train_only > 0 else math.nan
+        self.record["batch_size"] = getattr(pl_module, "batch_size", None)
+        self.write(pl_module, trainer)
+        self.start = None
+
+    def on_test_start(self, trainer, pl_module):
+        self.start = time.perf_counter()
+        self.samples = 0
+        self.latency_batch = None
+        self.precision = trainer.precision
+
+    def on_test_batch_start(self, trainer, pl_module, batch, batch_idx, dataloader_idx=0):
+        if self.latency_batch is None:
+            img, in_data, target, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky, json_data = batch
+            self.latency_batch = [x[:1].clone() for x in [img, in_data, diffuse_direct_irradiance, most_recent_clear_sky, target_clear_sky]]
+
+    def on_test_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx=0):
+        self.samples += len(batch[2])
+
+    def on_test_end(self, trainer, pl_module):
+        seconds = time.perf_counter() - self.start
+        self.record["test_seconds"] = seconds
+        self.record["test_samples"] = self.samples
+        self.record["test_samples_per_second"] = self.samples / seconds if seconds > 0 else math.nan
+        if self.latency_batch is not None:
+            model = pl_module.models[0] if isinstance(pl_module, MultiCheckpointModule) else pl_module
+            self.record["latency_ms"] = 1000 * self.latency(model)
+        self.write(pl_module, trainer)
+
+    def latency(self, model):
+        """Median seconds for one sample's forward pass, after a few warm up passes"""
+        times = []
+        with torch.no_grad():
+            for i in range(self.latency_repeats + 3):
+                if model.device.type == "cuda":
+                    torch.cuda.synchronize(model.device)
+                start = time.perf_counter()
+                with autocast(model.device, self.precision):
+                    model(*self.latency_batch)
+                if model.device.type == "cuda":
+                    torch.cuda.synchronize(model.device)
+                if i >= 3:
+                    times.append(time.perf_counter() - start)
+        return float(np.median(times))
+
 def make_callbacks(args):
     x = [
         pl.callbacks.EarlyStopping(
@@ -96,7 +1044,11 @@ def make_callbacks(args):
             dirpath="./",
             filename="latest_best",
         ),
+        ValLossHistory(),
+        RunCost(),
     ]
+    if args.step_timing:
+        x.append(StepTimer())
     if args.use_stochastic_weight_averaging:
         x = x.append(pl.callbacks.StochasticWeightAveraging(swa_epoch_start=2))
     return x
@@ -108,6 +1060,15 @@ def test_phase(model, trainer, data, test_output):
     trainer.test(model, datamodule=data)
     print("exporting")
     model.export_test_csv(test_output)
+    model.export_test_metrics(metrics_output_path(test_output))
+
+def metrics_output_path(test_output):
+    """test_out.csv.gz -> test_out_metrics.json, next to the test csv"""
+    test_output = Path(test_output)
+    name = test_output.name
+    for suffix in [".gz", ".csv"]:
+        name = name[:-len(suffix)] if name.endswith(suffix) else name
+    return test_output.with_name(name + "_metrics.json")
 
 def main(args, model):
     data = SolpredDataModule(args)
@@ -115,8 +1076,30 @@ def main(args, model):
         print("Visualising")
         data.setup()
         model.visualise_activations(data.test_dataloader())
+    elif args.compare_precision:
+        print("Comparing bf16 with fp32 on the test set")
+        precision_compare_test(model, args, data)
+    elif args.lr_find:
+        print("Running the learning rate range test only")
+        lr_range_test(optimise_model(model, args.channels_last, args.compile), args, data)
+    elif args.learning_rates:
+        shared_data_train(type(model), args, data)
     else:
+        optimise_model(model, args.channels_last, args.compile)
+        if args.batch_size_search and not args.test and not args.load_checkpoint:
+            batch_size_search(model, args, data)
+        elif Path(BATCH_SIZE_FILE).exists():
+            # Resuming or testing a run whose batch size was searched
+            with open(BATCH_SIZE_FILE) as f:
+                set_batch_size(model, args, data, json.load(f)["batch_size"])
+        if model.learning_rate == "auto":
+            auto_learning_rate(model, args, data)
         trainer = pl.Trainer.from_argparse_args(args, callbacks=make_callbacks(args))
+        if args.eval_checkpoints:
+            multi_checkpoint_test(type(model), args.eval_checkpoints, trainer, data, args.test_output,
+                                  channels_last=args.channels_last, compile=args.compile)
+            print("Main Done")
+            return
         # Run Train
         if not args.test:
             if args.load_checkpoint and args.resume_train:
@@ -130,6 +1113,10 @@ def main(args, model):
                 trainer.fit(model, data)
         else:
             print("Skipping Training")
+        if Path(PRUNE_FILE).exists() and not args.test:
+            print(f"Pruned by the sweep controller, see {PRUNE_FILE}, skipping testing")
+            print("Main Done")
+            return
         # Run Test
         test_phase(model, trainer, data, args.test_output)
     print("Main Done")
@@ -145,6 +1132,22 @@ def make_parser():
     parser.add_argument('--test_output', type=str, default='test_out.csv.gz')
     parser.add_argument('--stopping_patience', type=int, default=10, help="Early Stopping Patience")
     parser.add_argument('--use_stochastic_weight_averaging', action='store_true', help="Run with SWA turned on")
+    parser.add_argument('--eval_checkpoints', type=Path, nargs='+', help="Only run inference, for all of these checkpoints in one pass over the test set")
+    parser.add_argument('--learning_rates', type=str, nargs='+', help="Train one model per learning rate on a shared data stream (overrides --learning_rate)")
+    parser.add_argument('--channels_last', action='store_true', help="Run the model and its input images in channels_last memory format")
+    parser.add_argument('--compile', action='store_true', help="channels_last, and compile the model with torch.compile (torch 2+)")
+    parser.add_argument('--compare_precision', action='store_true', help="Only run inference, in fp32 and under bf16 autocast, and compare them (use with --load_checkpoint)")
+    parser.add_argument('--batch_size_search', action='store_true', help="Pick the batch size with the best train samples/s, from --batch_size up, see batch_size_search")
+    parser.add_argument('--max_batch_size', type=int, default=512, help="Largest batch size the search tries")
+    parser.add_argument('--memory_budget_mb', type=float, default=None, help="Batch size search memory limit, defaults to 90%% of the gpu or 80%% of ram")
+    parser.add_argument('--batch_search_steps', type=int, default=20, help="Timed batches per batch size")
+    parser.add_argument('--scale_lr', action='store_true', help="Scale the learning rate linearly with the batch size the search picks")
+    parser.add_argument('--step_timing', action='store_true', help="Time data wait, transfer, forward, backward and optimizer per batch, see StepTimer")
+    parser.add_argument('--lr_find', action='store_true', help="Only run a learning rate range test, the curve is written to lr_find.json")
+    parser.add_argument('--lr_find_min', type=float, default=1e-8, help="Learning rate range test start")
+    parser.add_argument('--lr_find_max', type=float, default=1e-2, help="Learning rate range test end")
+    parser.add_argument('--lr_find_steps', type=int, default=300, help="Learning rate range test length in batches")
+    parser.add_argument('--member_dir', type=str, default="lr_{lr}", help="Directory for each --learning_rates model's checkpoint and test output, {lr} is replaced")
     return parser
 
 if __name__ == '__main__':
@@ -0,0 +1,242 @@
+"""
+Local sweep scheduler, an alternative to the launch.sh written for the local engine
+
+Reads the run-params.json that launcher/make-run-folders! writes into every run folder and runs the runs
+in a fixed number of concurrent slots, each with an explicit CPU budget: the slot's cores are pinned with
+sched_setaffinity, torch gets --threads intra-op threads (OMP_NUM_THREADS/MKL_NUM_THREADS) and the data
+loader gets --workers processes.  What to run is decided as in launcher/local determine-script:
+
+    output file exists        skip
+    prune.json                skip, the run was pruned by asha.py
+    started_testing.json      --load_checkpoint latest_best.ckpt --test
+    latest_best.ckpt exists   --load_checkpoint latest_best.ckpt --resume_train
+    otherwise                 train from scratch
+
+Each run's output goes to run.log in its folder, and its wall time to run-timing.json in its folder
+and to sweep-timings.jsonl in the current directory.
+
+python3 sweep_scheduler.py conv-run --threads 6 --workers 2 --accelerator cpu --precision 32
+python3 sweep_scheduler.py conv-run --slots 2 --threads 8 --workers 4 --dry-run
+python3 sweep_scheduler.py conv-run --threads 6 --workers 2 -- --max_epochs 20
+python3 sweep_scheduler.py conv-run --threads 6 --workers 2 --asha    # prune with asha.py while the sweep runs
+"""
+# Standard Library Modules
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from queue import Queue
+import argparse
+import datetime
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+# Local Modules
+import asha
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "latest_best.ckpt"
+TEST_STARTED_FILE = "started_testing.json"
+TIMING_FILE = "run-timing.json"
+LOG_FILE = "run.log"
+
+
+def find_runs(paths) -> list:
+    '''
+    :param paths: run-params.json files, or directories to search for them
+    :return: list of (run folder, run params), in a stable order
+    '''
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.rglob("run-params.json")) if path.is_dir() else [path]
+    runs = []
+    for path in files:
+        with open(path) as f:
+            runs.append((path.parent, json.load(f)))
+    return runs
+
+
+def skip_reason(run_folder: Path, params: dict, force_test: bool = False) -> str:
+    '''Why a run is skipped, or None if it should run'''
+    if (run_folder / params["out-file"]).exists():
+        return f"{run_folder / params['out-file']} already exists"
+    if (run_folder / asha.PRUNE_FILE).exists() and not force_test:
+        return f"pruned by asha.py ({run_folder / asha.PRUNE_FILE})"
+    return None
+
+
+def determine_mode(run_folder: Path, params: dict, force_test: bool = False) -> str:
+    '''Same filesystem checks as determine-script: "skip", "test", "resume" or "train"'''
+    if skip_reason(run_folder, params, force_test) is not None:
+        return "skip"
+    if (run_folder / TEST_STARTED_FILE).exists() or force_test:
+        return "test"
+    if (run_folder / CHECKPOINT_FILE).exists():
+        return "resume"
+    return "train"
+
+
+def set_option(command: list, option: str, value) -> list:
+    '''Replaces the value of an option in a command, or appends the option if the command does not have it'''
+    if value is None:
+        return command
+    if option in command and command.index(option) + 1 < len(command):
+        command[command.index(option) + 1] = str(value)
+    else:
+        command += [option, str(value)]
+    return command
+
+
+def make_command(params: dict, mode: str, workers: int, accelerator: str, precision: str, extra_args: list) -> list:
+    '''
+    The run's python-command, with the slot's loader workers, the mode's checkpoint arguments and, if given,
+    the accelerator and precision in place of the run's own.
+    '''
+    command = shlex.split(params["python-command"].replace("$@", ""))
+    set_option(command, "--num_workers", workers)
+    set_option(command, "--accelerator", accelerator)
+    set_option(command, "--precision", precision)
+    if mode == "test":
+        command += ["--load_checkpoint", CHECKPOINT_FILE, "--test"]
+    elif mode == "resume":
+        command += ["--load_checkpoint", CHECKPOINT_FILE, "--resume_train"]
+    return command + list(extra_args)
+
+
+def slot_cpus(n_slots: int, cpus_per_slot: int) -> list:
+    '''Disjoint sets of the CPUs this process may use, one per slot (shared round robin if there are not enough)'''
+    available = sorted(os.sched_getaffinity(0))
+    if n_slots * cpus_per_slot > len(available):
+        logger.warning(f"{n_slots} slots of {cpus_per_slot} cpus needs {n_slots * cpus_per_slot} cpus, only {len(available)} available, slots will share cpus")
+    return [sorted({available[j % len(available)] for j in range(i * cpus_per_slot, (i + 1) * cpus_per_slot)}) for i in range(n_slots)]
+
+
+class Scheduler:
+    '''
+    Runs the runs of a sweep in concurrent slots, see the module docstring.
+    '''
+    def __init__(self, slots: int, threads: int, workers: int, accelerator: str = None, precision: str = None,
+                 extra_args: list = (), timings_path=Path("sweep-timings.jsonl"), dry_run: bool = False):
+        self.threads = threads
+        self.workers = workers
+        self.accelerator = accelerator
+        self.precision = precision
+        self.extra_args = list(extra_args)
+        self.timings_path = Path(timings_path)
+        self.dry_run = dry_run
+        self.slots = Queue()
+        for i, cpus in enumerate(slot_cpus(slots, threads + workers)):
+            self.slots.put((i, cpus))
+        self.n_slots = slots
+
+    def run_env(self) -> dict:
+        env = dict(os.environ)
+        for name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+            env[name] = str(self.threads)
+        return env
+
+    def run_one(self, run) -> dict:
+        '''Thread function: waits for a free slot, then runs one run in it'''
+        run_folder, params, mode = run
+        slot, cpus = self.slots.get()
+        try:
+            command = make_command(params, mode, self.workers, self.accelerator, self.precision, self.extra_args)
+            logger.info(f"slot {slot}: {mode} {run_folder}")
+            logger.debug(" ".join(command))
+            start = datetime.datetime.now()
+            start_time = time.perf_counter()
+            returncode = None
+            if not self.dry_run:
+                with open(run_folder / LOG_FILE, "a") as log:
+                    returncode = subprocess.run(command, cwd=run_folder, env=self.run_env(), stdout=log, stderr=subprocess.STDOUT,
+                                                preexec_fn=lambda: os.sched_setaffinity(0, cpus)).returncode
+            record = {"run_folder": str(run_folder),
+                      "job_name": params.get("job-name"),
+                      "mode": mode,
+                      "slot": slot,
+                      "cpus": cpus,
+                      "threads": self.threads,
+                      "workers": self.workers,
+                      "start": str(start),
+                      "wall_seconds": time.perf_counter() - start_time,
+                      "returncode": returncode,
+                      "command": command}
+        finally:
+            self.slots.put((slot, cpus))
+        if not self.dry_run:
+            with open(run_folder / TIMING_FILE, "w") as f:
+                json.dump(record, f, indent=2)
+            log_level = logging.INFO if returncode == 0 else logging.WARNING
+            logger.log(log_level, f"slot {slot}: {run_folder} finished in {record['wall_seconds']:.0f}s with return code {returncode}")
+        return record
+
+    def run(self, runs: list, force_test: bool = False) -> list:
+        '''
+        :param runs: list of (run folder, run params) from find_runs
+        :return: timing records of the runs that were started
+        '''
+        jobs = []
+        for run_folder, params in runs:
+            reason = skip_reason(run_folder, params, force_test)
+            if reason is not None:
+                logger.info(f"Skipping {run_folder}, {reason}")
+            else:
+                jobs.append((run_folder, params, determine_mode(run_folder, params, force_test)))
+        logger.info(f"Running {len(jobs)} of {len(runs)} runs in {self.n_slots} slots of {self.threads} threads and {self.workers} workers")
+        records = []
+        with ThreadPoolExecutor(max_workers=self.n_slots) as executor:
+            for record in executor.map(self.run_one, jobs):
+                records.append(record)
+                if not self.dry_run:
+                    with open(self.timings_path, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+        return records
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the runs of a sweep locally in concurrent slots with explicit CPU budgets")
+    parser.add_argument('paths', type=Path, nargs='+', help="Run folders (searched for run-params.json) or run-params.json files")
+    parser.add_argument('--threads', type=int, default=4, help="Torch intra-op threads per slot")
+    parser.add_argument('--workers', type=int, default=2, help="Data loader worker processes per slot")
+    parser.add_argument('--slots', type=int, default=None, help="Concurrent runs, defaults to as many as the CPUs allow")
+    parser.add_argument('--accelerator', type=str, default=None, help="Replaces the accelerator in the run's python-command, kept as launched if not given")
+    parser.add_argument('--precision', type=str, default=None, help="Replaces the precision in the run's python-command, kept as launched if not given")
+    parser.add_argument('--force-test', action='store_true', help="Test every unfinished run from its checkpoint, as force-test does")
+    parser.add_argument('--timings', type=Path, default=Path("sweep-timings.jsonl"), help="Jsonl file the timing of every run is appended to")
+    parser.add_argument('--dry-run', action='store_true', help="Log what would be run without running it")
+    parser.add_argument('--asha', action='store_true', help="Run the asha.py controller over the same runs while they train")
+    parser.add_argument('--asha-eta', type=int, default=3, help="asha.py --eta")
+    parser.add_argument('--asha-min-epochs', type=int, default=2, help="asha.py --min-epochs")
+    parser.add_argument('--asha-interval', type=float, default=60, help="Seconds between asha.py checks")
+    # Everything after -- is passed on to every run
+    argv = sys.argv[1:]
+    extra_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv[:argv.index("--")] if "--" in argv else argv)
+    args.extra_args = extra_args
+    return args
+
+
+def main(args):
+    slots = args.slots if args.slots is not None else max(1, len(os.sched_getaffinity(0)) // (args.threads + args.workers))
+    scheduler = Scheduler(slots, args.threads, args.workers, args.accelerator, args.precision, args.extra_args, args.timings, args.dry_run)
+    controller_thread = None
+    done = threading.Event()
+    if args.asha:
+        controller = asha.Controller(args.paths, args.asha_eta, args.asha_min_epochs, dry_run=args.dry_run)
+        controller_thread = threading.Thread(target=controller.watch, args=(args.asha_interval, done.is_set), daemon=True)
+        controller_thread.start()
+    records = scheduler.run(find_runs(args.paths), args.force_test)
+    done.set()
+    failed = [r for r in records if r["returncode"] not in (0, None)]
+    logger.info(f"Finished {len(records)} runs, {len(failed)} failed, {sum(r['wall_seconds'] for r in records):.0f}s of run time")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main(parse_args())
@@ -0,0 +1,84 @@
+"""
+Import-time benchmark for the plotting entry points
+
+Each script is imported (not run) in a fresh interpreter, started from an empty temporary directory
+so that any dependency on the current working directory shows up as a failure.
+
+python3 bench-imports.py                               # every *.py in this folder
+python3 bench-imports.py json-to-interact.py plotly_tools.py --repeats 10 --budget 1.5 --output import-times.json
+"""
+# Standard Library Modules
+from pathlib import Path
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import json
+
+PLOTTING_DIR = Path(__file__).resolve().parent
+
+# Imports the file as a module named "bench_target", so the __main__ block doesn't run
+IMPORT_SNIPPET = """
+import sys, time, importlib.util
+sys.path.insert(0, {plotting_dir!r})
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("bench_target", {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(path, repeats, cwd):
+    '''
+    :return: list of import times in seconds, or the error output if the import failed
+    '''
+    times = []
+    for _ in range(repeats):
+        snippet = IMPORT_SNIPPET.format(plotting_dir=str(PLOTTING_DIR), path=str(path))
+        result = subprocess.run([sys.executable, "-c", snippet], cwd=cwd, capture_output=True, text=True)
+        if result.returncode != 0:
+            return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the plotting entry points")
+    parser.add_argument('scripts', type=Path, nargs='*', help="Scripts to benchmark, defaults to every *.py in the plotting folder")
+    parser.add_argument('--repeats', type=int, default=5, help="Fresh interpreters per script, the median is reported")
+    parser.add_argument('--budget', type=float, default=None, help="Exit non-zero if any median import time is over this many seconds")
+    parser.add_argument('--output', type=Path, default=None, help="Optional json file to write the results to")
+    return parser.parse_args()
+
+
+def main(args):
+    scripts = [p.resolve() for p in args.scripts] or sorted(p for p in PLOTTING_DIR.glob("*.py") if p.name != Path(__file__).name)
+    results = {}
+    over_budget = False
+    with tempfile.TemporaryDirectory() as cwd:
+        for path in scripts:
+            times = time_import(path, args.repeats, cwd)
+            if isinstance(times, str):
+                results[path.name] = {"error": times}
+                over_budget = True
+                print(f"{path.name:30s} FAILED: {times}")
+                continue
+            median = statistics.median(times)
+            results[path.name] = {"median_seconds": median, "min_seconds": min(times), "max_seconds": max(times)}
+            flag = ""
+            if args.budget is not None and median > args.budget:
+                over_budget = True
+                flag = f"  over budget ({args.budget:.2f}s)"
+            print(f"{path.name:30s} {median:7.3f}s (min {min(times):.3f}s, max {max(times):.3f}s){flag}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(parse_args())
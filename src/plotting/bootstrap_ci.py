@@ -0,0 +1,174 @@
+"""
+Block bootstrap confidence intervals for forecast metrics across runs and folds
+
+Samples within a day are strongly correlated, so the test set is resampled in blocks of whole days.
+Every metric in forecast_metrics is built from sums, so each file is reduced once to per-day sums, and every
+replicate is then just a weighted sum of days: all replicates are drawn as one (replicates x days) matrix of
+day counts and evaluated with a single matrix product per sum, for every model column at once.
+The same days are drawn for every column, so intervals of different configurations are paired.
+
+    import bootstrap_ci
+    table = bootstrap_ci.bootstrap_files(paths, n_replicates=2000, by_config_aggregate="median")
+
+python3 bootstrap_ci.py /work/processed-runs/blackmountain/wide/*_wide.parquet --by-config --output rmse_ci.csv
+"""
+# Standard Library Modules
+from pathlib import Path
+import argparse
+
+# External Modules
+import numpy as np
+import pandas as pd
+
+# Local Modules
+import forecast_metrics
+import results_loader
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def day_sums(df: pd.DataFrame, days: pd.DatetimeIndex, model_cols: list = None, persist_cols: list = None, actual: str = forecast_metrics.ACTUAL_COL) -> tuple:
+    '''
+    Reduces a wide results frame to per-day sums for its model and persistence columns.
+    :param df: wide results frame with a sorted DatetimeIndex
+    :param days: the days every file is reduced onto, rows on other days are ignored
+    :return: (model columns, {sum name: (n_days, k)} for the models, the same for their persistence columns)
+    '''
+    if model_cols is None:
+        model_cols = forecast_metrics.model_columns(df.columns)
+    if persist_cols is None:
+        persist_cols = [forecast_metrics.persist_column(c) for c in model_cols]
+    codes = days.get_indexer(df.index.normalize())
+    actual_values = df[actual].to_numpy()
+    model = forecast_metrics.group_sums(actual_values, df[model_cols].to_numpy(), codes=codes, n_groups=len(days))
+    persist = forecast_metrics.group_sums(actual_values, df[persist_cols].to_numpy(), codes=codes, n_groups=len(days))
+    return model_cols, model, persist
+
+
+def draw_weights(n_days: int, n_replicates: int, block_days: int = 1, seed=None) -> np.ndarray:
+    '''
+    Draws every replicate at once as contiguous blocks of days (circular moving block bootstrap).
+    :param n_days: days in the test set
+    :param n_replicates: number of bootstrap replicates
+    :param block_days: length of each block in days
+    :param seed: seed for numpy's default_rng
+    :return: (n_replicates, n_days) array with the number of times each day is drawn in each replicate
+    '''
+    rng = np.random.default_rng(seed)
+    n_blocks = -(-n_days // block_days)
+    starts = rng.integers(0, n_days, size=(n_replicates, n_blocks))
+    days = (starts[:, :, None] + np.arange(block_days)).reshape(n_replicates, -1)[:, :n_days] % n_days
+    # Offset each replicate's days so one bincount counts them all
+    offsets = (np.arange(n_replicates) * n_days)[:, None]
+    return np.bincount((days + offsets).ravel(), minlength=n_replicates * n_days).reshape(n_replicates, n_days).astype(np.float64)
+
+
+def replicate_metrics(model: dict, persist: dict, weights: np.ndarray) -> dict:
+    '''
+    :param model: per-day sums for the model columns, from day_sums
+    :param persist: per-day sums for the matching persistence columns
+    :param weights: (n_replicates, n_days) day counts, or a single (1, n_days) row of ones for the point estimate
+    :return: dict of metric name -> (n_replicates, k)
+    '''
+    model_metrics = forecast_metrics.metrics_from_sums({name: weights @ sums for name, sums in model.items()})
+    persist_metrics = forecast_metrics.metrics_from_sums({name: weights @ sums for name, sums in persist.items()})
+    out = {name: model_metrics[name] for name in ["mae", "rmse", "r2"]}
+    out["mae_skill"] = forecast_metrics.skill(persist_metrics["mae"], model_metrics["mae"])
+    out["rmse_skill"] = forecast_metrics.skill(persist_metrics["rmse"], model_metrics["rmse"])
+    return out
+
+
+def by_config(metrics: dict, columns: list, aggregate: str = "median") -> tuple:
+    '''
+    Aggregates each replicate's metrics over the folds of each configuration, eg. the median RMSE over folds.
+    :return: (configuration names, dict of metric name -> (n_replicates, n_configs))
+    '''
+    configs = pd.unique(pd.Series([forecast_metrics.config_name(c) for c in columns]))
+    positions = [[i for i, c in enumerate(columns) if forecast_metrics.config_name(c) == config] for config in configs]
+    reduce = {"median": np.nanmedian, "mean": np.nanmean, "min": np.nanmin, "max": np.nanmax}[aggregate]
+    return list(configs), {name: np.stack([reduce(values[:, p], axis=1) for p in positions], axis=1) for name, values in metrics.items()}
+
+
+def ci_table(point: dict, replicates: dict, names: list, confidence: float = 0.95) -> pd.DataFrame:
+    '''
+    Percentile intervals in long format, one row per name and metric.
+    :param point: dict of metric -> (1, k) estimates on the original data
+    :param replicates: dict of metric -> (n_replicates, k)
+    :param names: the k column or configuration names
+    :return: frame with name, metric, estimate, lower, upper, se and replicates columns
+    '''
+    alpha = (1 - confidence) / 2
+    frames = []
+    for metric, values in replicates.items():
+        lower, upper = np.nanquantile(values, [alpha, 1 - alpha], axis=0)
+        frames.append(pd.DataFrame({"name": names,
+                                    "metric": metric,
+                                    "estimate": point[metric][0],
+                                    "lower": lower,
+                                    "upper": upper,
+                                    "se": np.nanstd(values, axis=0, ddof=1),
+                                    "replicates": np.sum(~np.isnan(values), axis=0)}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def bootstrap_files(paths: list, n_replicates: int = 2000, block_days: int = 1, confidence: float = 0.95, by_config_aggregate: str = None, seed=None) -> pd.DataFrame:
+    '''
+    Confidence intervals for every model column of several wide results files, resampled on the same days.
+    :param paths: wide results parquet files
+    :param n_replicates: number of bootstrap replicates
+    :param block_days: length of each resampled block in days
+    :param confidence: two sided interval width
+    :param by_config_aggregate: None for one interval per column, or "median"/"mean"/"min"/"max" to aggregate over folds first
+    :param seed: seed for the draws
+    :return: CI table from ci_table
+    '''
+    frames = [results_loader.load_results(path, cache=False) for path in paths]
+    days = pd.DatetimeIndex(sorted(set().union(*[set(df.index.normalize()) for df in frames])))
+    columns, model, persist = [], [], []
+    for path, df in zip(paths, frames):
+        file_columns, file_model, file_persist = day_sums(df, days)
+        logger.debug(f"{path}: {len(file_columns)} model columns over {len(days)} days")
+        columns += file_columns
+        model.append(file_model)
+        persist.append(file_persist)
+    model = {name: np.concatenate([m[name] for m in model], axis=1) for name in model[0]}
+    persist = {name: np.concatenate([p[name] for p in persist], axis=1) for name in persist[0]}
+
+    weights = draw_weights(len(days), n_replicates, block_days, seed)
+    point = replicate_metrics(model, persist, np.ones((1, len(days))))
+    replicates = replicate_metrics(model, persist, weights)
+    names = columns
+    if by_config_aggregate is not None:
+        names, point = by_config(point, columns, by_config_aggregate)
+        _, replicates = by_config(replicates, columns, by_config_aggregate)
+    return ci_table(point, replicates, names, confidence)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Block bootstrap confidence intervals for the model columns of wide results files")
+    parser.add_argument('paths', type=Path, nargs='+', help="Wide results parquet files")
+    parser.add_argument('--replicates', type=int, default=2000, help="Number of bootstrap replicates")
+    parser.add_argument('--block-days', type=int, default=1, help="Days per resampled block")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Two sided interval width")
+    parser.add_argument('--by-config', nargs='?', const="median", default=None, choices=["median", "mean", "min", "max"], help="Aggregate over the folds of each configuration first, median by default")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for the draws")
+    parser.add_argument('--output', type=Path, default=None, help="Csv to write, printed if not given")
+    return parser.parse_args()
+
+
+def main(args):
+    table = bootstrap_files(args.paths, args.replicates, args.block_days, args.confidence, args.by_config, args.seed)
+    if args.output is None:
+        print(table.to_string())
+    else:
+        table.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    import logging.config
+    import json
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
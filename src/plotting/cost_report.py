@@ -0,0 +1,181 @@
+"""
+Compute cost vs accuracy across the runs of a sweep
+
+Joins what each run cost (run_cost.json, written by solpred_common.RunCost) with its accuracy (the test metrics json
+next to the test output, or the test output itself for runs that predate it), averages the folds of each
+configuration, and plots skill against training time, inference latency and parameter count with the Pareto front
+(configurations no other configuration beats on both) drawn through them.  One figure per horizon, skill is only
+comparable within a horizon.
+
+python3 cost_report.py /work/bmr-fc-run /work/bmr-sunset-run --output-dir cost-report
+python3 cost_report.py /work/bmr-fc-run --score mae_skill --output-dir cost-report
+"""
+# Standard Library Modules
+from pathlib import Path
+import argparse
+import json
+
+# External Modules
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+# Local Modules
+import forecast_metrics
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+RUN_COST_FILE = "run_cost.json"
+PARAM_COLUMNS = {"dataset": "dataset", "model-name": "model", "input-terms": "terms", "input-spacing": "spacing",
+                 "horizon": "horizon", "fold": "fold", "learning-rate": "lr", "crop-size": "crop"}
+CONFIG_COLUMNS = ["dataset", "model", "terms", "spacing", "horizon", "lr", "crop"]
+# cost column -> axis label, lower is better for all of them
+COST_COLUMNS = {"train_hours": "Training wall time (hours)",
+                "latency_ms": "Inference latency per sample (ms)",
+                "parameters": "Parameters"}
+
+
+def metrics_path(out_file: Path) -> Path:
+    '''test_out.csv.gz -> test_out_metrics.json, as solpred_common.metrics_output_path'''
+    name = out_file.name
+    for suffix in [".gz", ".csv"]:
+        name = name[:-len(suffix)] if name.endswith(suffix) else name
+    return out_file.with_name(name + "_metrics.json")
+
+
+def accuracy_from_csv(out_file: Path) -> dict:
+    '''Model and persistence metrics from a long format test output (time, series, value)'''
+    df = pd.read_csv(out_file).pivot_table(index="time", columns="series", values="value")
+    model_col = [c for c in df.columns if c.endswith("_pred") and c != "persist_pred"][0]
+    return {series: {"rmse": float(forecast_metrics.rmse(df["actual"], df[col])), "mae": float(forecast_metrics.mae(df["actual"], df[col]))}
+            for series, col in [("model", model_col), ("persist", "persist_pred")]}
+
+
+def read_accuracy(run_folder: Path, out_file: str) -> dict:
+    '''rmse, mae and their skill vs persistence, or an empty dict if the run has not been tested'''
+    out_path = run_folder / out_file
+    if metrics_path(out_path).exists():
+        with open(metrics_path(out_path)) as f:
+            metrics = json.load(f)
+    elif out_path.exists():
+        metrics = accuracy_from_csv(out_path)
+    else:
+        return {}
+    if "model" not in metrics:
+        # A multi checkpoint test output, the accuracy of each checkpoint is in its own run folder
+        return {}
+    accuracy = {name: metrics["model"][name] for name in ["rmse", "mae"]}
+    for name in ["rmse", "mae"]:
+        if "persist" in metrics:
+            accuracy[f"{name}_skill"] = float(forecast_metrics.skill(metrics["persist"][name], metrics["model"][name]))
+        else:
+            # Member metrics written by multi_checkpoint_test before it wrote persist, the skill is already there
+            accuracy[f"{name}_skill"] = float(metrics.get("skill", metrics["model"]).get(f"{name}_skill", np.nan))
+    return accuracy
+
+
+def read_run(run_folder: Path) -> dict:
+    with open(run_folder / "run-params.json") as f:
+        params = json.load(f)
+    row = {"run_folder": str(run_folder), **{column: params.get(key) for key, column in PARAM_COLUMNS.items()}}
+    if (run_folder / RUN_COST_FILE).exists():
+        with open(run_folder / RUN_COST_FILE) as f:
+            cost = json.load(f)
+        if "members" in cost:
+            # Every member of a shared data run together, each member's share is in its own run folder
+            logger.debug(f"Skipping the combined cost of {run_folder}, shared by {cost['members']}")
+        else:
+            row.update({k: v for k, v in cost.items() if isinstance(v, (int, float))})
+            row["train_hours"] = cost.get("train_seconds", np.nan) / 3600
+    row.update(read_accuracy(run_folder, params["out-file"]))
+    return row
+
+
+def cost_table(paths) -> pd.DataFrame:
+    '''One row per run folder under paths'''
+    folders = []
+    for path in map(Path, paths):
+        folders += [p.parent for p in sorted(path.rglob("run-params.json"))]
+    df = pd.DataFrame([read_run(folder) for folder in folders])
+    for column in ["train_hours", "latency_ms", "parameters", "train_samples_per_second", "epochs", "rmse_skill"]:
+        if column not in df:
+            df[column] = np.nan
+    return df
+
+
+def config_table(runs: pd.DataFrame) -> pd.DataFrame:
+    '''Mean over the folds of each configuration, with the number of folds that have both cost and accuracy'''
+    numeric = [c for c in runs.columns if c not in CONFIG_COLUMNS + ["run_folder", "fold"] and pd.api.types.is_numeric_dtype(runs[c])]
+    grouped = runs.groupby(CONFIG_COLUMNS, dropna=False)
+    configs = grouped[numeric].mean()
+    configs["folds"] = grouped["rmse_skill"].count()
+    return configs.reset_index()
+
+
+def pareto_front(cost, score) -> np.ndarray:
+    '''Mask of the points no other point beats on both lower cost and higher score'''
+    cost = np.asarray(cost, dtype=float)
+    score = np.asarray(score, dtype=float)
+    valid = np.isfinite(cost) & np.isfinite(score)
+    front = np.zeros(len(cost), dtype=bool)
+    best = -np.inf
+    # Cheapest first, ties best score first, a point is on the front if it beats every cheaper point
+    for i in np.lexsort((-score, cost)):
+        if valid[i] and score[i] > best:
+            front[i] = True
+            best = score[i]
+    return front
+
+
+def plot_fronts(configs: pd.DataFrame, score: str, output_path: Path, title: str = ""):
+    fig, axes = plt.subplots(ncols=len(COST_COLUMNS), squeeze=False)
+    fig.set_size_inches(6 * len(COST_COLUMNS), 5)
+    for ax, (cost, label) in zip(axes[0], COST_COLUMNS.items()):
+        for model, df in configs.groupby("model"):
+            ax.scatter(df[cost], df[score], label=model)
+            for _, row in df.iterrows():
+                ax.annotate(f"{row['terms']}x{row['spacing']}s", (row[cost], row[score]), fontsize=7, xytext=(3, 3), textcoords="offset points")
+        front = configs[pareto_front(configs[cost], configs[score])].sort_values(cost)
+        ax.step(front[cost], front[score], where="post", color="black", linestyle="--", label="Pareto front")
+        if configs[cost].gt(0).any():
+            ax.set_xscale("log")
+        ax.set_xlabel(label)
+        ax.set_ylabel(score)
+        ax.legend(fontsize=8)
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Skill against training time, latency and size across sweep runs, with Pareto fronts")
+    parser.add_argument('paths', type=Path, nargs='+', help="Run directories, searched for run-params.json")
+    parser.add_argument('--score', type=str, default="rmse_skill", help="Accuracy column, higher is better (rmse_skill or mae_skill)")
+    parser.add_argument('--output-dir', type=Path, default=Path("cost-report"), help="Where the csvs and plots are written")
+    return parser.parse_args()
+
+
+def main(args):
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    runs = cost_table(args.paths)
+    runs.to_csv(args.output_dir / "runs.csv", index=False)
+    configs = config_table(runs)
+    for cost in COST_COLUMNS:
+        configs[f"pareto_{cost}"] = False
+    for horizon, df in configs.groupby("horizon"):
+        for cost in COST_COLUMNS:
+            configs.loc[df.index, f"pareto_{cost}"] = pareto_front(df[cost], df[args.score])
+        plot_fronts(df, args.score, args.output_dir / f"pareto_{horizon}s.png", title=f"{args.score} vs cost, {horizon}s horizon")
+    configs.to_csv(args.output_dir / "configs.csv", index=False)
+    logger.info(f"{len(runs)} runs, {len(configs)} configurations, written to {args.output_dir}")
+    print(configs[CONFIG_COLUMNS + [args.score] + list(COST_COLUMNS) + [f"pareto_{cost}" for cost in COST_COLUMNS]].to_string())
+
+
+if __name__ == '__main__':
+    import logging.config
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
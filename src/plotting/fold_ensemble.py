@@ -0,0 +1,255 @@
+"""
+Fold ensembles from per-fold wide results files, in one streaming pass
+
+The fold files are merged on ``id-time`` with a k-way merge over record batches instead of repeated pairwise joins,
+so memory use is bounded by the batch size and the number of folds, not the length of the test set.
+As in make_ensembles.clj, rows with missing values are dropped and only the ``id-time`` values present in every
+fold are kept.  Output columns are ``id-time``, ``predicted-time``, ``actual``, the persistence column without its
+fold, then ``<name>``, ``<name>_upper`` and ``<name>_lower``, ready for json-to-interact.py.
+
+Bands:
+    t         mean +/- a 95% t interval over the folds, the same as make_ensembles.clj (default)
+    minmax    mean, with the min and max over the folds
+    quantile  median, with the --quantiles over the folds
+
+python3 fold_ensemble.py /work/processed-runs/blackmountain/wide/blackmountain_fully-conv_2x30s_120s_run_03_crop_1024_lr_3.0E-6_fold_*_wide.parquet --output ensemble.parquet
+python3 fold_ensemble.py fold_*_wide.parquet --band quantile --quantiles 0.1 0.9 --output ensemble.parquet
+"""
+# Standard Library Modules
+from pathlib import Path
+import argparse
+import re
+
+# External Modules
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Local Modules
+import forecast_metrics
+import results_loader
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 65536
+# Two sided 95% t critical values for 1 to 10 degrees of freedom, as used in make_ensembles.clj
+T_CRIT_TABLE = [12.71, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228]
+
+
+def ensemble_name(path) -> str:
+    '''
+    Name of the ensemble a fold file belongs to,
+    eg. blackmountain_fully-conv_2x30s_120s_run_03_crop_1024_lr_3.0E-6_fold_4_wide.parquet -> blackmountain_fully-conv_2x30s_120s_run_03_crop_1024_lr_3.0E-6
+    '''
+    stem = re.sub(r"\.(parquet|csv|csv\.gz)$", "", Path(path).name)
+    return re.sub(r"_fold_\d+(_[a-z]+)?$", "", stem)
+
+
+def t_crit(n: int) -> float:
+    if n - 1 <= len(T_CRIT_TABLE):
+        return T_CRIT_TABLE[n - 2]
+    from scipy import stats
+    return stats.t.ppf(0.975, n - 1)
+
+
+def strictly_increasing(parquet_file: pq.ParquetFile, batch_size: int = BATCH_SIZE) -> bool:
+    '''
+    Whether a file's ``id-time`` is strictly increasing (sorted, no duplicates), in memory bounded by the batch size.
+    The row group statistics rule out overlapping row groups without reading anything, then the column is scanned
+    a batch at a time.  ``TIME_FORMAT`` strings sort in time order, so the string statistics can be compared.
+    '''
+    column = parquet_file.schema_arrow.get_field_index(results_loader.ID_COL)
+    previous_max = None
+    for i in range(parquet_file.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            break
+        if previous_max is not None and statistics.min <= previous_max:
+            return False
+        previous_max = statistics.max
+    last = None
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=[results_loader.ID_COL]):
+        keys = FoldReader.parse_keys(batch.column(0))
+        if len(keys) == 0:
+            continue
+        if (last is not None and keys[0] <= last) or np.any(keys[1:] <= keys[:-1]):
+            return False
+        last = keys[-1]
+    return True
+
+
+class FoldReader:
+    '''
+    Reads one fold file as a stream of (key, row data) chunks with strictly increasing ``id-time``.
+    Files are read in record batches when they are already strictly increasing, otherwise the needed columns are
+    read whole, sorted and deduplicated (keeping the first row of each ``id-time``).
+    '''
+    def __init__(self, path, batch_size: int = BATCH_SIZE):
+        self.path = path
+        parquet_file = pq.ParquetFile(path)
+        names = parquet_file.schema_arrow.names
+        self.model_col = forecast_metrics.model_columns(names)[0]
+        self.persist_col = forecast_metrics.persist_column(self.model_col)
+        self.columns = [results_loader.ID_COL, results_loader.TIME_COL, forecast_metrics.ACTUAL_COL, self.persist_col, self.model_col]
+        if strictly_increasing(parquet_file, batch_size):
+            self.batches = parquet_file.iter_batches(batch_size=batch_size, columns=self.columns)
+        else:
+            logger.warning(f"{path} is not sorted by {results_loader.ID_COL} or has duplicates, reading it whole")
+            table = parquet_file.read(columns=self.columns)
+            keys = self.parse_keys(table.column(results_loader.ID_COL))
+            order = np.argsort(keys, kind="stable")
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = keys[order][1:] != keys[order][:-1]
+            if not first.all():
+                logger.warning(f"{path} has {np.count_nonzero(~first)} duplicate {results_loader.ID_COL} rows, keeping the first of each")
+            table = table.take(pa.array(order[first]))
+            self.batches = iter(table.to_batches(max_chunksize=batch_size))
+        self.keys = np.array([], dtype=np.int64)
+        self.last_key = None
+        self.table = None
+        self.done = False
+
+    @staticmethod
+    def parse_keys(times) -> np.ndarray:
+        return pc.strptime(times, format=results_loader.TIME_FORMAT, unit="s").cast(pa.int64()).to_numpy(zero_copy_only=False)
+
+    def fill(self):
+        '''Reads batches until there is buffered data or the file is exhausted'''
+        while len(self.keys) == 0 and not self.done:
+            batch = next(self.batches, None)
+            if batch is None:
+                self.done = True
+                return
+            # Drop rows with missing values, as make_ensembles.clj does
+            table = pa.Table.from_batches([batch]).drop_null()
+            values = [table.column(c).to_numpy(zero_copy_only=False) for c in self.columns[2:]]
+            table = table.filter(pa.array(~np.any(np.isnan(np.stack(values)), axis=0)))
+            self.table = table
+            self.keys = self.parse_keys(table.column(results_loader.ID_COL))
+            # merge_folds relies on unique, sorted keys, eg. the file must not change while it is read
+            if len(self.keys) > 0:
+                if (self.last_key is not None and self.keys[0] <= self.last_key) or np.any(self.keys[1:] <= self.keys[:-1]):
+                    raise ValueError(f"{self.path} {results_loader.ID_COL} is not strictly increasing while streaming it")
+                self.last_key = self.keys[-1]
+
+    def take_until(self, bound: int):
+        '''Removes and returns the buffered rows with key <= bound'''
+        n = np.searchsorted(self.keys, bound, side="right")
+        keys, table = self.keys[:n], self.table.slice(0, n)
+        self.keys, self.table = self.keys[n:], self.table.slice(n)
+        return keys, table
+
+
+def merge_folds(readers: list):
+    '''
+    K-way merge of the fold readers, yields (first fold's table, (m, k) model values) for the id-times present in every fold.
+    :return: generator, and the count of rows dropped because they were missing from some fold is logged at the end
+    '''
+    dropped = 0
+    while True:
+        for reader in readers:
+            reader.fill()
+        if any(len(reader.keys) == 0 for reader in readers):
+            # A fold is exhausted, nothing else can match in every fold
+            dropped += sum(len(reader.keys) for reader in readers)
+            for reader in readers:
+                while not reader.done:
+                    reader.keys = np.array([], dtype=np.int64)
+                    reader.fill()
+                    dropped += len(reader.keys)
+            break
+        # Everything up to the smallest buffered maximum can be matched now
+        bound = min(reader.keys[-1] for reader in readers)
+        chunks = [reader.take_until(bound) for reader in readers]
+        common = chunks[0][0]
+        for keys, _ in chunks[1:]:
+            # Keys are unique within each reader, see FoldReader
+            common = np.intersect1d(common, keys, assume_unique=True)
+        dropped += sum(len(keys) for keys, _ in chunks) - len(common) * len(chunks)
+        if len(common) == 0:
+            continue
+        positions = [np.searchsorted(keys, common) for keys, _ in chunks]
+        first = chunks[0][1].take(pa.array(positions[0]))
+        values = np.stack([table.column(reader.model_col).to_numpy(zero_copy_only=False)[p]
+                           for (_, table), reader, p in zip(chunks, readers, positions)], axis=1)
+        yield first, values
+    if dropped > 0:
+        logger.warning(f"Dropped {dropped} fold rows whose {results_loader.ID_COL} is not present in every fold")
+
+
+def bands(values: np.ndarray, band: str = "t", quantiles: tuple = (0.1, 0.9)) -> tuple:
+    '''
+    :param values: (m, k) predictions from k folds
+    :return: (centre, upper, lower) arrays of length m
+    '''
+    k = values.shape[1]
+    if band == "t":
+        mean = values.mean(axis=1)
+        if k == 1:
+            return mean, mean, mean
+        half_width = t_crit(k) * values.std(axis=1, ddof=1) / np.sqrt(k)
+        return mean, mean + half_width, mean - half_width
+    elif band == "minmax":
+        return values.mean(axis=1), values.max(axis=1), values.min(axis=1)
+    elif band == "quantile":
+        lower, centre, upper = np.quantile(values, [quantiles[0], 0.5, quantiles[1]], axis=1)
+        return centre, upper, lower
+    raise ValueError(f"Unknown band {band}")
+
+
+def make_ensemble(paths: list, output_path, name: str = None, band: str = "t", quantiles: tuple = (0.1, 0.9), batch_size: int = BATCH_SIZE, compression: str = "gzip") -> int:
+    '''
+    Writes the ensemble of the fold files to parquet.
+    :param paths: per-fold wide results files of one run configuration
+    :param output_path: parquet file to write
+    :param name: ensemble column name, defaults to ensemble_name of the first path
+    :param band: "t", "minmax" or "quantile"
+    :param quantiles: lower and upper quantile for the quantile band
+    :param batch_size: rows read per batch from each fold
+    :return: number of rows written
+    '''
+    readers = sorted((FoldReader(path, batch_size) for path in paths), key=lambda r: r.model_col)
+    name = ensemble_name(paths[0]) if name is None else name
+    persist_col = forecast_metrics.config_name(readers[0].persist_col)
+    schema = pa.schema([(results_loader.ID_COL, pa.string()), (results_loader.TIME_COL, pa.string()),
+                        (forecast_metrics.ACTUAL_COL, pa.float64()), (persist_col, pa.float64()),
+                        (name, pa.float64()), (f"{name}_upper", pa.float64()), (f"{name}_lower", pa.float64())])
+    rows = 0
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with pq.ParquetWriter(str(output_path), schema, compression=compression) as writer:
+        for first, values in merge_folds(readers):
+            centre, upper, lower = bands(values, band, quantiles)
+            writer.write_table(pa.table([first.column(results_loader.ID_COL).cast(pa.string()),
+                                         first.column(results_loader.TIME_COL).cast(pa.string()),
+                                         first.column(forecast_metrics.ACTUAL_COL).cast(pa.float64()),
+                                         first.column(readers[0].persist_col).cast(pa.float64()),
+                                         pa.array(centre), pa.array(upper), pa.array(lower)], schema=schema))
+            rows += len(centre)
+    logger.info(f"Wrote {rows} rows of {name} from {len(readers)} folds to {output_path}")
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Combine per-fold wide results files into an ensemble with upper and lower bands")
+    parser.add_argument('paths', type=Path, nargs='+', help="Wide results parquet files, one per fold")
+    parser.add_argument('--output', type=Path, required=True, help="Parquet file to write")
+    parser.add_argument('--name', type=str, default=None, help="Ensemble column name, defaults to the file name without its fold")
+    parser.add_argument('--band', choices=["t", "minmax", "quantile"], default="t", help="How the upper and lower columns are calculated")
+    parser.add_argument('--quantiles', type=float, nargs=2, default=[0.1, 0.9], help="Lower and upper quantile for --band quantile")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Rows read per batch from each fold")
+    return parser.parse_args()
+
+
+def main(args):
+    make_ensemble(args.paths, args.output, args.name, args.band, tuple(args.quantiles), args.batch_size)
+
+
+if __name__ == '__main__':
+    import logging.config
+    import json
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
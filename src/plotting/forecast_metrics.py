@@ -0,0 +1,427 @@
+"""
+Vectorised forecast metrics for wide results files
+
+Computes MAE, MSE, RMSE, R2 and skill vs persistence, plus the ramp detection (RDI) and false ramp (FRI) indices
+from Chu et al., for many prediction columns at once, optionally split into groups (weather category or case study).
+The definitions match src/solpred/reports/metrics.clj: every statistic is computed over the rows where both the
+actual and that prediction column are present.
+
+Everything reduces to per-group sums of a handful of terms, so each block of columns is a single pass over the rows.
+
+    import forecast_metrics
+    groups = forecast_metrics.category_groups(df.index)
+    table = forecast_metrics.evaluate(df, model_cols, groups=groups)
+
+python3 forecast_metrics.py blackmountain_fully-conv_2x60s_300s_run_06_crop_1024_lr_3.0E-4_fold_3_wide.parquet --by category --clear-sky clear-sky-irradiance-cache.parquet --output metrics.csv
+python3 forecast_metrics.py blackmountain_fully-conv_2x60s_300s_run_06_crop_1024_lr_3.0E-4_fold_3_wide.parquet --smart-persistence /work/irradiance-store
+"""
+# Standard Library Modules
+from pathlib import Path
+import argparse
+import re
+
+# External Modules
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Local Modules
+import irradiance_store
+import results_loader
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+CATEGORY_FILE = REPO_DIR / "resources" / "datasets" / "blackmountain-test.csv"
+CASE_STUDY_FILE = REPO_DIR / "resources" / "datasets" / "bm-casestudies.edn"
+ACTUAL_COL = "actual"
+CLEAR_SKY_COL = "ClearSkyGHI"
+RAMP_FRACTION = 0.1
+COLUMN_BLOCK = 64
+# More runs of equal group codes than this and the rows are sorted by group before reducing
+MAX_RUNS = 4096
+
+# Per group and column sums that every metric is derived from
+SUMS = ["count", "abs_error", "sq_error", "actual", "actual_sq", "hits", "misses", "false_ramps", "true_no_ramps"]
+
+
+def mae(actual, pred):
+    '''MAE over the rows where both are present, a float for a single column or an array for a 2D ``pred``'''
+    return _single(standard_metrics(actual, pred)["mae"], pred)
+
+
+def mse(actual, pred):
+    '''MSE over the rows where both are present'''
+    return _single(standard_metrics(actual, pred)["mse"], pred)
+
+
+def rmse(actual, pred):
+    '''RMSE over the rows where both are present'''
+    return _single(standard_metrics(actual, pred)["rmse"], pred)
+
+
+def r2(actual, pred):
+    '''Coefficient of determination over the rows where both are present'''
+    return _single(standard_metrics(actual, pred)["r2"], pred)
+
+
+def skill(reference, forecast):
+    '''Skill of a forecast metric vs a reference metric (eg. persistence RMSE), 1 - forecast / reference'''
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1 - np.asarray(forecast, dtype=float) / np.asarray(reference, dtype=float)
+
+
+def _single(values, pred):
+    return float(values[0]) if np.ndim(pred) == 1 else values
+
+
+def _as_2d(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    return values.reshape(-1, 1) if values.ndim == 1 else values
+
+
+def group_sums(actual, pred, persist=None, clear_sky=None, codes=None, n_groups=1) -> dict:
+    '''
+    Sums every metric is built from, for each group and prediction column.
+    Element-wise work is done in float32 when the predictions are float32, the sums are always accumulated in float64.
+    :param actual: (n,) observed values
+    :param pred: (n, k) predictions
+    :param persist: optional (n,) or (n, k) persistence forecast, the start of each ramp interval
+    :param clear_sky: optional (n,) clear sky irradiance, ramps are changes larger than RAMP_FRACTION of it
+    :param codes: optional (n,) group number of each row, rows with a negative code are skipped
+    :param n_groups: number of groups
+    :return: dict of SUMS name -> (n_groups, k) array, the ramp sums are only present if persist and clear_sky are given
+    '''
+    pred = np.asarray(pred)
+    dtype = np.float32 if pred.dtype == np.float32 else np.float64
+    pred = _as_2d(pred.astype(dtype, copy=False))
+    actual = np.asarray(actual, dtype=dtype).reshape(-1, 1)
+    if codes is None:
+        codes = np.zeros(len(actual), dtype=np.int64)
+    codes = np.asarray(codes)
+
+    # Rows are reduced as runs of equal codes, so time sorted results grouped by day or window need no reordering
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) > 0 else np.array([], dtype=np.int64)
+    if len(starts) > MAX_RUNS:
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        actual, pred = actual[order], pred[order]
+        persist = None if persist is None else _as_2d(np.asarray(persist))[order]
+        clear_sky = None if clear_sky is None else np.asarray(clear_sky).reshape(-1, 1)[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.append(starts[1:], len(codes))
+    runs = [(code, first, last) for code, first, last in zip(codes[starts], starts, ends) if code >= 0]
+
+    def reduce(values):
+        # Slice sums along the rows are much faster than np.add.reduceat(axis=0) on wide blocks
+        out = np.zeros((n_groups, values.shape[1]))
+        for code, first, last in runs:
+            if values.dtype == bool:
+                out[code] += np.count_nonzero(values[first:last], axis=0)
+            else:
+                out[code] += values[first:last].sum(axis=0, dtype=np.float64)
+        return out
+
+    error = pred - actual
+    valid = ~np.isnan(error)
+    all_valid = valid.all()
+    if not all_valid:
+        error[~valid] = 0
+    sums = {"count": reduce(valid),
+            "abs_error": reduce(np.abs(error)),
+            "sq_error": reduce(np.square(error, out=error))}
+    if all_valid:
+        sums["actual"] = np.repeat(reduce(actual), pred.shape[1], axis=1)
+        sums["actual_sq"] = np.repeat(reduce(np.square(actual)), pred.shape[1], axis=1)
+    else:
+        observed = np.where(valid, actual, 0)
+        sums["actual"] = reduce(observed)
+        sums["actual_sq"] = reduce(np.square(observed, out=observed))
+
+    if persist is not None and clear_sky is not None:
+        start = _as_2d(np.asarray(persist, dtype=dtype))
+        threshold = RAMP_FRACTION * np.asarray(clear_sky, dtype=dtype).reshape(-1, 1)
+        actual_ramp = actual - start
+        pred_ramp = pred - start
+        ramp_valid = valid & ~np.isnan(actual_ramp) & ~np.isnan(threshold)
+        actual_mag = np.abs(actual_ramp)
+        pred_is_ramp = np.abs(pred_ramp) > threshold
+        # RDI counts ramps of at least the threshold, FRI counts no-ramps of at most the threshold, as in metrics.clj
+        rdi_ramp = ramp_valid & (actual_mag >= threshold)
+        hit = rdi_ramp & pred_is_ramp & (actual_ramp * pred_ramp > 0)
+        no_ramp = ramp_valid & ~(actual_mag > threshold)
+        false_ramp = no_ramp & pred_is_ramp
+        sums["hits"] = reduce(hit)
+        sums["misses"] = reduce(rdi_ramp) - sums["hits"]
+        sums["false_ramps"] = reduce(false_ramp)
+        sums["true_no_ramps"] = reduce(no_ramp) - sums["false_ramps"]
+    return sums
+
+
+def metrics_from_sums(sums: dict) -> dict:
+    '''
+    :param sums: output of group_sums, arrays of any (matching) shape
+    :return: dict of metric name -> array, NaN where there are no rows
+    '''
+    with np.errstate(divide="ignore", invalid="ignore"):
+        count = sums["count"]
+        out = {"count": count,
+               "mae": sums["abs_error"] / count,
+               "mse": sums["sq_error"] / count}
+        out["rmse"] = np.sqrt(out["mse"])
+        total_sq = sums["actual_sq"] - sums["actual"] ** 2 / count
+        out["r2"] = 1 - sums["sq_error"] / total_sq
+        if "hits" in sums:
+            ramps = sums["hits"] + sums["misses"]
+            no_ramps = sums["false_ramps"] + sums["true_no_ramps"]
+            out["rdi_hits"] = sums["hits"]
+            out["rdi_ramps"] = ramps
+            out["rdi"] = np.where(ramps > 0, sums["hits"] / ramps, 1.0)
+            out["fri_false_ramps"] = sums["false_ramps"]
+            out["fri_no_ramps"] = no_ramps
+            out["fri"] = np.where(no_ramps > 0, sums["false_ramps"] / no_ramps, 0.0)
+    return out
+
+
+def standard_metrics(actual, pred) -> dict:
+    '''
+    MAE, MSE, RMSE and R2 for every column of ``pred`` at once.
+    :param actual: (n,) observed values
+    :param pred: (n,) or (n, k) predictions
+    :return: dict of metric name -> (k,) array
+    '''
+    return {name: values[0] for name, values in metrics_from_sums(group_sums(actual, pred)).items()}
+
+
+def persist_column(model_col: str) -> str:
+    '''
+    The persistence column that goes with a model column in a wide file,
+    eg. fully-conv_2x60s_300s_run_06_fold_3 -> persist_2x60s_300s_run_06_fold_3
+    '''
+    return f"persist_{model_col.split('_', 1)[1]}"
+
+
+def config_name(column: str) -> str:
+    '''
+    The run configuration of a model or persistence column, the column without its fold,
+    eg. fully-conv_2x60s_300s_run_06_fold_3 -> fully-conv_2x60s_300s_run_06
+    '''
+    return re.sub(r"_fold_\d+$", "", column)
+
+
+def column_horizon(column: str) -> int:
+    '''
+    The forecast horizon in seconds of a model or persistence column,
+    eg. fully-conv_2x60s_300s_run_06_fold_3 -> 300
+    '''
+    match = re.search(r"_\d+x\d+s_(\d+)s?_", column)
+    if match is None:
+        raise ValueError(f"No horizon in column name {column}")
+    return int(match.group(1))
+
+
+def add_smart_persistence(df: pd.DataFrame, store_dir, model_cols: list = None) -> list:
+    '''
+    Adds a smart persistence column (the clear sky index at the id-time persisted to the target time, see
+    irradiance_store.persistence) for each horizon of the model columns of a wide results frame.
+    :param df: wide results frame with an ``id-time`` column
+    :param store_dir: irradiance_store directory
+    :return: the smart persistence column for each model column, to use as ``evaluate``'s persist_cols
+    '''
+    model_cols = model_columns(df.columns) if model_cols is None else model_cols
+    store = irradiance_store.IrradianceStore(store_dir)
+    persist_cols = []
+    for column in model_cols:
+        horizon = column_horizon(column)
+        persist_col = f"smart_persist_{horizon}s"
+        if persist_col not in df:
+            df[persist_col] = irradiance_store.persistence(store, df[results_loader.ID_COL], smart=True, horizon=horizon)
+        persist_cols.append(persist_col)
+    return persist_cols
+
+
+def model_columns(columns) -> list:
+    '''The model prediction columns of a wide file, everything except actual, persistence, times and ensemble bounds'''
+    skip = {ACTUAL_COL, CLEAR_SKY_COL, results_loader.TIME_COL, results_loader.ID_COL}
+    return [c for c in columns if c not in skip and not c.startswith(("persist_", "smart_persist_", "__index_level_")) and not c.endswith(("_upper", "_lower"))]
+
+
+def category_groups(index: pd.DatetimeIndex, category_file=CATEGORY_FILE, include_all: bool = True) -> dict:
+    '''
+    Rows of each weather category (Sunny, Intermittent, Overcast, ...), by the date of each row.
+    :param index: DatetimeIndex of the results
+    :param category_file: csv with Date and Category columns
+    :param include_all: add an "All" group with every row
+    :return: dict of category -> row positions
+    '''
+    categories = pd.read_csv(category_file, dtype=str).set_index("Date")["Category"]
+    row_categories = pd.Series(index.strftime("%Y-%m-%d")).map(categories).values
+    groups = {"All": np.arange(len(index))} if include_all else {}
+    for category in pd.unique(categories):
+        groups[category] = np.flatnonzero(row_categories == category)
+    return groups
+
+
+def read_case_studies(path=CASE_STUDY_FILE) -> list:
+    '''
+    Reads the case study windows from an edn file such as resources/datasets/bm-casestudies.edn.
+    :return: list of (case study id, start, end), entries without a start and end (eg. "All") are skipped
+    '''
+    text = Path(path).read_text()
+    case_studies = []
+    for entry in re.findall(r"\{[^{}]*\}", text):
+        fields = dict(re.findall(r':(case-study-[a-z-]+)\s+"([^"]*)"', entry))
+        if fields.get("case-study-start-dt") and fields.get("case-study-end-dt"):
+            case_studies.append((fields["case-study-id"], fields["case-study-start-dt"], fields["case-study-end-dt"]))
+    return case_studies
+
+
+def case_study_groups(index: pd.DatetimeIndex, case_studies=None, include_all: bool = True) -> dict:
+    '''
+    Rows inside each case study window (inclusive), found by binary search when the index is sorted.
+    :param index: DatetimeIndex of the results
+    :param case_studies: list of (id, start, end), defaults to read_case_studies()
+    :param include_all: add an "All" group with the rows of every case study, as the report pipeline does
+    :return: dict of case study id -> row positions
+    '''
+    if case_studies is None:
+        case_studies = read_case_studies()
+    groups = {case_study_id: results_loader.window_rows(index, start, end) for case_study_id, start, end in case_studies}
+    if include_all:
+        all_rows = np.unique(np.concatenate(list(groups.values()))) if groups else np.array([], dtype=np.int64)
+        groups = {"All": all_rows, **groups}
+    return groups
+
+
+def group_atoms(groups: dict, n_rows: int) -> tuple:
+    '''
+    Splits possibly overlapping groups (eg. "All" and the categories) into disjoint atoms of rows that belong to exactly
+    the same groups, so every row is reduced once and each group's sums are the sum of its atoms.
+    :return: (atom code of each row, -1 if in no group, (n_groups, n_atoms) membership matrix)
+    '''
+    membership = np.zeros((n_rows, len(groups)), dtype=bool)
+    for i, rows in enumerate(groups.values()):
+        membership[np.asarray(rows, dtype=np.int64), i] = True
+    patterns, codes = np.unique(membership, axis=0, return_inverse=True)
+    codes = codes.reshape(-1)
+    empty = ~patterns.any(axis=1)
+    if empty.any():
+        # Rows in no group are dropped, renumber the remaining atoms
+        renumber = np.cumsum(~empty) - 1
+        codes = np.where(empty[codes], -1, renumber[codes])
+        patterns = patterns[~empty]
+    return codes, patterns.T.astype(np.float64)
+
+
+def evaluate(df: pd.DataFrame, model_cols: list = None, persist_cols: list = None, actual: str = ACTUAL_COL, clear_sky=None, groups: dict = None, block: int = COLUMN_BLOCK) -> pd.DataFrame:
+    '''
+    Metrics for many model columns of a wide results frame, with skill vs persistence and optionally RDI / FRI.
+    :param df: wide results frame
+    :param model_cols: prediction columns, defaults to model_columns(df.columns)
+    :param persist_cols: persistence column for each model column, defaults to persist_column() of each
+    :param actual: observed column
+    :param clear_sky: optional clear sky irradiance aligned with df (column name or array), enables RDI and FRI
+    :param groups: optional dict of group name -> row positions, eg. from category_groups or case_study_groups
+    :param block: number of model columns evaluated per pass, bounds memory use
+    :return: frame indexed by (group, column) with count, mae, mse, rmse, r2, the persistence equivalents,
+        mae/mse/rmse skill and, with clear_sky, the ramp metrics
+    '''
+    if model_cols is None:
+        model_cols = model_columns(df.columns)
+    if persist_cols is None:
+        persist_cols = [persist_column(c) for c in model_cols]
+    if groups is None:
+        groups = {"All": np.arange(len(df))}
+    if isinstance(clear_sky, str):
+        clear_sky = df[clear_sky].values
+    codes, membership = group_atoms(groups, len(df))
+    actual_values = df[actual].to_numpy()
+
+    def sums_by_group(values, persist=None):
+        sums = group_sums(actual_values, values, persist=persist, clear_sky=clear_sky, codes=codes, n_groups=membership.shape[1])
+        return {name: membership @ atom_sums for name, atom_sums in sums.items()}
+
+    # Persistence columns are shared by many models (eg. ensembles), so evaluate each once
+    unique_persist = list(dict.fromkeys(persist_cols))
+    persist_metrics = metrics_from_sums(sums_by_group(df[unique_persist].to_numpy()))
+    persist_position = {c: i for i, c in enumerate(unique_persist)}
+
+    frames = []
+    for first in range(0, len(model_cols), block):
+        cols = model_cols[first:first + block]
+        persist_block = [persist_cols[i] for i in range(first, first + len(cols))]
+        model_metrics = metrics_from_sums(sums_by_group(df[cols].to_numpy(), None if clear_sky is None else df[persist_block].to_numpy()))
+        positions = [persist_position[c] for c in persist_block]
+        table = {name: values for name, values in model_metrics.items()}
+        for name in ["mae", "mse", "rmse", "r2"]:
+            table[f"persist_{name}"] = persist_metrics[name][:, positions]
+        for name in ["mae", "mse", "rmse"]:
+            table[f"{name}_skill"] = skill(table[f"persist_{name}"], table[name])
+        index = pd.MultiIndex.from_product([list(groups), cols], names=["group", "column"])
+        frames.append(pd.DataFrame({name: values.ravel() for name, values in table.items()}, index=index))
+
+    result = pd.concat(frames).reindex(pd.MultiIndex.from_product([list(groups), model_cols], names=["group", "column"]))
+    result["persist_column"] = np.tile(persist_cols, len(groups))
+    return result
+
+
+def read_clear_sky(path, id_times) -> np.ndarray:
+    '''
+    Clear sky GHI for each id-time, from a clear-sky-irradiance-cache.parquet or an irradiance_store directory.
+    :return: array aligned with id_times, NaN where the cache has no entry
+    '''
+    if Path(path).is_dir():
+        return irradiance_store.IrradianceStore(path).lookup(id_times, irradiance_store.CLEAR_SKY_COL)
+    cache = pd.read_parquet(path, columns=[results_loader.ID_COL, CLEAR_SKY_COL]).drop_duplicates(results_loader.ID_COL)
+    return cache.set_index(results_loader.ID_COL)[CLEAR_SKY_COL].reindex(id_times).values
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Calculate forecast metrics for every model column of wide results files")
+    parser.add_argument('paths', type=Path, nargs='+', help="Wide results parquet files")
+    parser.add_argument('--by', choices=["all", "category", "case-study"], default="all", help="How to group the rows")
+    parser.add_argument('--category-file', type=Path, default=CATEGORY_FILE, help="Csv of Date, Category")
+    parser.add_argument('--case-study-file', type=Path, default=CASE_STUDY_FILE, help="Edn file of case study windows")
+    parser.add_argument('--clear-sky', type=Path, default=None, help="clear-sky-irradiance-cache.parquet or irradiance_store directory, enables RDI and FRI")
+    parser.add_argument('--smart-persistence', type=Path, default=None, help="irradiance_store directory, skill is against smart persistence from the measured series instead of the file's persistence")
+    parser.add_argument('--output', type=Path, default=None, help="Csv to write, printed if not given")
+    args = parser.parse_args()
+    if args.smart_persistence is not None and args.clear_sky is not None:
+        # RDI and FRI start each ramp from the measured value at the id-time, which smart persistence is not
+        parser.error("--smart-persistence and --clear-sky can't be used together")
+    return args
+
+
+def main(args):
+    tables = []
+    for path in args.paths:
+        columns = None
+        if args.clear_sky is not None or args.smart_persistence is not None:
+            columns = [c for c in pq.ParquetFile(path).schema_arrow.names if c != results_loader.TIME_COL]
+        df = results_loader.load_results(path, columns=columns, cache=False)
+        if args.by == "category":
+            groups = category_groups(df.index, args.category_file)
+        elif args.by == "case-study":
+            groups = case_study_groups(df.index, read_case_studies(args.case_study_file))
+        else:
+            groups = None
+        clear_sky = None if args.clear_sky is None else read_clear_sky(args.clear_sky, df[results_loader.ID_COL])
+        persist_cols = None if args.smart_persistence is None else add_smart_persistence(df, args.smart_persistence)
+        table = evaluate(df, persist_cols=persist_cols, groups=groups, clear_sky=clear_sky)
+        tables.append(pd.concat({path.name: table}, names=["file"]))
+        logger.info(f"{path.name}: {len(table)} rows of metrics")
+    result = pd.concat(tables)
+    if args.output is None:
+        print(result.to_string())
+    else:
+        result.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    import logging.config
+    import json
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
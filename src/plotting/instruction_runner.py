@@ -0,0 +1,108 @@
+"""
+Runs json instruction files through a plotting function, one at a time, in batches or as a long lived worker.
+
+Used by json-to-interact.py and json-to-static.py so that imports are paid once per batch instead of once per plot:
+
+python3 json-to-interact.py instr.json                  # single instruction file
+python3 json-to-interact.py instr_dir/ a.json b.json    # every *.json in instr_dir, then a.json and b.json
+python3 json-to-interact.py --stdin                     # worker, reads one instruction file path or json object per line
+
+In worker mode a line "done <input>" or "error <input> <message>" is written to stdout after each instruction.
+Nothing else is written to stdout in worker mode: logging (logging_config.json) goes to stderr, and anything the
+plotting code prints is redirected to stderr.
+"""
+# Standard Library Modules
+from contextlib import redirect_stdout
+from pathlib import Path
+import json
+import sys
+import traceback
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def add_batch_args(parser):
+    '''
+    Adds the instruction file and worker arguments to an argparse parser.
+    '''
+    parser.add_argument('instr_files', type=Path, nargs='*', help="Json files with instructions, or directories of them")
+    parser.add_argument('--stdin', action='store_true', help="Run as a worker, reading instruction file paths (or json instructions) from stdin, one per line")
+    return parser
+
+
+def instruction_files(paths):
+    '''
+    Expands directories into the *.json files they contain.
+    :param paths: list of files and directories
+    :return: generator of instruction file paths
+    '''
+    for path in paths:
+        if path.is_dir():
+            yield from sorted(path.glob("*.json"))
+        else:
+            yield path
+
+
+def read_instruction(item):
+    '''
+    :param item: path to an instruction file, or a json object string
+    :return: the instruction dict
+    '''
+    if isinstance(item, str) and item.lstrip().startswith("{"):
+        return json.loads(item)
+    with open(item) as f:
+        return json.load(f)
+
+
+def run_stdin(plot_func, stream=sys.stdin, out=sys.stdout):
+    '''
+    Worker loop, runs ``plot_func`` on every instruction read from ``stream`` until it is closed.
+    :return: number of failed instructions
+    '''
+    failures = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            with redirect_stdout(sys.stderr):
+                plot_func(read_instruction(line))
+            print(f"done {line}", file=out, flush=True)
+        except Exception as e:
+            failures += 1
+            logger.error(f"Failed on {line}\n{traceback.format_exc()}")
+            print(f"error {line} {e!r}", file=out, flush=True)
+    return failures
+
+
+def run_files(plot_func, paths):
+    '''
+    Runs ``plot_func`` on every instruction file, continuing past failures.
+    :return: number of failed instructions
+    '''
+    failures = 0
+    for path in instruction_files(paths):
+        try:
+            plot_func(read_instruction(path))
+        except Exception:
+            failures += 1
+            logger.error(f"Failed on {path}\n{traceback.format_exc()}")
+    return failures
+
+
+def main(args, plot_func):
+    '''
+    Entry point for the json-to-* scripts, exits non-zero if any instruction failed.
+    '''
+    if args.stdin:
+        failures = run_stdin(plot_func)
+    elif len(args.instr_files) == 1 and args.instr_files[0].is_file():
+        # Single file, fail loudly as before
+        failures = 0
+        plot_func(read_instruction(args.instr_files[0]))
+    else:
+        failures = run_files(plot_func, args.instr_files)
+    if failures > 0:
+        sys.exit(f"{failures} instructions failed")
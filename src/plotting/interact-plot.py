@@ -1,18 +1,31 @@
+"""
+Interactive plots of a day of channel data in 10 minute windows
+
+The day file is read once and written to an uncompressed Arrow IPC file in shared memory (/dev/shm when available).
+Each worker memory maps it once and takes zero-copy slices for its windows, instead of re-reading the parquet per window.
+
+python3 interact-plot.py --date 2022-07-11
+python3 interact-plot.py --date 2022-07-11 --reread      # previous behaviour, re-read the parquet for every window
+python3 interact-plot.py --date 2022-07-11 --benchmark   # time loading every window both ways, no plotting
+"""
+import argparse
 import datetime
+import tempfile
+import time
 from pathlib import Path
 from multiprocessing import Pool
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import plotly_tools as plot_tools
-import sklearn.metrics as metrics
 
 #Logging
 import logging
 import logging.config
 import json
 
-with open("logging_config.json") as f:
+with open(Path(__file__).with_name("logging_config.json")) as f:
     log_config = json.load(f)
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
@@ -36,6 +49,40 @@ def get_df(date, start, end):
     subset_df = df.between_time(start, end).copy() # Copy to get rid of view/copy ambiguity
     return subset_df
 
+def share_day(date, out_dir):
+    """
+    Reads the day once and writes it, sorted by time, to an uncompressed Arrow IPC file that workers can memory map.
+    :return: path to the IPC file
+    """
+    df = pd.read_parquet(f"/work/{date}.parquet").sort_index(kind="stable")
+    table = pa.Table.from_pandas(df)
+    ipc_path = Path(out_dir) / f"{date}.arrow"
+    with pa.OSFile(str(ipc_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return ipc_path
+
+# Set once per worker by init_shared_day
+_day_table = None
+_day_index = None
+
+def init_shared_day(ipc_path):
+    """Pool initializer, memory maps the shared day and builds its time index once per worker"""
+    global _day_table, _day_index
+    _day_table = pa.ipc.open_file(pa.memory_map(str(ipc_path), "r")).read_all()
+    index_col = _day_table.schema.pandas_metadata["index_columns"][0]
+    _day_index = pd.DatetimeIndex(_day_table.column(index_col).to_pandas())
+
+def get_shared_df(date, start, end):
+    """Same rows as get_df, sliced from the memory mapped day without copying the data columns"""
+    print(f"{date} {start} {end}")
+    rows = _day_index.indexer_between_time(start, end)
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        subset = _day_table.slice(rows[0], len(rows))
+    else:
+        subset = _day_table.take(rows)
+    return subset.to_pandas(split_blocks=True)
+
 def custom_plot(df, date, suffix, channel):
     print("=============================================")
     out_dir = Path(f"/work/interact_CH{channel}")
@@ -47,12 +94,12 @@ def custom_plot(df, date, suffix, channel):
 
 def pool_func(args):
     date, start, end, suffix = args
-    df = get_df(date, start, end)
+    df = get_df(date, start, end) if _day_table is None else get_shared_df(date, start, end)
     for ch in range(1, 7):
         custom_plot(df, date, suffix, ch)
 
-def main():
-    dt = datetime.datetime(2022, 7, 11, 8)
+def make_time_list(date):
+    dt = datetime.datetime.combine(date, datetime.time(8))
     date = dt.strftime("%Y-%m-%d")
     time_list = []
     while dt.time() < datetime.time(23,0):
@@ -60,12 +107,52 @@ def main():
         dt = dt + datetime.timedelta(minutes=10)
         end = dt.time()
         time_list.append((date, start, end, str(start)))
-        
+    return time_list
+
+def benchmark(date, time_list):
+    """Times loading every window with a re-read per window against the shared day, without plotting"""
+    start = time.perf_counter()
+    reread_rows = sum(len(get_df(*args[:3])) for args in time_list)
+    reread_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory(dir="/dev/shm" if Path("/dev/shm").is_dir() else None) as tmp_dir:
+        start = time.perf_counter()
+        init_shared_day(share_day(date, tmp_dir))
+        setup_seconds = time.perf_counter() - start
+        shared_rows = sum(len(get_shared_df(*args[:3])) for args in time_list)
+        shared_seconds = time.perf_counter() - start
+
+    assert reread_rows == shared_rows, f"Row counts differ, {reread_rows} re-read vs {shared_rows} shared"
+    n = len(time_list)
+    logger.info(f"Re-read per window: {reread_seconds:.2f}s, {n / reread_seconds:.1f} windows/s")
+    logger.info(f"Shared day:         {shared_seconds:.2f}s ({setup_seconds:.2f}s setup), {n / shared_seconds:.1f} windows/s, {reread_seconds / shared_seconds:.1f}x")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Interactive plots of a day of channel data in 10 minute windows")
+    parser.add_argument('--date', type=datetime.date.fromisoformat, default=datetime.date(2022, 7, 11), help="Day to plot, reads /work/<date>.parquet")
+    parser.add_argument('--processes', type=int, default=3, help="Number of worker processes")
+    parser.add_argument('--reread', action='store_true', help="Re-read the parquet for every window instead of sharing the day")
+    parser.add_argument('--benchmark', action='store_true', help="Only time loading the windows both ways, no plots")
+    return parser.parse_args()
+
+def main(args):
+    time_list = make_time_list(args.date)
+    date = time_list[0][0]
+    if args.benchmark:
+        benchmark(date, time_list)
+        return
+
     print("Starting pool")
-    with Pool(processes=3, maxtasksperchild=1) as pool:
-        pool.imap_unordered(pool_func, time_list)
-        pool.close()
-        pool.join()
+    if args.reread:
+        with Pool(processes=args.processes, maxtasksperchild=1) as pool:
+            for _ in pool.imap_unordered(pool_func, time_list):
+                pass
+    else:
+        with tempfile.TemporaryDirectory(dir="/dev/shm" if Path("/dev/shm").is_dir() else None) as tmp_dir:
+            ipc_path = share_day(date, tmp_dir)
+            with Pool(processes=args.processes, initializer=init_shared_day, initargs=(ipc_path,)) as pool:
+                for _ in pool.imap_unordered(pool_func, time_list):
+                    pass
     print("Done")
 
 def custom_plot2(df, date, suffix):
@@ -88,4 +175,4 @@ def main2():
     custom_plot2(df, date, str(start))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file
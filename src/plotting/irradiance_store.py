@@ -0,0 +1,287 @@
+"""
+Date partitioned store of the measured irradiance series, with binary search range lookups
+
+The daily ``BlackMountain_<date>_cloud_projection.csv.gz`` files are converted once into one time sorted parquet file
+per day, ``<store>/<year>/<date>.parquet``, with a ``time`` timestamp column and float32 measurements.
+``_index.parquet`` holds the date, row count, first and last time of every day, and the source file's mtime and size
+so a rebuild only converts new or changed days.
+Lookups find the days of a window from the index and the rows within each day with ``searchsorted``
+on the sorted times, so nothing is parsed or scanned at lookup time.
+
+    import irradiance_store
+    store = irradiance_store.IrradianceStore("/work/irradiance-store")
+    df = store.read("2015-12-19 11:30:00", "2015-12-19 11:50:00", columns=["GlobalCMP11Physical"])
+    clear_sky = store.lookup(df.index, "ClearSkyGHI")
+    smart_persist = irradiance_store.persistence(store, df.index, smart=True, horizon=420)
+
+python3 irradiance_store.py /work/irradiance-store build /data/blackmountain/irradiance/2015 --processes 8
+python3 irradiance_store.py /work/irradiance-store read --start "2015-12-19 11:30:00" --end "2015-12-19 11:50:00"
+"""
+# Standard Library Modules
+from collections import OrderedDict
+from multiprocessing import Pool
+from pathlib import Path
+import argparse
+import os
+import re
+
+# External Modules
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Local Modules
+import results_loader
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "_index.parquet"
+SOURCE_GLOB = "*_cloud_projection.csv.gz"
+SOURCE_TIME_COL = "Timestamp"
+SOURCE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIME_COL = "time"
+GHI_COL = "GlobalCMP11Physical"
+CLEAR_SKY_COL = "ClearSkyGHI"
+COLUMNS = [GHI_COL, CLEAR_SKY_COL, "DirectCHP1Physical", "DiffuseCMP11Physical", "SunZenith", "SunAzimuth"]
+DAY_CACHE_SIZE = 32
+
+
+def source_date(path) -> str:
+    '''The date of a daily source file, eg. BlackMountain_2015-01-01_cloud_projection.csv.gz -> 2015-01-01'''
+    match = re.search(r"(\d{4}-\d{2}-\d{2})", Path(path).name)
+    return None if match is None else match.group(1)
+
+
+def sorted_range(times: np.ndarray, start=None, end=None) -> slice:
+    '''
+    Binary search for an inclusive time window in sorted times.
+    :param times: sorted datetime64 array (or DatetimeIndex)
+    :param start: optional inclusive start (``TIME_FORMAT`` string, ISO string or datetime)
+    :param end: optional inclusive end
+    :return: slice of the rows inside the window
+    '''
+    start, end = results_loader.parse_time(start), results_loader.parse_time(end)
+    times = np.asarray(times, dtype="datetime64[ns]")
+    first = 0 if start is None else np.searchsorted(times, start.to_datetime64(), side="left")
+    last = len(times) if end is None else np.searchsorted(times, end.to_datetime64(), side="right")
+    return slice(first, max(first, last))
+
+
+def as_times(times) -> pd.DatetimeIndex:
+    '''Datetimes, or strings in ``TIME_FORMAT`` such as an ``id-time`` column, as a DatetimeIndex'''
+    if len(times) > 0 and isinstance(np.asarray(times)[0], str):
+        return pd.DatetimeIndex(pd.to_datetime(np.asarray(times), format=results_loader.TIME_FORMAT))
+    return pd.DatetimeIndex(times)
+
+
+def convert(args) -> dict:
+    '''
+    Pool function: converts one daily csv into a time sorted parquet day file.
+    :param args: (source path, store root, columns to keep)
+    :return: index record for the day
+    '''
+    path, root, columns = args
+    date = source_date(path)
+    df = pd.read_csv(path, usecols=lambda c: c == SOURCE_TIME_COL or c in columns)
+    times = pd.to_datetime(df[SOURCE_TIME_COL], format=SOURCE_TIME_FORMAT)
+    order = np.argsort(times.values, kind="stable")
+    table = pa.table({TIME_COL: pa.array(times.values[order].astype("datetime64[s]")),
+                      **{c: pa.array(df[c].to_numpy(dtype=np.float32)[order]) for c in columns if c in df.columns}})
+    day_path = Path(root) / date[:4] / f"{date}.parquet"
+    day_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = day_path.with_name(f".{day_path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, day_path)
+    stat = Path(path).stat()
+    return {"date": date,
+            "source": str(Path(path).resolve()),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "rows": table.num_rows,
+            "first": times.min() if len(times) > 0 else pd.NaT,
+            "last": times.max() if len(times) > 0 else pd.NaT}
+
+
+class IrradianceStore:
+    '''
+    A date partitioned irradiance store rooted at a directory, see the module docstring for the layout.
+    '''
+    def __init__(self, root, cache_size: int = DAY_CACHE_SIZE):
+        self.root = Path(root)
+        self.cache_size = cache_size
+        self._day_cache = OrderedDict()
+        self._index = None
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / INDEX_FILE
+
+    def index(self) -> pd.DataFrame:
+        '''One row per stored day, sorted by date'''
+        if self._index is None:
+            if self.index_path.exists():
+                self._index = pd.read_parquet(self.index_path).sort_values("date", ignore_index=True)
+            else:
+                self._index = pd.DataFrame(columns=["date", "source", "mtime_ns", "size", "rows", "first", "last"])
+        return self._index
+
+    def build(self, paths, processes: int = None, columns: list = COLUMNS, force: bool = False) -> pd.DataFrame:
+        '''
+        Converts the daily csv files that are new or changed since the last build, in parallel.
+        :param paths: daily csv files, or directories to search for them
+        :param processes: worker processes, defaults to the number of CPUs
+        :param columns: measurement columns to keep
+        :param force: convert every file, even if it is unchanged
+        :return: index records of the days written
+        '''
+        files = []
+        for path in map(Path, paths):
+            files += sorted(path.rglob(SOURCE_GLOB)) if path.is_dir() else [path]
+        index = self.index()
+        known = {(row.source, row.mtime_ns, row.size) for row in index.itertuples()}
+        jobs = []
+        for path in files:
+            stat = path.stat()
+            if source_date(path) is None:
+                logger.warning(f"Skipping {path}, no date in its name")
+            elif force or (str(path.resolve()), stat.st_mtime_ns, stat.st_size) not in known:
+                jobs.append((path, self.root, list(columns)))
+        logger.info(f"Converting {len(jobs)} of {len(files)} days into {self.root}")
+        if len(jobs) == 0:
+            return index.iloc[:0]
+        with Pool(processes=processes) as pool:
+            written = pd.DataFrame(pool.imap_unordered(convert, jobs))
+        index = pd.concat([index[~index["date"].isin(written["date"])], written], ignore_index=True).sort_values("date", ignore_index=True)
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_name(f".{INDEX_FILE}.tmp")
+        index.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.index_path)
+        self._index = index
+        self._day_cache.clear()
+        logger.info(f"Converted {len(written)} days, {written['rows'].sum()} rows")
+        return written
+
+    def day(self, date: str) -> tuple:
+        '''
+        :param date: "YYYY-MM-DD"
+        :return: (sorted datetime64[ns] times, pyarrow table of the day), cached
+        '''
+        if date in self._day_cache:
+            self._day_cache.move_to_end(date)
+            return self._day_cache[date]
+        table = pq.read_table(self.root / date[:4] / f"{date}.parquet")
+        times = table.column(TIME_COL).to_numpy().astype("datetime64[ns]")
+        self._day_cache[date] = (times, table)
+        while len(self._day_cache) > self.cache_size:
+            self._day_cache.popitem(last=False)
+        return times, table
+
+    def days(self, start=None, end=None) -> list:
+        '''The stored dates with rows inside an inclusive window, found by binary search on the index'''
+        index = self.index()
+        start, end = results_loader.parse_time(start), results_loader.parse_time(end)
+        first = 0 if start is None else np.searchsorted(index["last"].values, start.to_datetime64(), side="left")
+        last = len(index) if end is None else np.searchsorted(index["first"].values, end.to_datetime64(), side="right")
+        return list(index["date"].iloc[first:last])
+
+    def read(self, start=None, end=None, columns: list = None) -> pd.DataFrame:
+        '''
+        Reads the measured series inside an inclusive time window.
+        :param start: optional inclusive start (``TIME_FORMAT`` string, ISO string or datetime)
+        :param end: optional inclusive end
+        :param columns: measurement columns, defaults to every stored column
+        :return: frame with a sorted ``datetime`` index
+        '''
+        frames = []
+        for date in self.days(start, end):
+            times, table = self.day(date)
+            rows = sorted_range(times, start, end)
+            names = [c for c in table.column_names if c != TIME_COL] if columns is None else list(columns)
+            part = table.select(names).slice(rows.start, rows.stop - rows.start).to_pandas()
+            part.index = pd.DatetimeIndex(times[rows], name="datetime")
+            frames.append(part)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns if columns is not None else [], index=pd.DatetimeIndex([], name="datetime"))
+        return pd.concat(frames)
+
+    def lookup(self, times, column: str = GHI_COL) -> np.ndarray:
+        '''
+        Values of one column at the given times, eg. the clear sky GHI at each id-time of a results file.
+        :param times: datetimes, or strings in ``TIME_FORMAT``
+        :return: float array aligned with times, NaN where the store has no row at that time
+        '''
+        times = as_times(times)
+        out = np.full(len(times), np.nan)
+        values = times.values
+        dates = times.strftime("%Y-%m-%d")
+        stored = set(self.index()["date"])
+        for date in pd.unique(dates):
+            if date not in stored:
+                continue
+            positions = np.flatnonzero(dates == date)
+            day_times, table = self.day(date)
+            rows = np.searchsorted(day_times, values[positions])
+            found = rows < len(day_times)
+            found[found] = day_times[rows[found]] == values[positions][found]
+            column_values = table.column(column).to_numpy()
+            out[positions[found]] = column_values[rows[found]]
+        return out
+
+
+def persistence(store: IrradianceStore, id_times, smart: bool = False, horizon: int = None) -> np.ndarray:
+    '''
+    Persistence baseline from the measured series.
+    :param store: irradiance store
+    :param id_times: times the forecasts are made at
+    :param smart: persist the clear sky index instead of the GHI, needs the horizon
+    :param horizon: forecast horizon in seconds
+    :return: forecast for id_time + horizon, aligned with id_times
+    '''
+    ghi = store.lookup(id_times, GHI_COL)
+    if not smart:
+        return ghi
+    id_times = as_times(id_times)
+    clear_sky_now = store.lookup(id_times, CLEAR_SKY_COL)
+    clear_sky_target = store.lookup(id_times + pd.Timedelta(seconds=horizon), CLEAR_SKY_COL)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(clear_sky_now > 0, ghi / clear_sky_now * clear_sky_target, ghi)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build and read a date partitioned store of the measured irradiance")
+    parser.add_argument('store', type=Path, help="Root directory of the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Convert new and changed daily csv files")
+    build.add_argument('paths', type=Path, nargs='+', help="Daily *_cloud_projection.csv.gz files, or directories of them")
+    build.add_argument('--processes', type=int, default=None, help="Number of worker processes, defaults to the number of CPUs")
+    build.add_argument('--columns', type=str, nargs='+', default=COLUMNS, help="Measurement columns to keep")
+    build.add_argument('--force', action='store_true', help="Convert unchanged files again")
+    read = commands.add_parser("read", help="Read a time window")
+    read.add_argument('--start', type=str, default=None, help="Inclusive start of the window")
+    read.add_argument('--end', type=str, default=None, help="Inclusive end of the window")
+    read.add_argument('--columns', type=str, nargs='+', default=None, help="Columns to read")
+    read.add_argument('--output', type=Path, default=None, help="Csv to write, printed if not given")
+    return parser.parse_args()
+
+
+def main(args):
+    store = IrradianceStore(args.store)
+    if args.command == "build":
+        store.build(args.paths, args.processes, args.columns, args.force)
+        return
+    df = store.read(args.start, args.end, args.columns)
+    if args.output is None:
+        print(df.to_string())
+    else:
+        df.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    import logging.config
+    import json
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
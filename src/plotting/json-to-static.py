@@ -3,15 +3,14 @@ Plot single day with metrics
 """
 # Standard Library Modules
 from pathlib import Path
-from datetime import datetime
-import math
 import argparse
-import json
 
 # External Modules
-import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
+
+# Local Modules
+import results_loader
+import instruction_runner
 
 
 def line_timeseries(df, labels=None, ax_title="", fig_title="", filebase="plot", out_dir=Path("")):
@@ -30,29 +29,18 @@ def line_timeseries(df, labels=None, ax_title="", fig_title="", filebase="plot",
     plt.close(fig)
 
 
-def read_parquet(path):
-    df = pd.read_parquet(path)
-    df["datetime"] = pd.to_datetime(df["predicted-time"], format="%Y-%m-%d_%H-%M-%S")
-    df["date"] = df["datetime"].dt.strftime("%Y-%m-%d")
-    df = df.set_index("datetime")
-    df = df.sort_index()
-    df = df.drop(columns=["date", "id-time", "predicted-time"])
-    cols=df.columns.tolist()
-    cols.sort()
-    df = df[cols]
-    return df
-
-
 def parse_args():
-    parser = argparse.ArgumentParser(description="CLI script to crop and resize images")
-    parser.add_argument('instr_file', type=Path, help="Json file with instructions")
+    parser = argparse.ArgumentParser(description="CLI script to make static plots from json instruction files")
+    parser = instruction_runner.add_batch_args(parser)
     return parser.parse_args()
 
 
+def plot_instr(instr):
+    line_timeseries(results_loader.load_results(instr["path"], sort_columns=True, cache=False), fig_title=instr["title"], filebase=instr["title"], out_dir=instr["out-dir"])
+
+
 def main(args):
-    with open(args.instr_file) as f:
-        instr = json.load(f)
-    line_timeseries(read_parquet(instr["path"]), fig_title=instr["title"], filebase=instr["title"], out_dir=instr["out-dir"])
+    instruction_runner.main(args, plot_instr)
 
 if __name__ == '__main__':
     main(parse_args())
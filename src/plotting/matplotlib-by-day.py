@@ -9,14 +9,16 @@ import math
 # External Modules
 import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
+
+# Local Modules
+import results_loader
 
 #Logging
 import logging
 import logging.config
 import json
 
-with open("logging_config.json") as f:
+with open(Path(__file__).with_name("logging_config.json")) as f:
     log_config = json.load(f)
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
@@ -44,15 +46,6 @@ def line_timeseries(df, labels, ax_title="", fig_title="", filebase="plot", outp
     plt.close(fig)
 
 
-def read_parquet(path):
-    df = pd.read_parquet(path)
-    df["datetime"] = pd.to_datetime(df["predicted-time"], format="%Y-%m-%d_%H-%M-%S")
-    df["date"] = df["datetime"].dt.strftime("%Y-%m-%d")
-    df = df.set_index("datetime")
-    df = df.sort_index()
-    return df
-    
-
 def plot_date():
     print(f"Plotting from {left_file} {right_file} for date {date}")
     
@@ -68,8 +61,7 @@ def plot_dir(basedir="/work/processed-runs/blackmountain", outdir="/work"):
         output_dir = outdir / stem
         output_dir.mkdir(exist_ok=True)
         logger.debug(f"Working with {stem}")
-        df = read_parquet(f)
-        df = df.drop(columns=["predicted-time", "id-time"])
+        df = results_loader.load_results(f)
 
         actual_label = df.columns[0]
         model_label = df.columns[1]
@@ -81,11 +73,8 @@ def plot_dir(basedir="/work/processed-runs/blackmountain", outdir="/work"):
         if not "persist" in persist_label:
             raise WrongColumnError(f"{persist_label} is meant to be the persist column")
 
-        dates = df["date"].unique()
-        for date in dates:
+        for date, date_df in df.groupby(df.index.date):
             logger.debug(f"processing {date}")
-            date_df = df[df["date"] == date]
-            date_df = date_df.drop(columns=["date"])
             axis_title = "Axis Title"
             figure_title = "figure Title"
             file_base = f"{date}_{stem}"
@@ -10,7 +10,9 @@ import math
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
+
+# Local Modules
+import results_loader
 
 def line_timeseries(df, labels, ax_title="", fig_title="", filebase="plot", output_dir=Path("")):
     fig, ax = plt.subplots()
@@ -27,14 +29,6 @@ def line_timeseries(df, labels, ax_title="", fig_title="", filebase="plot", outp
     plt.close(fig)
 
 
-def read_parquet(path):
-    df = pd.read_parquet(path)
-    df["datetime"] = pd.to_datetime(df["predicted-time"], format="%Y-%m-%d_%H-%M-%S")
-    df["date"] = df["datetime"].dt.strftime("%Y-%m-%d")
-    df = df.set_index("datetime")
-    df = df.sort_index()
-    return df
-
 def plot_common(x, date, figure_title, short_descriptor):
     actual_label = x.columns[0]
     model_label = x.columns[1]
@@ -60,9 +54,7 @@ def plot_common(x, date, figure_title, short_descriptor):
 
 def plot_sample1():
     date = "2015-01-31"
-    df = read_parquet("/work/processed-runs/blackmountain-round_2_blackmountain-ramp-round/wide-na/blackmountain-round_2_blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet")
-    date_df = df[df["date"] == date]
-    date_df = date_df.drop(columns=["date", "predicted-time", "id-time"])
+    date_df = results_loader.load_results("/work/processed-runs/blackmountain-round_2_blackmountain-ramp-round/wide-na/blackmountain-round_2_blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet", date=date)
     x = date_df.between_time("12:16", "12:39").copy() # Copy to get rid of view/copy ambiguity
     
     short_descriptor = "bmr2bmrr"
@@ -70,9 +62,7 @@ def plot_sample1():
     plot_common(x, date, figure_title, short_descriptor)
 
     # -------------- #
-    df = read_parquet("/work/processed-runs/blackmountain-round/wide-na/blackmountain-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet")
-    date_df = df[df["date"] == date]
-    date_df = date_df.drop(columns=["date", "predicted-time", "id-time"])
+    date_df = results_loader.load_results("/work/processed-runs/blackmountain-round/wide-na/blackmountain-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet", date=date)
     x = date_df.between_time("12:16", "12:39").copy() # Copy to get rid of view/copy ambiguity
 
     short_descriptor = "bmr"
@@ -80,9 +70,7 @@ def plot_sample1():
     plot_common(x, date, figure_title, short_descriptor)
 
     # -------------- #
-    df = read_parquet("/work/processed-runs/blackmountain-ramp-round/wide-na/blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet")
-    date_df = df[df["date"] == date]
-    date_df = date_df.drop(columns=["date", "predicted-time", "id-time"])
+    date_df = results_loader.load_results("/work/processed-runs/blackmountain-ramp-round/wide-na/blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet", date=date)
     x = date_df.between_time("12:16", "12:39").copy() # Copy to get rid of view/copy ambiguity
 
     short_descriptor = "bmrr"
@@ -92,9 +80,7 @@ def plot_sample1():
 
 def plot_sample2():
     date = "2015-02-05"
-    df = read_parquet("/work/processed-runs/blackmountain-round_2_blackmountain-ramp-round/wide-na/blackmountain-round_2_blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet")
-    date_df = df[df["date"] == date]
-    date_df = date_df.drop(columns=["date", "predicted-time", "id-time"])
+    date_df = results_loader.load_results("/work/processed-runs/blackmountain-round_2_blackmountain-ramp-round/wide-na/blackmountain-round_2_blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet", date=date)
     x = date_df.between_time("12:31", "12:54").copy() # Copy to get rid of view/copy ambiguity
 
     short_descriptor = "bmr2bmrr"
@@ -102,9 +88,7 @@ def plot_sample2():
     plot_common(x, date, figure_title, short_descriptor)
 
     # -------------- #
-    df = read_parquet("/work/processed-runs/blackmountain-round/wide-na/blackmountain-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet")
-    date_df = df[df["date"] == date]
-    date_df = date_df.drop(columns=["date", "predicted-time", "id-time"])
+    date_df = results_loader.load_results("/work/processed-runs/blackmountain-round/wide-na/blackmountain-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet", date=date)
     x = date_df.between_time("12:31", "12:54").copy() # Copy to get rid of view/copy ambiguity
 
     short_descriptor = "bmr"
@@ -112,9 +96,7 @@ def plot_sample2():
     plot_common(x, date, figure_title, short_descriptor)
 
     # -------------- #
-    df = read_parquet("/work/processed-runs/blackmountain-ramp-round/wide-na/blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet")
-    date_df = df[df["date"] == date]
-    date_df = date_df.drop(columns=["date", "predicted-time", "id-time"])
+    date_df = results_loader.load_results("/work/processed-runs/blackmountain-ramp-round/wide-na/blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0_wide-na.parquet", date=date)
     x = date_df.between_time("12:31", "12:54").copy() # Copy to get rid of view/copy ambiguity
 
     short_descriptor = "bmrr"
@@ -1,5 +1,6 @@
 import os
 import re
+import warnings
 from pathlib import Path
 from pprint import pformat
 from typing import Union
@@ -7,30 +8,26 @@ from typing import Union
 from plotly.graph_objs import Figure
 from plotly.graph_objs.scattergl import Legendgrouptitle
 from plotly.subplots import make_subplots
-import plotly.graph_objects as go
-import sklearn
 import numpy as np
 import pandas as pd
 import plotly
-import plotly.express as px
+import plotly.colors
 import plotly.graph_objects as go
-import plotly.io as pio
-import seaborn as sns
-from matplotlib.colors import ListedColormap
-import webbrowser
+# plotly.express, plotly.io, seaborn, matplotlib, sklearn and webbrowser are slow to import and only needed by some functions,
+# so they're imported inside the functions that use them
 
 #Logging
 import logging
 import logging.config
 import json
 
-with open("logging_config.json") as f:
+with open(Path(__file__).with_name("logging_config.json")) as f:
     log_config = json.load(f)
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
 
 
-def boxplot_by_category(df, title, group_col=None, out_dir='.', saveHTML=True, show_plot=False, height=800, xtitle=None, ytitle=None, boxpoints='suspectedoutliers', fence_percentiles=None, verbose=0):
+def boxplot_by_category(df, title, group_col=None, out_dir='.', saveHTML=True, show_plot=False, height=800, xtitle=None, ytitle=None, boxpoints='suspectedoutliers', fence_percentiles=None, summary_only=False, verbose=0):
     '''
     Draws boxplots grouped on the x axis by unique values of ``group_col``.
     :param df: Dataframe to plot
@@ -44,8 +41,10 @@ def boxplot_by_category(df, title, group_col=None, out_dir='.', saveHTML=True, s
     :param ytitle:
     :param boxpoints: how can be 'all','outliers', 'suspectedoutliers' or False.  See https://plotly.com/python/box-plots/
     :param fence_percentiles: custom percentiles for the upper and lower fence (whisker-end) positions. Eg, for the 5th and 95th percentiles, use fence_percentile=[5,95].  None uses plotly defaults.
+    :param summary_only: if True, only the precomputed box statistics (see ``summary_statistics``) are sent to plotly, no raw points, so the report size doesn't depend on the number of rows.
     :return:
     '''
+    import plotly.io as pio
     PLOTLY_TEMPLATE = "seaborn"
     TEMPLATE_COLOURS = pio.templates[PLOTLY_TEMPLATE].layout["colorway"]
 
@@ -55,13 +54,18 @@ def boxplot_by_category(df, title, group_col=None, out_dir='.', saveHTML=True, s
     # Get unique colour for each model
     colours = {m: TEMPLATE_COLOURS[ii % len(TEMPLATE_COLOURS)] for ii, m in enumerate(models)}
 
+    # Precompute the box statistics for every column and group in one pass
+    summary = None
+    if summary_only or fence_percentiles is not None:
+        # ddof=1 as the groupby std this replaced
+        summary = summary_statistics(df, group_col=group_col, fence_percentiles=fence_percentiles, ddof=1)
+
     # Create the figure
     fig = go.Figure()
     for c in sorted(set(df.columns) - {group_col}):
-        data = df[[c, group_col]].dropna()
-        data = data.sort_values(group_col)
-        fig = go.Figure()
-        if fence_percentiles is None:
+        if summary is None:
+            data = df[[c, group_col]].dropna()
+            data = data.sort_values(group_col)
             fig.add_trace(
                 go.Box(
                     x=list(map(str, data[group_col])),
@@ -76,22 +80,23 @@ def boxplot_by_category(df, title, group_col=None, out_dir='.', saveHTML=True, s
             )
 
         else:
+            stats = summary.xs(c, level="column").dropna(subset=["median"])
             fig.add_trace(
                 go.Box(
-                    x=pd.unique(list(map(str, data[group_col]))),
+                    x=list(map(str, stats.index)),
                     name=c,
                     legendgroup=c,
                     text="{}:".format(c),
                     line_color=colours[c],
-                    boxpoints=boxpoints,
+                    boxpoints=False if summary_only else boxpoints,
                     boxmean=True,
-                    q1=data.groupby(group_col)[c].agg(np.percentile, ([25])).values,
-                    median=data.groupby(group_col)[c].agg(np.percentile, ([50])).values,
-                    mean=data.groupby(group_col)[c].agg(np.mean).values,
-                    sd=data.groupby(group_col)[c].agg(np.std).values,
-                    q3=data.groupby(group_col)[c].agg(np.percentile, ([75])).values,
-                    lowerfence=data.groupby(group_col)[c].agg(np.percentile, ([fence_percentiles[0]])).values,
-                    upperfence=data.groupby(group_col)[c].agg(np.percentile, ([fence_percentiles[1]])).values,
+                    q1=stats["q1"].values,
+                    median=stats["median"].values,
+                    mean=stats["mean"].values,
+                    sd=stats["sd"].values,
+                    q3=stats["q3"].values,
+                    lowerfence=stats["lowerfence"].values,
+                    upperfence=stats["upperfence"].values,
                     orientation='v',
                 )
             )
@@ -115,7 +120,7 @@ def boxplot_by_category(df, title, group_col=None, out_dir='.', saveHTML=True, s
     return fig
 
 
-def boxplot_by_column(df, title, out_dir='.', saveHTML=True, show_plot=False, height=800, xtitle=None, ytitle=None, boxpoints='suspectedoutliers', fence_percentiles=None, verbose=0):
+def boxplot_by_column(df, title, out_dir='.', saveHTML=True, show_plot=False, height=800, xtitle=None, ytitle=None, boxpoints='suspectedoutliers', fence_percentiles=None, summary_only=False, verbose=0):
     '''
     Draw boxplots, showing one box for each dataframe column.
     :param df: Dataframe to plot
@@ -128,8 +133,10 @@ def boxplot_by_column(df, title, out_dir='.', saveHTML=True, show_plot=False, he
     :param ytitle:
     :param boxpoints: how can be 'all','outliers', 'suspectedoutliers' or False.  See https://plotly.com/python/box-plots/
     :param fence_percentiles: custom percentiles for the upper and lower fence (whisker-end) positions. Eg, for the 5th and 95th percentiles, use fence_percentile=[5,95].  None uses plotly defaults.
+    :param summary_only: if True, only the precomputed box statistics (see ``summary_statistics``) are sent to plotly, no raw points, so the report size doesn't depend on the number of rows.
     :return:
     '''
+    import plotly.io as pio
     PLOTLY_TEMPLATE = "seaborn"
     TEMPLATE_COLOURS = pio.templates[PLOTLY_TEMPLATE].layout["colorway"]
 
@@ -139,10 +146,15 @@ def boxplot_by_column(df, title, out_dir='.', saveHTML=True, show_plot=False, he
     # Get unique colour for each model
     colours = {m: TEMPLATE_COLOURS[ii % len(TEMPLATE_COLOURS)] for ii, m in enumerate(models)}
 
+    # Precompute the box statistics for every column in one pass
+    summary = None
+    if summary_only or fence_percentiles is not None:
+        summary = summary_statistics(df, fence_percentiles=fence_percentiles)
+
     # Create the figure
     fig = go.Figure()
     for c in df.columns:
-        if fence_percentiles is None:
+        if summary is None:
             fig.add_trace(
                 go.Box(
                     y=df[c],
@@ -155,22 +167,23 @@ def boxplot_by_column(df, title, out_dir='.', saveHTML=True, show_plot=False, he
                 )
             )
         else:
+            stats = summary.loc[c]
             fig.add_trace(
                 go.Box(
-                    y=df[c],
+                    **({'x': [c]} if summary_only else {'y': df[c]}),
                     name=c,
                     legendgroup=c,
                     text="{}: ".format(c),
                     line_color=colours[c],
-                    boxpoints=boxpoints,
+                    boxpoints=False if summary_only else boxpoints,
                     boxmean=True,
-                    q1=[np.percentile(df[c], 25)],
-                    median=[np.percentile(df[c], 50)],
-                    mean=[np.mean(df[c])],
-                    sd=[np.std(df[c])],
-                    q3=[np.percentile(df[c], 75)],
-                    lowerfence=[np.percentile(df[c], fence_percentiles[0])],
-                    upperfence=[np.percentile(df[c], fence_percentiles[1])],
+                    q1=[stats["q1"]],
+                    median=[stats["median"]],
+                    mean=[stats["mean"]],
+                    sd=[stats["sd"]],
+                    q3=[stats["q3"]],
+                    lowerfence=[stats["lowerfence"]],
+                    upperfence=[stats["upperfence"]],
                     orientation='v',
                 )
             )
@@ -194,6 +207,101 @@ def boxplot_by_column(df, title, out_dir='.', saveHTML=True, show_plot=False, he
     return fig
 
 
+def summary_statistics(df: pd.DataFrame, group_col: str = None, fence_percentiles: list = None, ddof: int = 0) -> pd.DataFrame:
+    '''
+    Computes box plot statistics (count, mean, sd, quartiles and fences) for every column of ``df`` in one vectorised pass, optionally for each unique value of ``group_col``.
+    NaNs are ignored per column, rows with a NaN group are dropped.
+    :param df: Dataframe to summarise
+    :param group_col: optional name of a column to group the data by.
+    :param fence_percentiles: percentiles for the lower and upper fences, eg [5, 95].  None gives plotly's default fences: the furthest points within 1.5 IQR of the box.
+    :param ddof: delta degrees of freedom of the sd, 0 (population sd, as np.std) by default.
+    :return: a dataframe with one row per column (indexed by ``column``), or per group and column (indexed by ``group_col``, ``column``), with columns count, mean, sd, min, q1, median, q3, max, lowerfence, upperfence.
+    '''
+    cols = [c for c in df.columns if c != group_col]
+    values = df[cols].to_numpy(dtype=np.float64)
+    if group_col is None:
+        codes = np.zeros(len(df), dtype=np.int64)
+        groups = [None]
+    else:
+        codes, groups = pd.factorize(df[group_col], sort=True)
+        values = values[codes >= 0]
+        codes = codes[codes >= 0]
+    index = pd.Index(cols, name="column") if group_col is None else pd.MultiIndex.from_product([groups, cols], names=[group_col, "column"])
+    if len(values) == 0:
+        summary = pd.DataFrame(np.nan, index=index, columns=["count", "mean", "sd", "min", "q1", "median", "q3", "max", "lowerfence", "upperfence"])
+        summary["count"] = 0
+        return summary
+
+    # Sort every column by (group, value), NaNs last within each group, so that each group is a contiguous sorted block
+    order = np.argsort(values, axis=0, kind="stable")
+    order = np.take_along_axis(order, np.argsort(codes[order], axis=0, kind="stable"), axis=0)
+    values = np.take_along_axis(values, order, axis=0)
+    codes = np.sort(codes)
+    starts = np.searchsorted(codes, np.arange(len(groups)))
+
+    # Moments for every group and column at once, two pass so the sd doesn't lose precision to cancellation
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid, starts, axis=0).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0) / count
+        deviation = np.where(valid, values - mean[codes], 0.0)
+        total_sq = np.add.reduceat(deviation * deviation, starts, axis=0)
+        sd = np.sqrt(total_sq / (count - ddof))
+    sd[count - ddof <= 0] = np.nan
+
+    def sorted_value(position):
+        '''Values at a (group, column) array of positions within each sorted group block, NaN for empty groups'''
+        position = np.clip(position, 0, np.maximum(count - 1, 0)).astype(np.int64)
+        rows = np.minimum(starts[:, None] + position, len(values) - 1)
+        out = np.take_along_axis(values, rows, axis=0)
+        return np.where(count > 0, out, np.nan)
+
+    def percentile(q):
+        '''Linear interpolation between the closest ranks, as np.nanpercentile'''
+        position = (count - 1) * q / 100
+        below = np.floor(position)
+        lower, upper = sorted_value(below), sorted_value(below + 1)
+        return lower + (upper - lower) * np.where(position > below, position - below, 0.0)
+
+    lo, q1, median, q3, hi = sorted_value(np.zeros(count.shape)), percentile(25), percentile(50), percentile(75), sorted_value(count - 1)
+    if fence_percentiles is None:
+        # The first and last points of each block within 1.5 IQR of the box
+        iqr = q3 - q1
+        below_fence = np.add.reduceat(valid & (values < (q1 - 1.5 * iqr)[codes]), starts, axis=0)
+        within_fence = np.add.reduceat(valid & (values <= (q3 + 1.5 * iqr)[codes]), starts, axis=0)
+        lowerfence, upperfence = sorted_value(below_fence), sorted_value(within_fence - 1)
+    else:
+        lowerfence, upperfence = percentile(fence_percentiles[0]), percentile(fence_percentiles[1])
+    stats = np.stack([s.ravel() for s in [lo, q1, median, q3, hi, lowerfence, upperfence]], axis=1)
+
+    summary = pd.DataFrame(stats, index=index, columns=["min", "q1", "median", "q3", "max", "lowerfence", "upperfence"])
+    summary.insert(0, "sd", sd.ravel())
+    summary.insert(0, "mean", mean.ravel())
+    summary.insert(0, "count", count.ravel().astype(np.int64))
+    return summary
+
+
+def histogram_counts(df: pd.DataFrame, nbins: int = 200) -> pd.DataFrame:
+    '''
+    Bins every column of ``df`` into the same ``nbins`` equal-width bins in one vectorised pass, ignoring NaNs.
+    :param df: Dataframe to bin
+    :param nbins: number of bins spanning the min to max of all columns
+    :return: a dataframe of counts with one column per ``df`` column, indexed by the bin centres.
+    '''
+    values = df.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return pd.DataFrame(columns=df.columns, dtype=np.int64)
+    lo, hi = values[valid].min(), values[valid].max()
+    width = (hi - lo) / nbins if hi > lo else 1.0
+    edges = lo + width * np.arange(nbins + 1)
+
+    bins = np.clip(((np.where(valid, values, lo) - lo) / width).astype(np.int64), 0, nbins - 1)
+    flat = (bins + nbins * np.arange(values.shape[1]))[valid]
+    counts = np.bincount(flat, minlength=nbins * values.shape[1]).reshape(values.shape[1], nbins)
+    return pd.DataFrame(counts.T, index=pd.Index((edges[:-1] + edges[1:]) / 2, name="bin"), columns=df.columns)
+
+
 def bar(df, title, out_dir='.', error_df=None, saveHTML=True, show_plot=False, show_menu=True, height=800):
     '''
     Draws each columns of a dataframe as a separate trace in a plotly plot.
@@ -259,7 +367,34 @@ def bar(df, title, out_dir='.', error_df=None, saveHTML=True, show_plot=False, s
     return fig
 
 
-def scatter(df: pd.DataFrame, title='', out_dir='.', trend_degree: int = [1], colour_col: str = None, saveHTML=True, show_plot=False, draw_mode='markers', height=800):
+def confidence_intervals(ci_df: pd.DataFrame, metric: str, title='', out_dir='.', sort=True, saveHTML=True, show_plot=False, height=None):
+    '''
+    Dot and whisker plot of the intervals for one metric from a CI table (see bootstrap_ci.ci_table), one row per name.
+    :param ci_df: long CI table with name, metric, estimate, lower and upper columns
+    :param metric: metric to plot, eg. 'rmse'
+    :param title:
+    :param out_dir:
+    :param sort: order the rows by estimate
+    :param saveHTML:
+    :param show_plot:
+    :param height: defaults to 25px per row
+    :return:
+    '''
+    td = ci_df[ci_df["metric"] == metric]
+    if sort:
+        td = td.sort_values("estimate")
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=td["estimate"], y=td["name"], mode='markers', name=metric, hoverlabel=dict(namelength=-1),
+                             error_x=dict(type='data', symmetric=False, array=td["upper"] - td["estimate"], arrayminus=td["estimate"] - td["lower"])))
+    fig.update_layout(title=title, height=height if height is not None else max(400, 25 * len(td)))
+    fig.update_xaxes(title=metric)
+    if show_plot:
+        fig.show()
+    if saveHTML:
+        fig_to_html(fig, out_dir, title)
+    return fig
+
+def scatter(df: pd.DataFrame, title='', out_dir='.', trend_degree: int = [1], colour_col: str = None, saveHTML=True, show_plot=False, draw_mode='markers', height=800, density=False, nbins=200):
     """
     A 2D scatter plot using the first two columns of `df`.
     :param df:
@@ -271,6 +406,9 @@ def scatter(df: pd.DataFrame, title='', out_dir='.', trend_degree: int = [1], co
     :param show_plot:
     :param draw_mode:
     :param height:
+    :param density: bin the points into an nbins x nbins 2D histogram and draw it as a heatmap instead of one marker per point.
+        Trend lines are still fitted on every point but drawn on a fixed grid, so the html size doesn't grow with the data.
+    :param nbins: number of bins per axis when density is True
     :return:
     """
     fig = go.Figure()
@@ -281,7 +419,14 @@ def scatter(df: pd.DataFrame, title='', out_dir='.', trend_degree: int = [1], co
 
     ''' Loop through dataframes in df_in making a subplot from each '''
     cols = df.columns
-    fig.add_trace(go.Scattergl(x=df[cols[0]], y=df[cols[1]], mode=draw_mode, name=f'{cols[0]} vs {cols[1]}', hoverlabel=dict(namelength=-1), fill=colour_col, marker=dict(opacity=0.5)))
+    if density:
+        points = df[[cols[0], cols[1]]].dropna()
+        counts, xedges, yedges = np.histogram2d(points[cols[0]].values, points[cols[1]].values, bins=nbins)
+        counts = np.where(counts > 0, counts, np.nan)
+        fig.add_trace(go.Heatmap(x=(xedges[:-1] + xedges[1:]) / 2, y=(yedges[:-1] + yedges[1:]) / 2, z=counts.T, colorscale='Viridis',
+                                 colorbar=dict(title='Samples'), hoverongaps=False, name=f'{cols[0]} vs {cols[1]}'))
+    else:
+        fig.add_trace(go.Scattergl(x=df[cols[0]], y=df[cols[1]], mode=draw_mode, name=f'{cols[0]} vs {cols[1]}', hoverlabel=dict(namelength=-1), fill=colour_col, marker=dict(opacity=0.5)))
 
     fig.update_layout(barmode='group', hovermode='x', title=title)
     fig.update_layout(height=height)
@@ -294,18 +439,28 @@ def scatter(df: pd.DataFrame, title='', out_dir='.', trend_degree: int = [1], co
 
     if trend_degree is not None:
         for deg in trend_degree:
-            from sklearn.linear_model import LinearRegression
-            from sklearn.preprocessing import PolynomialFeatures
-            from sklearn.pipeline import make_pipeline
-            from sklearn.metrics import r2_score, mean_absolute_error
-            regr = make_pipeline(PolynomialFeatures(deg), LinearRegression())
-
-            r = df.dropna().sort_values(cols[0])
-            x = r[cols[0]]
-            y = r[cols[1]]
-            model = regr.fit(x.values.reshape(-1, 1), y.values)
-            fit = model.predict(x.values.reshape(-1, 1))
-            fig.add_trace(go.Scatter(x=x.values, y=fit, mode="lines", name=f"Poly({deg}) fit (R2={r2_score(y, fit):.2f}, MAE={mean_absolute_error(y, fit):.2f})"))
+            if density:
+                x = points[cols[0]].values
+                y = points[cols[1]].values
+                poly = np.polynomial.Polynomial.fit(x, y, deg)
+                fit = poly(x)
+                r2 = 1 - np.sum((y - fit) ** 2) / np.sum((y - y.mean()) ** 2)
+                mae = np.mean(np.abs(y - fit))
+                grid = np.linspace(x.min(), x.max(), nbins)
+                fig.add_trace(go.Scatter(x=grid, y=poly(grid), mode="lines", name=f"Poly({deg}) fit (R2={r2:.2f}, MAE={mae:.2f})"))
+            else:
+                from sklearn.linear_model import LinearRegression
+                from sklearn.preprocessing import PolynomialFeatures
+                from sklearn.pipeline import make_pipeline
+                from sklearn.metrics import r2_score, mean_absolute_error
+                regr = make_pipeline(PolynomialFeatures(deg), LinearRegression())
+
+                r = df.dropna().sort_values(cols[0])
+                x = r[cols[0]]
+                y = r[cols[1]]
+                model = regr.fit(x.values.reshape(-1, 1), y.values)
+                fit = model.predict(x.values.reshape(-1, 1))
+                fig.add_trace(go.Scatter(x=x.values, y=fit, mode="lines", name=f"Poly({deg}) fit (R2={r2_score(y, fit):.2f}, MAE={mean_absolute_error(y, fit):.2f})"))
 
     if show_plot:
         fig.show()
@@ -314,7 +469,7 @@ def scatter(df: pd.DataFrame, title='', out_dir='.', trend_degree: int = [1], co
     return fig
 
 
-def heatmap(df: pd.DataFrame, title: str, out_dir: str, colour_scale: str = 'Turbo', log_scale: bool = True, height: int = 2000, raster_width: int = 2000, save_html: bool = True, raster_format: str = 'webp'):
+def heatmap(df: pd.DataFrame, title: str, out_dir: str, colour_scale: str = 'Turbo', log_scale: bool = True, height: int = 2000, raster_width: int = 2000, save_html: bool = True, raster_format: str = 'webp', tiled: bool = False, agg: str = 'mean', html_max_size: int = 500):
     """
     Generates a heatmap using the DataFrame row index and column names as the axis and the values as the colours.
 
@@ -327,11 +482,14 @@ def heatmap(df: pd.DataFrame, title: str, out_dir: str, colour_scale: str = 'Tur
     :param raster_width: image width (for raster output only)
     :param save_html: saves an html file if True
     :param raster_format: saves a raster file if set to a valid file type supported by plotly/kaleido, eg: png, webp, bmp, jpg etc.
+    :param tiled: if True, builds a block-aggregated pyramid of ``df`` (see ``heatmap_pyramid``) and renders the level that fits the output size instead of the full dataframe.
+    :param agg: how blocks are aggregated when ``tiled``, 'mean' or 'max'
+    :param html_max_size: when ``tiled``, the html only embeds a level with at most this many rows and columns.
     """
     scale = colour_scale
 
     if log_scale:
-        scale = px.colors.sequential.Turbo
+        scale = plotly.colors.sequential.Turbo
         scale = [
             [0, scale[0]],
             [1. / 10000, scale[1]],
@@ -345,14 +503,81 @@ def heatmap(df: pd.DataFrame, title: str, out_dir: str, colour_scale: str = 'Tur
             [1., scale[14]],
         ]
 
-    fig = px.imshow(df, aspect="auto", color_continuous_scale=scale)
-    fig.update_layout(title=title, height=2000)
+    import plotly.express as px
+    if tiled:
+        levels = heatmap_pyramid(df, agg=agg, min_size=min(html_max_size, height, raster_width))
+        html_df = select_pyramid_level(levels, html_max_size, html_max_size)
+        raster_df = select_pyramid_level(levels, height, raster_width)
+        # Use the raster level's colour range for both outputs, the coarse html level would otherwise be rescaled
+        zmin, zmax = np.nanmin(raster_df.values), np.nanmax(raster_df.values)
+        make_fig = lambda level_df: px.imshow(level_df, aspect="auto", color_continuous_scale=scale, zmin=zmin, zmax=zmax)
+    else:
+        html_df = raster_df = df
+        make_fig = lambda level_df: px.imshow(level_df, aspect="auto", color_continuous_scale=scale)
 
+    fig = None
     if save_html:
+        fig = make_fig(html_df)
+        fig.update_layout(title=title, height=height)
         fig_to_html(fig, str(out_dir), title)
 
     if raster_format is not None:
-        fig.write_image(f"{out_dir}/{title}.{raster_format}", width=2000, height=2000)
+        # Reuse the html figure when both outputs show the same level
+        if fig is None or raster_df is not html_df:
+            fig = make_fig(raster_df)
+            fig.update_layout(title=title, height=height)
+        fig.write_image(f"{out_dir}/{title}.{raster_format}", width=raster_width, height=height)
+
+
+def block_reduce(values: np.ndarray, block: tuple = (2, 2), agg: str = 'mean') -> np.ndarray:
+    """
+    Aggregates a 2D array over non-overlapping blocks, ignoring NaNs.  Edges that don't fill a whole block are padded with NaN.
+
+    :param values: 2D array to reduce
+    :param block: (rows, cols) size of each block
+    :param agg: 'mean' or 'max'
+    :return: the reduced array, of shape ceil(values.shape / block)
+    """
+    block_rows, block_cols = block
+    rows, cols = values.shape
+    padded = np.pad(values.astype(np.float64, copy=False), ((0, -rows % block_rows), (0, -cols % block_cols)), constant_values=np.nan)
+    blocks = padded.reshape(padded.shape[0] // block_rows, block_rows, padded.shape[1] // block_cols, block_cols)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # All-NaN blocks stay NaN
+        if agg == 'mean':
+            return np.nanmean(blocks, axis=(1, 3))
+        elif agg == 'max':
+            return np.nanmax(blocks, axis=(1, 3))
+    raise ValueError(f"Unknown block aggregation {agg}, expected 'mean' or 'max'")
+
+
+def heatmap_pyramid(df: pd.DataFrame, agg: str = 'mean', min_size: int = 64) -> list:
+    """
+    Builds a multi-resolution pyramid for ``heatmap``.  Each level halves the rows and columns of the one before it (axes already at or below ``min_size`` are left alone), until both axes are at most ``min_size``.
+    Each block is labelled with the index/column label of its first row/column.
+
+    :param df: numeric dataframe, eg date x time-of-day errors
+    :param agg: how blocks are aggregated, 'mean' or 'max'
+    :param min_size: size of the coarsest level
+    :return: list of dataframes, finest (``df`` itself) first
+    """
+    levels = [df]
+    values = df.to_numpy(dtype=np.float64)
+    index, columns = df.index, df.columns
+    while values.shape[0] > min_size or values.shape[1] > min_size:
+        block = (2 if values.shape[0] > min_size else 1, 2 if values.shape[1] > min_size else 1)
+        values = block_reduce(values, block, agg)
+        index, columns = index[::block[0]], columns[::block[1]]
+        levels.append(pd.DataFrame(values, index=index, columns=columns))
+    return levels
+
+
+def select_pyramid_level(levels: list, max_rows: int, max_cols: int) -> pd.DataFrame:
+    """ Returns the finest level of a ``heatmap_pyramid`` that fits within ``max_rows`` x ``max_cols``, or the coarsest level if none fit. """
+    for level in levels:
+        if level.shape[0] <= max_rows and level.shape[1] <= max_cols:
+            return level
+    return levels[-1]
 
 def time_series(df_in: Union[pd.DataFrame, tuple], title='', out_dir='.', table_df=None, df_precision=3, saveHTML=True, show_plot=False, draw_mode='lines', subplot_titles: list[str]=None, height=800, verbose=0, show_menu=False, intervals: list[str]=None) -> Figure:
     '''
@@ -471,6 +696,7 @@ def time_series(df_in: Union[pd.DataFrame, tuple], title='', out_dir='.', table_
     if show_plot and not saveHTML:
         fig.show()
     elif show_plot and saveHTML:
+        import webbrowser
         url = "file://" + os.path.abspath(html_file)
         webbrowser.open(url)
 
@@ -515,10 +741,28 @@ def scatterplot_3d(df, colour_col: str = None, title='', out_dir='.', saveHTML=T
         fig_to_html(fig, out_dir, title)
 
 
-def histogram_overlaid(df: pd.DataFrame, nbins: int = 200, title='', out_dir='.', saveHTML=True, show_plot=False, height=1200):
-    """ Draws an overlaid histogram from each columns in the DF """
-    m = df.melt().dropna()
-    fig = px.histogram(m, x="value", color="variable", nbins=nbins, marginal="box", opacity=0.7)
+def histogram_overlaid(df: pd.DataFrame, nbins: int = 200, title='', out_dir='.', saveHTML=True, show_plot=False, height=1200, summary_only=False):
+    """
+    Draws an overlaid histogram from each columns in the DF
+    If ``summary_only`` is True the bins and marginal boxes are computed here (see ``histogram_counts`` and ``summary_statistics``) and only those are sent to plotly, rather than the raw data.
+    """
+    if summary_only:
+        counts = histogram_counts(df, nbins=nbins)
+        summary = summary_statistics(df)
+        bin_width = counts.index[1] - counts.index[0] if len(counts) > 1 else 1.0
+        colours = plotly.colors.qualitative.Plotly
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.2, 0.8], vertical_spacing=0.02)
+        for ii, c in enumerate(df.columns):
+            colour = colours[ii % len(colours)]
+            stats = summary.loc[c]
+            fig.add_trace(go.Box(y=[c], q1=[stats["q1"]], median=[stats["median"]], q3=[stats["q3"]], lowerfence=[stats["lowerfence"]], upperfence=[stats["upperfence"]],
+                                 mean=[stats["mean"]], sd=[stats["sd"]], orientation='h', boxpoints=False, name=c, legendgroup=c, showlegend=False, marker_color=colour), row=1, col=1)
+            fig.add_trace(go.Bar(x=counts.index, y=counts[c], width=bin_width, name=c, legendgroup=c, marker_color=colour), row=2, col=1)
+        fig.update_yaxes(title="count", row=2, col=1)
+    else:
+        import plotly.express as px
+        m = df.melt().dropna()
+        fig = px.histogram(m, x="value", color="variable", nbins=nbins, marginal="box", opacity=0.7)
     fig.update_layout(barmode='overlay')
     fig.update_traces(opacity=0.75)
     fig.update_xaxes(title=title)
@@ -542,6 +786,7 @@ def scatterplot_matrix(df, colour_col: str = None, title='', out_dir='.', saveHT
     :param height:
     :return:
     """
+    import plotly.express as px
     fig = px.scatter_matrix(df, color=colour_col, opacity=0.5)
 
     fig.update_layout(height=height)
@@ -565,7 +810,7 @@ def get_trace_colour(fig, trace_name: str):
     :return: the trace colour, or None if not found.
     '''
 
-    colors = px.colors.qualitative.Plotly
+    colors = plotly.colors.qualitative.Plotly
 
     colour = None
     for i, data in enumerate(fig['data']):
@@ -610,6 +855,7 @@ def figs_to_html(figs: list, file: str, show=False, extra_html=[], verbose=0):
         if verbose > 0:
             logger.info(f'Plot saved to {os.path.abspath(html_file)}')
     if show:
+        import webbrowser
         url = "file://" + os.path.abspath(html_file)
         webbrowser.open(url)
     return html_file
@@ -628,6 +874,9 @@ def df_to_html(df: pd.DataFrame, file_name: str = None, show: bool = False, shad
         logger.error(f'Returning blank html for DF because column and index values must be unique for HTML rendering, but df.index.is_unique={df.index.is_unique}, df.columns.is_unique={df.columns.is_unique}. Try dropping duplicates first.')
         return ""
 
+    import seaborn as sns
+    from matplotlib.colors import ListedColormap
+
     df = df.copy().round(precision)
     with pd.option_context("display.precision", precision):
         # cm = sns.light_palette("red", as_cmap=True)
@@ -11,14 +11,16 @@ import datetime
 import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
+
+# Local Modules
+import results_loader
 
 #Logging
 import logging
 import logging.config
 import json
 
-with open("logging_config.json") as f:
+with open(Path(__file__).with_name("logging_config.json")) as f:
     log_config = json.load(f)
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
@@ -39,19 +41,6 @@ def solpred_line_timeseries(df, actual, ax_title="", fig_title="", xlabel='Times
     plt.close(fig)
 
 
-def read_parquet(path):
-    df = pd.read_parquet(path)
-    df["datetime"] = pd.to_datetime(df["predicted-time"], format="%Y-%m-%d_%H-%M-%S")
-    df = df.set_index("datetime")
-    df = df.sort_index()
-    return df
-
-def filter_date(df, start_time, end_time):
-    df = df[df.index < end_time]
-    df = df[df.index > start_time]
-    df = df.dropna()
-    return df
-
 def my_func_123():
     basefolder="/work/processed-runs/blackmountain/categories/All/wide"
     model="fully-conv"
@@ -62,12 +51,9 @@ def my_func_123():
     fold="fold_3"
     y_top=1200
     y_bot=0
+    path = f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"
     
-
-    df = read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet")
-    start_time = datetime.datetime(2015, 7, 20)
-    end_time = datetime.datetime(2015, 7, 21)
-    df = filter_date(df, start_time, end_time)
+    df = results_loader.load_results(path, columns=["actual"], date="2015-07-20").dropna()
 
     solpred_line_timeseries(
         df,
@@ -81,10 +67,7 @@ def my_func_123():
         output_path=f"/work/plots/sunny-2015-07-20.pdf"
     )
 
-    df = read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet")
-    start_time = datetime.datetime(2015, 3, 21)
-    end_time = datetime.datetime(2015, 3, 22)
-    df = filter_date(df, start_time, end_time)
+    df = results_loader.load_results(path, columns=["actual"], date="2015-03-21").dropna()
 
     solpred_line_timeseries(
         df,
@@ -98,10 +81,7 @@ def my_func_123():
         output_path=f"/work/plots/intermittent-2015-03-21.pdf"
     )
     
-    df = read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet")
-    start_time = datetime.datetime(2015, 7, 15)
-    end_time = datetime.datetime(2015, 7, 16)
-    df = filter_date(df, start_time, end_time)
+    df = results_loader.load_results(path, columns=["actual"], date="2015-07-15").dropna()
 
     solpred_line_timeseries(
         df,
@@ -115,10 +95,7 @@ def my_func_123():
         output_path=f"/work/plots/overcast-2015-07-15.pdf"
     )
 
-    df = read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet")
-    start_time = datetime.datetime(2015, 9, 18)
-    end_time = datetime.datetime(2015, 9, 19)
-    df = filter_date(df, start_time, end_time)
+    df = results_loader.load_results(path, columns=["actual"], date="2015-09-18").dropna()
 
     solpred_line_timeseries(
         df,
@@ -4,19 +4,21 @@ Plot single day with metrics
 # Standard Library Modules
 from pathlib import Path
 import datetime
-import math
 
 # External Modules
 import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
+
+# Local Modules
+import forecast_metrics
+import results_loader
 
 #Logging
 import logging
 import logging.config
 import json
 
-with open("logging_config.json") as f:
+with open(Path(__file__).with_name("logging_config.json")) as f:
     log_config = json.load(f)
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
@@ -32,169 +34,57 @@ def solpred_line_timeseries(df, actual, model, persist, ax_title="", fig_title="
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
     plt.legend()
-    r2 = metrics.r2_score(df[actual], df[model])
-    rmse = math.sqrt(metrics.mean_squared_error(df[actual], df[model]))
-    rmse_p = math.sqrt(metrics.mean_squared_error(df[actual], df[persist]))
-    skill = (1 - rmse/rmse_p) * 100
+    r2 = forecast_metrics.r2(df[actual], df[model])
+    rmse = forecast_metrics.rmse(df[actual], df[model])
+    rmse_p = forecast_metrics.rmse(df[actual], df[persist])
+    skill = forecast_metrics.skill(rmse_p, rmse) * 100
     ax.set_title(f"{ax_title} RMSE$={rmse:.2f}$, Skill$={skill:.1f}\%$, $R^2={r2:.2f}$")
     fig.suptitle(f"{fig_title}")
     fig.savefig(output_path)
     plt.close(fig)
 
 
-def read_parquet(path):
-    df = pd.read_parquet(path)
-    df["datetime"] = pd.to_datetime(df["predicted-time"], format="%Y-%m-%d_%H-%M-%S")
-    df = df.set_index("datetime")
-    df = df.sort_index()
-    return df
-
-def dec19():
-    basefolder="/results/CaseStudies/19-dec-high"
-    model="fully-conv"
-    y_top=1075
-    y_bot=925
+def plot_case_study(case_study_id, basefolder, fig_title, plots, y_top=1000, y_bot=0, suffix="metrics", case_study_file=forecast_metrics.CASE_STUDY_FILE):
+    """
+    Plots one case study for several runs. The window comes from the case study file, and each
+    results file is read once for every plot that uses it
+    :param plots: list of (model, inout, run, crop, lr, fold, ax_title)
+    :param suffix: "metrics" for the per case study files, or "wide" to slice the window out of the full results
+    """
+    windows = [w for w in forecast_metrics.read_case_studies(case_study_file) if w[0] == case_study_id]
+    paths = [f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_{suffix}.parquet" for model, inout, run, crop, lr, fold, _ in plots]
+    slices = results_loader.load_windows(list(dict.fromkeys(paths)), windows)
+    prefix = "-".join(case_study_id.split("-")[:2])
+    for path, (model, inout, run, crop, lr, fold, ax_title) in zip(paths, plots):
+        solpred_line_timeseries(
+            slices[path][case_study_id],
+            actual="actual",
+            model=f"{model}_{inout}_{run}_{fold}",
+            persist=f"persist_{inout}_{run}_{fold}",
+            xlabel="Time",
+            ylabel="Irradiance ($W/m^2$)",
+            ax_title=ax_title,
+            fig_title=fig_title,
+            y_top=y_top,
+            y_bot=y_bot,
+            output_path=f"{basefolder}/{prefix}-{model}_{inout}_{run}_{fold}.pdf"
+        )
 
-    run="run_06"
-    inout="2x60s_300s"
-    crop="crop_1024"
-    lr="lr_3.0E-4"
-    fold="fold_3"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="Solpred 5 minutes ahead.",
-        fig_title="December 19 - High Cloud Band",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/19-dec-{model}_{inout}_{run}_{fold}.pdf"
-    )
 
-    run="run_02"
-    inout="16x120s_420s"
-    crop="crop_full"
-    lr="lr_3.0E-6"
-    fold="fold_1"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="Solpred 7 minutes ahead.",
-        fig_title="December 19 - High Cloud Band",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/19-dec-{model}_{inout}_{run}_{fold}.pdf"
-    )
-
-    run="run_03"
-    inout="8x30s_120s"
-    crop="crop_1024"
-    lr="lr_3.0E-6"
-    fold="fold_9"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="Solpred 2 minutes ahead.",
-        fig_title="December 19 - High Cloud Band",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/19-dec-{model}_{inout}_{run}_{fold}.pdf"
-    )
+def dec19():
+    plot_case_study("19-dec-high", "/results/CaseStudies/19-dec-high", "December 19 - High Cloud Band", [
+        ("fully-conv", "2x60s_300s", "run_06", "crop_1024", "lr_3.0E-4", "fold_3", "Solpred 5 minutes ahead."),
+        ("fully-conv", "16x120s_420s", "run_02", "crop_full", "lr_3.0E-6", "fold_1", "Solpred 7 minutes ahead."),
+        ("fully-conv", "8x30s_120s", "run_03", "crop_1024", "lr_3.0E-6", "fold_9", "Solpred 2 minutes ahead."),
+    ], y_top=1075, y_bot=925)
 
 def apr25():
-    basefolder="/results/CaseStudies/25-apr-switch"
-    model="fully-conv"
-    y_top=800
-    y_bot=0
-
-    run="run_06"
-    inout="2x60s_120s"
-    crop="crop_1024"
-    lr="lr_3.0E-5"
-    fold="fold_0"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="Solpred 2 minutes ahead.",
-        fig_title="April 25 - Sunny to Overcast",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/25-apr-{model}_{inout}_{run}_{fold}.pdf"
-    )
-
-    run="run_06"
-    inout="2x60s_300s"
-    crop="crop_1024"
-    lr="lr_3.0E-5"
-    fold="fold_1"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="Solpred 5 minutes ahead.",
-        fig_title="April 25 - Sunny to Overcast",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/25-apr-{model}_{inout}_{run}_{fold}.pdf"
-    )
-
-    run="run_02"
-    inout="2x60s_420s"
-    crop="crop_full"
-    lr="lr_3.0E-6"
-    fold="fold_1"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="Solpred 7 minutes ahead.",
-        fig_title="April 25 - Sunny to Overcast",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/25-apr-{model}_{inout}_{run}_{fold}.pdf"
-    )
-
-    model="sunset"
-
-    run="run_02"
-    inout="2x60s_120s"
-    crop="crop_1024"
-    lr="lr_3.0E-6"
-    fold="fold_3"
-    solpred_line_timeseries(
-        read_parquet(f"{basefolder}/blackmountain_{model}_{inout}_{run}_{crop}_{lr}_{fold}_metrics.parquet"),
-        actual="actual",
-        model=f"{model}_{inout}_{run}_{fold}",
-        persist=f"persist_{inout}_{run}_{fold}",
-        xlabel="Time",
-        ylabel="Irradiance ($W/m^2$)",
-        ax_title="SUNSET* 2 minutes ahead.",
-        fig_title="April 25 - Sunny to Overcast",
-        y_top=y_top,
-        y_bot=y_bot,
-        output_path=f"{basefolder}/25-apr-{model}_{inout}_{run}_{fold}.pdf"
-    )
+    plot_case_study("25-apr-switch", "/results/CaseStudies/25-apr-switch", "April 25 - Sunny to Overcast", [
+        ("fully-conv", "2x60s_120s", "run_06", "crop_1024", "lr_3.0E-5", "fold_0", "Solpred 2 minutes ahead."),
+        ("fully-conv", "2x60s_300s", "run_06", "crop_1024", "lr_3.0E-5", "fold_1", "Solpred 5 minutes ahead."),
+        ("fully-conv", "2x60s_420s", "run_02", "crop_full", "lr_3.0E-6", "fold_1", "Solpred 7 minutes ahead."),
+        ("sunset", "2x60s_120s", "run_02", "crop_1024", "lr_3.0E-6", "fold_3", "SUNSET* 2 minutes ahead."),
+    ], y_top=800, y_bot=0)
 
 
 def main():
@@ -0,0 +1,188 @@
+"""
+Render a manifest of static plot jobs in parallel
+
+Jobs are grouped by source file so each parquet is read once (only the columns the jobs need),
+then each group is rendered in a process pool. Per-job timings are logged and optionally written out.
+
+python3 render-manifest.py manifest.json --processes 8 --timings timings.json
+
+Manifest format (json), either a list of jobs or {"jobs": [...]}. Each job is:
+{
+    "path": "/results/CaseStudies/19-dec-high/blackmountain_fully-conv_2x60s_300s_run_06_crop_1024_lr_3.0E-4_fold_3_metrics.parquet",
+    "kind": "solpred",                     # "solpred" (actual/model/persist with metrics), "line" (columns) or "scatter" (actual vs model)
+    "actual": "actual",                    # solpred and scatter
+    "model": "fully-conv_2x60s_300s_run_06_fold_3",
+    "persist": "persist_2x60s_300s_run_06_fold_3",  # solpred only
+    "columns": ["actual"],                 # line only
+    "start": "2015-12-19_11-30-00",        # optional time window, same format as predicted-time
+    "end": "2015-12-19_11-50-00",
+    "split": "day",                        # optional, render one figure per date, "{date}" in output is replaced
+    "output": "/results/CaseStudies/19-dec-high/19-dec.pdf",
+    "fig_title": "", "ax_title": "", "xlabel": "Time", "ylabel": "", "y_top": 1000, "y_bot": 0, "size": [9, 4]
+}
+"""
+# Standard Library Modules
+from pathlib import Path
+from multiprocessing import Pool
+import argparse
+import time
+
+# External Modules
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+# Local Modules
+import forecast_metrics
+import results_loader
+
+#Logging
+import logging
+import logging.config
+import json
+
+with open(Path(__file__).with_name("logging_config.json")) as f:
+    log_config = json.load(f)
+logging.config.dictConfig(log_config)
+logger = logging.getLogger(__name__)
+
+
+def job_columns(job):
+    """The data columns a job needs"""
+    kind = job.get("kind", "line")
+    if kind == "solpred":
+        return [job["actual"], job["model"], job["persist"]]
+    elif kind == "scatter":
+        return [job["actual"], job["model"]]
+    elif kind == "line":
+        return list(job["columns"])
+    raise ValueError(f"Unknown plot kind {kind} for {job.get('output')}")
+
+
+def group_jobs(jobs):
+    """Group jobs by source file, keeping the manifest order within each group"""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job["path"], []).append(job)
+    return groups
+
+
+def select_window(df, job):
+    start = results_loader.parse_time(job.get("start"))
+    end = results_loader.parse_time(job.get("end"))
+    return df.loc[start:end, job_columns(job)]
+
+
+def solpred_line_timeseries(ax, df, job):
+    actual, model, persist = job["actual"], job["model"], job["persist"]
+    df = df.dropna()
+    ax.plot(df.index, df[actual], '-', label="Actual")
+    ax.plot(df.index, df[model], '--', label="Solpred")
+    ax.plot(df.index, df[persist], ':', label="Persistence")
+    ax.legend()
+    r2 = forecast_metrics.r2(df[actual], df[model])
+    rmse_m = forecast_metrics.rmse(df[actual], df[model])
+    rmse_p = forecast_metrics.rmse(df[actual], df[persist])
+    skill = forecast_metrics.skill(rmse_p, rmse_m) * 100
+    ax.set_title(f"{job.get('ax_title', '')} RMSE$={rmse_m:.2f}$, Skill$={skill:.1f}\\%$, $R^2={r2:.2f}$")
+
+
+def line_timeseries(ax, df, job):
+    for label in job["columns"]:
+        ax.plot(df.index, df[label], job.get("fmt", '-'), label=label)
+    if len(job["columns"]) > 1:
+        ax.legend()
+    ax.set_title(job.get("ax_title", ""))
+
+
+def scatter(ax, df, job):
+    actual, model = job["actual"], job["model"]
+    df = df.dropna()
+    ax.scatter(df[actual], df[model], 1)
+    minval = df[[actual, model]].min().min()
+    maxval = df[[actual, model]].max().max()
+    ax.plot([minval, maxval], [minval, maxval], ls="--", color="black")
+    ax.set_title(f"{job.get('ax_title', '')} RMSE = {forecast_metrics.rmse(df[actual], df[model]):.2f}")
+
+
+PLOTTERS = {"solpred": solpred_line_timeseries, "line": line_timeseries, "scatter": scatter}
+
+
+def render(df, job, output_path):
+    fig, ax = plt.subplots()
+    fig.set_size_inches(*job.get("size", [9, 4]))
+    PLOTTERS[job.get("kind", "line")](ax, df, job)
+    if "y_top" in job or "y_bot" in job:
+        ax.set_ylim(bottom=job.get("y_bot"), top=job.get("y_top"), emit=True, auto=False)
+    if job.get("kind", "line") != "scatter" and job.get("split") == "day":
+        ax.xaxis.set_major_formatter(matplotlib.dates.DateFormatter("%H:%M"))
+    ax.set_xlabel(job.get("xlabel", "Timestep"))
+    ax.set_ylabel(job.get("ylabel", ""))
+    fig.suptitle(job.get("fig_title", ""))
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def render_group(args):
+    """Pool function: load one source file once and render all of its jobs. Returns a timing record per output"""
+    path, jobs = args
+    start = time.perf_counter()
+    columns = sorted({c for job in jobs for c in job_columns(job)})
+    df = results_loader.load_results(path, columns, cache=False)
+    load_seconds = time.perf_counter() - start
+
+    timings = []
+    for job in jobs:
+        window = select_window(df, job)
+        if job.get("split") == "day":
+            parts = [(job["output"].format(date=date), day_df) for date, day_df in window.groupby(window.index.date)]
+        else:
+            parts = [(job["output"], window)]
+        for output_path, part_df in parts:
+            job_start = time.perf_counter()
+            render(part_df, job, output_path)
+            timings.append({"path": path,
+                            "output": str(output_path),
+                            "rows": len(part_df),
+                            "load_seconds": load_seconds,
+                            "render_seconds": time.perf_counter() - job_start})
+    return timings
+
+
+def run_manifest(jobs, processes=None):
+    """Render all jobs, returning a list of timing records"""
+    groups = group_jobs(jobs)
+    logger.info(f"Rendering {len(jobs)} jobs from {len(groups)} files")
+    timings = []
+    with Pool(processes=processes) as pool:
+        for group_timings in pool.imap_unordered(render_group, groups.items()):
+            for t in group_timings:
+                logger.debug(f"{t['output']}: {t['rows']} rows, render {t['render_seconds']:.2f}s (file load {t['load_seconds']:.2f}s)")
+            timings.extend(group_timings)
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CLI script to render a manifest of plot jobs in parallel")
+    parser.add_argument('manifest', type=Path, help="Json file with a list of plot jobs")
+    parser.add_argument('--processes', type=int, default=None, help="Number of worker processes, defaults to the number of CPUs")
+    parser.add_argument('--timings', type=Path, default=None, help="Optional json file to write per-job timings to")
+    return parser.parse_args()
+
+
+def main(args):
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    jobs = manifest["jobs"] if isinstance(manifest, dict) else manifest
+    start = time.perf_counter()
+    timings = run_manifest(jobs, args.processes)
+    logger.info(f"Rendered {len(timings)} plots in {time.perf_counter() - start:.2f}s")
+    if args.timings is not None:
+        with open(args.timings, "w") as f:
+            json.dump(timings, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(parse_args())
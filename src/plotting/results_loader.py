@@ -0,0 +1,286 @@
+"""
+Shared loader for wide results parquet files (``*_wide.parquet``, ``*_metrics.parquet``)
+
+Reads only the requested columns and only the row groups that overlap the requested time window.
+The parsed ``predicted-time`` index of each file and the loaded frames are cached for the life of the process,
+keyed on the file's path, size and modification time.
+
+Row groups are the smallest unit that can be skipped.  The wide files written by make_summaries.clj are a single row
+group, so a window read from one of them still decodes the whole of every requested column; only the column selection
+and the cached index help.  ``rewrite_row_groups`` (or the command line below) rewrites files sorted by time in row
+groups of ``ROW_GROUP_SIZE`` rows, after which a one day window touches one or two row groups.
+
+    import results_loader
+    df = results_loader.load_results(path, columns=["actual", model_col], date="2015-12-19")
+    slices = results_loader.load_windows(paths, forecast_metrics.read_case_studies())  # {path: {case study id: df}}
+
+python3 results_loader.py /work/processed-runs/blackmountain/wide/*_wide.parquet
+python3 results_loader.py run_wide.parquet --output run_wide_sorted.parquet --row-group-size 4096
+"""
+# Standard Library Modules
+from collections import OrderedDict
+from pathlib import Path
+import argparse
+import datetime
+import os
+
+# External Modules
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+TIME_COL = "predicted-time"
+ID_COL = "id-time"
+FRAME_CACHE_SIZE = 32
+# A day of 10s samples is 8640 rows
+ROW_GROUP_SIZE = 8192
+
+_index_cache = {}
+_frame_cache = OrderedDict()
+
+
+def file_key(path) -> tuple:
+    '''
+    Cache key for a file, changes if the file is rewritten.
+    :param path: path to the file
+    :return: (resolved path, mtime, size)
+    '''
+    path = Path(path).resolve()
+    stat = path.stat()
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def parse_time(value):
+    '''
+    Parses a time bound given as a string in ``TIME_FORMAT``, an ISO string, a date or a datetime.
+    :param value: the bound, or None
+    :return: a pandas Timestamp, or None
+    '''
+    if value is None or isinstance(value, pd.Timestamp):
+        return value
+    if isinstance(value, str):
+        try:
+            return pd.to_datetime(value, format=TIME_FORMAT)
+        except ValueError:
+            return pd.Timestamp(value)
+    return pd.Timestamp(value)
+
+
+def time_index(path, time_col: str = TIME_COL) -> tuple:
+    '''
+    Reads and parses the time column of a results file once, and caches it.
+    :param path: path to the parquet file
+    :param time_col: name of the string time column
+    :return: (DatetimeIndex in file row order, array of cumulative row counts at the end of each row group)
+    '''
+    key = (file_key(path), time_col)
+    if key not in _index_cache:
+        parquet_file = pq.ParquetFile(path)
+        times = pc.strptime(parquet_file.read(columns=[time_col]).column(time_col), format=TIME_FORMAT, unit="ns")
+        index = pd.DatetimeIndex(times.to_pandas(), name="datetime")
+        row_group_ends = np.cumsum([parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)], dtype=np.int64)
+        _index_cache[key] = (index, row_group_ends)
+    return _index_cache[key]
+
+
+def window_rows(index: pd.DatetimeIndex, start=None, end=None, date=None) -> np.ndarray:
+    '''
+    Finds the file rows inside a time window.  ``date`` selects a whole day, ``start``/``end`` are inclusive bounds.
+    :return: row positions (in file order) inside the window
+    '''
+    if date is not None:
+        day = parse_time(date).normalize()
+        start = day if start is None else max(parse_time(start), day)
+        end = day + datetime.timedelta(days=1) - pd.Timedelta(1, "ns") if end is None else min(parse_time(end), day + datetime.timedelta(days=1) - pd.Timedelta(1, "ns"))
+    start, end = parse_time(start), parse_time(end)
+    if start is None and end is None:
+        return np.arange(len(index))
+    if index.is_monotonic_increasing:
+        first = 0 if start is None else index.searchsorted(start, side="left")
+        last = len(index) if end is None else index.searchsorted(end, side="right")
+        return np.arange(first, last)
+    mask = np.ones(len(index), dtype=bool)
+    if start is not None:
+        mask &= index >= start
+    if end is not None:
+        mask &= index <= end
+    return np.flatnonzero(mask)
+
+
+def read_rows(path, rows: np.ndarray, row_group_ends: np.ndarray, columns: list) -> pd.DataFrame:
+    '''
+    Reads ``columns`` for the given file rows, only touching the row groups that contain them.
+    '''
+    parquet_file = pq.ParquetFile(path)
+    if len(rows) == 0:
+        return parquet_file.schema_arrow.empty_table().select(columns).to_pandas()
+    sizes = np.diff(row_group_ends, prepend=0)
+    group_of_row = np.searchsorted(row_group_ends, rows, side="right")
+    groups = np.unique(group_of_row)
+    table = parquet_file.read_row_groups(groups.tolist(), columns=columns)
+    # Position of each wanted row within the concatenation of the selected row groups
+    selected_offsets = np.cumsum(sizes[groups]) - sizes[groups]
+    positions = rows - (row_group_ends[group_of_row] - sizes[group_of_row]) + selected_offsets[np.searchsorted(groups, group_of_row)]
+    if len(positions) < table.num_rows:
+        table = table.take(positions)
+    return table.to_pandas()
+
+
+def load_results(path, columns: list = None, start=None, end=None, date=None, sort_columns: bool = False, cache: bool = True) -> pd.DataFrame:
+    '''
+    Loads a wide results file indexed by the parsed ``predicted-time``.
+    :param path: path to the parquet file
+    :param columns: data columns to read, None reads every column except ``predicted-time`` and ``id-time``
+    :param start: optional inclusive start of the time window (``TIME_FORMAT`` string, ISO string or datetime)
+    :param end: optional inclusive end of the time window
+    :param date: optional single day to select, eg "2015-12-19"
+    :param sort_columns: sort the data columns by name
+    :param cache: reuse frames already loaded by this process
+    :return: dataframe with a sorted ``datetime`` index
+    '''
+    key = (file_key(path), tuple(columns) if columns is not None else None, str(start), str(end), str(date), sort_columns)
+    if cache and key in _frame_cache:
+        _frame_cache.move_to_end(key)
+        return _frame_cache[key].copy()
+
+    index, row_group_ends = time_index(path)
+    if columns is None:
+        columns = [c for c in pq.ParquetFile(path).schema_arrow.names if c not in (TIME_COL, ID_COL)]
+    columns = list(columns)
+    rows = window_rows(index, start, end, date)
+    df = read_rows(path, rows, row_group_ends, columns)
+    df.index = index[rows]
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind="stable")
+    if sort_columns:
+        df = df[sorted(df.columns)]
+
+    if cache:
+        _frame_cache[key] = df
+        while len(_frame_cache) > FRAME_CACHE_SIZE:
+            _frame_cache.popitem(last=False)
+        return df.copy()
+    return df
+
+
+def file_windows(path, windows: list, columns: list = None) -> dict:
+    '''
+    Slices many time windows out of one results file with a single read.
+    Every window is located by binary search on the (sorted) time index, then only the union of their rows is read.
+    :param path: path to the parquet file
+    :param windows: list of (id, start, end), with inclusive bounds as for load_results
+    :param columns: data columns to read, None reads every column except ``predicted-time`` and ``id-time``
+    :return: dict of window id -> dataframe with a sorted ``datetime`` index
+    '''
+    index, row_group_ends = time_index(path)
+    if columns is None:
+        columns = [c for c in pq.ParquetFile(path).schema_arrow.names if c not in (TIME_COL, ID_COL)]
+    order = np.arange(len(index)) if index.is_monotonic_increasing else np.argsort(index.values, kind="stable")
+    sorted_index = index[order]
+    window_file_rows = {window_id: order[window_rows(sorted_index, start, end)] for window_id, start, end in windows}
+    rows = np.unique(np.concatenate(list(window_file_rows.values()))) if window_file_rows else np.array([], dtype=np.int64)
+    df = read_rows(path, rows, row_group_ends, list(columns))
+    slices = {}
+    for window_id, file_rows in window_file_rows.items():
+        window_df = df.iloc[np.searchsorted(rows, file_rows)]
+        window_df.index = index[file_rows]
+        slices[window_id] = window_df
+    return slices
+
+
+def _file_windows(args):
+    path, windows, columns = args
+    return path, file_windows(path, windows, columns)
+
+
+def load_windows(paths: list, windows: list, columns: list = None, processes: int = None) -> dict:
+    '''
+    Slices every window out of every results file, reading each file once, eg. all the case studies of a set of runs.
+    :param paths: parquet files
+    :param windows: list of (id, start, end), or (start, end) pairs which are then identified by their position
+    :param columns: data columns to read, None for every column
+    :param processes: read the files in a process pool of this size, None reads them in this process
+    :return: dict of path -> window id -> dataframe with a sorted ``datetime`` index
+    '''
+    windows = [tuple(w) if len(w) == 3 else (i, *w) for i, w in enumerate(windows)]
+    jobs = [(path, windows, columns) for path in paths]
+    if processes is None:
+        return dict(map(_file_windows, jobs))
+    from multiprocessing import Pool
+    with Pool(processes=processes) as pool:
+        return dict(pool.imap(_file_windows, jobs))
+
+
+def load_csv_results(path, time_col: str = "time", start=None, end=None, date=None) -> pd.DataFrame:
+    '''
+    Loads a time window of a results csv (eg. the older ``*_wide.csv.gz`` files), indexed by the parsed ``time_col``.
+    The times are parsed in one vectorised call and the window found by binary search once they are sorted.
+    :return: dataframe with a sorted index named ``time_col``
+    '''
+    df = pd.read_csv(path)
+    index = pd.DatetimeIndex(pd.to_datetime(df.pop(time_col), format=TIME_FORMAT).values.astype("datetime64[ns]"), name=time_col)
+    order = np.argsort(index.values, kind="stable")
+    index = index[order]
+    rows = window_rows(index, start, end, date)
+    df = df.iloc[order[rows]]
+    df.index = index[rows]
+    return df
+
+
+def clear_cache():
+    '''Drops all cached indices and frames.'''
+    _index_cache.clear()
+    _frame_cache.clear()
+
+
+def rewrite_row_groups(path, output=None, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    '''
+    Rewrites a results file sorted by ``predicted-time`` in row groups of ``row_group_size`` rows,
+    so that ``load_results`` and ``file_windows`` can skip the row groups outside a window.
+    :param path: path to the parquet file
+    :param output: where to write, None replaces the file
+    :param row_group_size: rows per row group
+    :return: number of row groups written
+    '''
+    index, row_group_ends = time_index(path)
+    output = Path(path if output is None else output)
+    table = pq.read_table(path)
+    if not index.is_monotonic_increasing:
+        table = table.take(pa.array(np.argsort(index.values, kind="stable")))
+    # Write then rename, so the file is never seen half written
+    tmp_path = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path, row_group_size=row_group_size, compression="zstd")
+    os.replace(tmp_path, output)
+    n_row_groups = pq.ParquetFile(output).num_row_groups
+    logger.info(f"Wrote {output}, {table.num_rows} rows in {n_row_groups} row groups (was {len(row_group_ends)})")
+    return n_row_groups
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rewrite wide results files sorted by time in small row groups, so time windows skip the rest of the file")
+    parser.add_argument('paths', type=Path, nargs='+', help="Wide results parquet files, rewritten in place")
+    parser.add_argument('--output', type=Path, default=None, help="Where to write instead, only with a single path")
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE, help="Rows per row group")
+    return parser.parse_args()
+
+
+def main(args):
+    if args.output is not None and len(args.paths) > 1:
+        raise ValueError("--output needs a single path")
+    for path in args.paths:
+        rewrite_row_groups(path, args.output, args.row_group_size)
+
+
+if __name__ == '__main__':
+    import logging.config
+    import json
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
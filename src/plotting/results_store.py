@@ -0,0 +1,396 @@
+"""
+Consolidated, partitioned store of the results of every run
+
+Each run is ingested once into a single hive partitioned parquet dataset:
+
+    <store>/dataset=blackmountain/model=fully-conv/terms=2/spacing=60/horizon=300/fold=3/run_06_crop_1024_lr_3.0E-4.parquet
+
+with typed ``id_time``/``predicted_time`` timestamps and float32 ``actual``, ``prediction`` and ``persist`` columns,
+sorted by ``predicted_time`` so row group statistics prune time ranges.
+``_catalog.parquet`` in the store holds one row per ingested run (source file, its mtime and size, the run's identity,
+row count and time span), so queries pick their files from the catalog without opening every part, and ingestion
+only converts sources that are new or have changed since they were last ingested.
+
+Sources are the wide results files (``*_wide.parquet``, run identity from the file name) and the raw test outputs of
+a run folder (``*_out.csv.gz``, run identity from the ``run-params.json`` next to it).  Where a run has both, the
+wide file is used.  The case study and category subsets (``*_metrics.parquet``) and the metric ``.edn`` files are
+derived from the same rows and are not ingested; forecast_metrics.evaluate on a query result recomputes them.
+
+    import results_store
+    store = results_store.ResultsStore("/work/results-store")
+    store.ingest(["/work/processed-runs/blackmountain/wide"], processes=8)
+    runs = store.runs(model="fully-conv", horizon=300)
+    df = store.wide(model="fully-conv", horizon=300, start="2015-12-19", end="2015-12-20")
+
+python3 results_store.py /work/results-store ingest /work/processed-runs/blackmountain/wide --processes 8
+python3 results_store.py /work/results-store runs --model fully-conv --horizon 300
+python3 results_store.py /work/results-store query --model fully-conv --terms 2 --start 2015-12-19 --end 2015-12-20 --output 19-dec.parquet
+"""
+# Standard Library Modules
+from multiprocessing import Pool
+from pathlib import Path
+import argparse
+import json
+import os
+import re
+import time
+
+# External Modules
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Local Modules
+import forecast_metrics
+import results_loader
+
+#Logging
+import logging
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = "_catalog.parquet"
+ROW_GROUP_SIZE = 65536
+PARTITION_KEYS = ["dataset", "model", "terms", "spacing", "horizon", "fold"]
+PARTITION_SCHEMA = pa.schema([("dataset", pa.string()), ("model", pa.string()), ("terms", pa.int32()),
+                              ("spacing", pa.int32()), ("horizon", pa.int32()), ("fold", pa.int32())])
+VALUE_SCHEMA = pa.schema([("id_time", pa.timestamp("s")), ("predicted_time", pa.timestamp("s")),
+                          ("actual", pa.float32()), ("prediction", pa.float32()), ("persist", pa.float32()),
+                          ("run", pa.dictionary(pa.int32(), pa.string())), ("crop", pa.dictionary(pa.int32(), pa.string())),
+                          ("lr", pa.dictionary(pa.int32(), pa.string()))])
+# eg. blackmountain_fully-conv_2x60s_300s_run_06_crop_1024_lr_3.0E-4_fold_3
+# or blackmountain-round_2_blackmountain-ramp-round_fully-conv_16x60s_420s_run_00_lr_3.0E-6_fold_0 (no crop, from before
+# crop sizes were swept), the dataset may contain underscores so it is everything before the <model>_<terms>x<spacing>s token
+RUN_PATTERN = re.compile(r"^(?P<dataset>.+)_(?P<model>[^_]+)_(?P<terms>\d+)x(?P<spacing>\d+)s_(?P<horizon>\d+)s?"
+                         r"_run_(?P<run>[^_]+)(?:_crop_(?P<crop>[^_]+))?_lr_(?P<lr>.+)_fold_(?P<fold>\d+)$")
+# Crop of the runs whose names have none, the launcher's default crop-size
+DEFAULT_CROP = "full"
+WIDE_GLOB = "*_wide.parquet"
+RAW_GLOB = "*_out.csv.gz"
+
+
+def parse_run_name(name: str) -> dict:
+    '''
+    Run identity from a run description string or a file name built from one,
+    eg. blackmountain_fully-conv_2x60s_300s_run_06_crop_1024_lr_3.0E-4_fold_3_wide.parquet
+    :return: dict of dataset, model, terms, spacing, horizon, fold, run, crop and lr, or None if the name does not match
+    '''
+    stem = re.sub(r"\.(parquet|csv|csv\.gz)$", "", Path(name).name)
+    match = RUN_PATTERN.match(re.sub(r"_(wide|wide-na|metrics)$", "", stem))
+    if match is None:
+        return None
+    run = match.groupdict()
+    if run["crop"] is None:
+        run["crop"] = DEFAULT_CROP
+    for key in ["terms", "spacing", "horizon", "fold"]:
+        run[key] = int(run[key])
+    return run
+
+
+def run_from_params(path) -> dict:
+    '''
+    Run identity of a raw test output from the run-params.json written next to it by the launcher.
+    :param path: path to the ``*_out.csv.gz`` file
+    :return: dict as parse_run_name, or None if there is no run-params.json
+    '''
+    params_path = Path(path).with_name("run-params.json")
+    if not params_path.exists():
+        return None
+    with open(params_path) as f:
+        params = json.load(f)
+    run_id = re.search(r"run_(\d+)", str(params.get("run-dir", "")))
+    return {"dataset": params["dataset"],
+            "model": params["model-name"],
+            "terms": int(params["input-terms"]),
+            "spacing": int(params["input-spacing"]),
+            "horizon": int(re.sub(r"[^0-9]", "", str(params["horizon"]))),
+            "fold": int(params["fold"]),
+            "run": run_id.group(1) if run_id is not None else "00",
+            "crop": str(params["crop-size"]),
+            "lr": str(params["learning-rate"])}
+
+
+def run_key(run: dict) -> str:
+    '''Part file path of a run, relative to the store root'''
+    partition = "/".join(f"{key}={run[key]}" for key in PARTITION_KEYS)
+    return f"{partition}/run_{run['run']}_crop_{run['crop']}_lr_{run['lr']}.parquet"
+
+
+def find_sources(paths) -> list:
+    '''
+    Expands directories into the wide results and raw test output files under them.
+    :return: list of (path, run) for every source whose run identity could be found
+    '''
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(path.rglob(WIDE_GLOB)) + sorted(path.rglob(RAW_GLOB))
+        else:
+            files.append(path)
+    sources = []
+    for path in files:
+        run = run_from_params(path) if path.name.endswith(".csv.gz") else parse_run_name(path.name)
+        if run is None:
+            logger.warning(f"Skipping {path}, cannot find its run identity")
+        elif path.name.endswith("_metrics.parquet"):
+            logger.debug(f"Skipping {path}, case study and category subsets are not ingested")
+        else:
+            sources.append((path, run))
+    return sources
+
+
+def _strings(value: str, n: int) -> pa.DictionaryArray:
+    return pa.DictionaryArray.from_arrays(pa.array(np.zeros(n, dtype=np.int32)), pa.array([value]))
+
+
+def read_wide(path) -> tuple:
+    '''
+    :return: (id_time, predicted_time, actual, prediction, persist) arrays from a wide results file, in file order
+    '''
+    parquet_file = pq.ParquetFile(path)
+    model_col = forecast_metrics.model_columns(parquet_file.schema_arrow.names)[0]
+    persist_col = forecast_metrics.persist_column(model_col)
+    table = parquet_file.read(columns=[results_loader.ID_COL, results_loader.TIME_COL, forecast_metrics.ACTUAL_COL, model_col, persist_col])
+    times = [pc.strptime(table.column(c), format=results_loader.TIME_FORMAT, unit="s") for c in [results_loader.ID_COL, results_loader.TIME_COL]]
+    values = [table.column(c).cast(pa.float32()) for c in [forecast_metrics.ACTUAL_COL, model_col, persist_col]]
+    return (*times, *values)
+
+
+def read_raw(path, run: dict) -> tuple:
+    '''
+    :return: (id_time, predicted_time, actual, prediction, persist) arrays from a run's long test output csv
+    '''
+    df = pd.read_csv(path)
+    df = df.pivot_table(index="time", columns="series", values="value", aggfunc="first")
+    id_time = pd.to_datetime(df.index, format=results_loader.TIME_FORMAT)
+    predicted_time = id_time + pd.Timedelta(seconds=run["horizon"])
+    model_col = next(c for c in df.columns if c.endswith("_pred") and c != "persist_pred")
+    return (pa.array(id_time.values.astype("datetime64[s]")), pa.array(predicted_time.values.astype("datetime64[s]")),
+            *[pa.array(df[c].to_numpy(dtype=np.float32)) for c in [forecast_metrics.ACTUAL_COL, model_col, "persist_pred"]])
+
+
+def convert(args) -> dict:
+    '''
+    Pool function: writes one source as a part file of the store.
+    Rows with a missing value (the padding rows of the wide files) are dropped and the rest sorted by predicted_time.
+    :param args: (source path, run, store root)
+    :return: catalog record for the part
+    '''
+    path, run, root = args
+    start = time.perf_counter()
+    arrays = read_raw(path, run) if str(path).endswith(".csv.gz") else read_wide(path)
+    table = pa.table(list(arrays), names=VALUE_SCHEMA.names[:5]).drop_null()
+    values = np.stack([table.column(c).to_numpy(zero_copy_only=False) for c in ["actual", "prediction", "persist"]])
+    table = table.filter(pa.array(~np.any(np.isnan(values), axis=0)))
+    order = np.argsort(table.column("predicted_time").cast(pa.int64()).to_numpy(zero_copy_only=False), kind="stable")
+    table = table.take(pa.array(order))
+    n = table.num_rows
+    table = pa.table([*table.columns, _strings(run["run"], n), _strings(run["crop"], n), _strings(run["lr"], n)], schema=VALUE_SCHEMA)
+
+    key = run_key(run)
+    part_path = Path(root) / key
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so a part is never seen half written
+    tmp_path = part_path.with_name(f".{part_path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, compression="zstd")
+    os.replace(tmp_path, part_path)
+
+    times = table.column("predicted_time")
+    stat = Path(path).stat()
+    return {"source": str(Path(path).resolve()),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "key": key,
+            **{k: run[k] for k in PARTITION_KEYS + ["run", "crop", "lr"]},
+            "rows": n,
+            "start": pc.min(times).as_py() if n > 0 else None,
+            "end": pc.max(times).as_py() if n > 0 else None,
+            "seconds": time.perf_counter() - start}
+
+
+class ResultsStore:
+    '''
+    A partitioned results store rooted at a directory, see the module docstring for the layout.
+    '''
+    def __init__(self, root):
+        self.root = Path(root)
+
+    @property
+    def catalog_path(self) -> Path:
+        return self.root / CATALOG_FILE
+
+    def catalog(self) -> pd.DataFrame:
+        '''One row per ingested run'''
+        if not self.catalog_path.exists():
+            return pd.DataFrame(columns=["source", "mtime_ns", "size", "key", *PARTITION_KEYS, "run", "crop", "lr", "rows", "start", "end"])
+        return pd.read_parquet(self.catalog_path)
+
+    def write_catalog(self, catalog: pd.DataFrame):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.catalog_path.with_name(f".{CATALOG_FILE}.tmp")
+        catalog.reset_index(drop=True).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.catalog_path)
+
+    def ingest(self, paths, processes: int = None, force: bool = False) -> pd.DataFrame:
+        '''
+        Converts the sources that are new or changed since the last ingest, in parallel.
+        :param paths: source files, or directories to search for them
+        :param processes: worker processes, defaults to the number of CPUs
+        :param force: convert every source, even if it is unchanged
+        :return: catalog records of the parts written
+        '''
+        catalog = self.catalog()
+        known = {(row.source, row.mtime_ns, row.size) for row in catalog.itertuples()}
+        by_key = {}
+        for path, run in find_sources(paths):
+            key = run_key(run)
+            if key in by_key and str(by_key[key][0]).endswith(WIDE_GLOB[1:]):
+                logger.debug(f"Skipping {path}, {by_key[key][0]} is the same run")
+                continue
+            by_key[key] = (path, run)
+        jobs = []
+        for key, (path, run) in by_key.items():
+            stat = path.stat()
+            if not force and (str(path.resolve()), stat.st_mtime_ns, stat.st_size) in known:
+                continue
+            jobs.append((path, run, self.root))
+        logger.info(f"Ingesting {len(jobs)} of {len(by_key)} runs into {self.root}")
+        if len(jobs) == 0:
+            return catalog.iloc[:0]
+
+        records = []
+        start = time.perf_counter()
+        with Pool(processes=processes) as pool:
+            for record in pool.imap_unordered(convert, jobs):
+                logger.debug(f"{record['key']}: {record['rows']} rows in {record['seconds']:.2f}s")
+                records.append(record)
+        written = pd.DataFrame(records).drop(columns="seconds")
+        catalog = pd.concat([catalog[~catalog["key"].isin(written["key"])], written], ignore_index=True)
+        self.write_catalog(catalog.sort_values("key"))
+        logger.info(f"Ingested {len(written)} runs, {written['rows'].sum()} rows in {time.perf_counter() - start:.2f}s")
+        return written
+
+    def runs(self, start=None, end=None, **filters) -> pd.DataFrame:
+        '''
+        Selects runs from the catalog, without opening any part files.
+        :param start: optional inclusive start of a time window, only runs with rows inside it are kept
+        :param end: optional inclusive end of the time window
+        :param filters: catalog column -> value, or list of values, eg. model="fully-conv", horizon=[120, 420]
+        :return: catalog rows of the selected runs
+        '''
+        catalog = self.catalog()
+        mask = np.ones(len(catalog), dtype=bool)
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in catalog.columns:
+                raise ValueError(f"Unknown filter {key}, expected one of {list(catalog.columns)}")
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= catalog[key].astype(str).isin([str(v) for v in values]).to_numpy()
+        start, end = results_loader.parse_time(start), results_loader.parse_time(end)
+        if start is not None:
+            mask &= (catalog["end"] >= start).to_numpy()
+        if end is not None:
+            mask &= (catalog["start"] <= end).to_numpy()
+        return catalog[mask]
+
+    def query(self, start=None, end=None, columns: list = None, **filters) -> pd.DataFrame:
+        '''
+        Reads the rows of the selected runs inside a time window, in long format.
+        :param start: optional inclusive start of the window on predicted_time (``TIME_FORMAT`` string, ISO string or datetime)
+        :param end: optional inclusive end of the window
+        :param columns: columns to read, defaults to every value and partition column
+        :param filters: run selection, as for runs
+        :return: one row per run and time, with the partition columns
+        '''
+        selected = self.runs(start, end, **filters)
+        schema = pa.unify_schemas([VALUE_SCHEMA, PARTITION_SCHEMA])
+        if len(selected) == 0:
+            return schema.empty_table().to_pandas()
+        dataset = ds.dataset([str(self.root / key) for key in selected["key"]], schema=schema, format="parquet",
+                             partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"), partition_base_dir=str(self.root))
+        start, end = results_loader.parse_time(start), results_loader.parse_time(end)
+        condition = None
+        if start is not None:
+            condition = ds.field("predicted_time") >= pa.scalar(start.to_pydatetime(), pa.timestamp("s"))
+        if end is not None:
+            before_end = ds.field("predicted_time") <= pa.scalar(end.to_pydatetime(), pa.timestamp("s"))
+            condition = before_end if condition is None else condition & before_end
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+    def wide(self, start=None, end=None, **filters) -> pd.DataFrame:
+        '''
+        The selected runs in the wide results format, so they can go straight to forecast_metrics and the plotting scripts.
+        :return: frame with a sorted ``datetime`` index on predicted_time, ``actual`` and a model and persistence column per run
+        '''
+        df = self.query(start, end, **filters)
+        if len(df) == 0:
+            return pd.DataFrame(columns=[forecast_metrics.ACTUAL_COL], index=pd.DatetimeIndex([], name="datetime"))
+        # Column names as in the wide files, eg. fully-conv_2x60s_300s_run_06_fold_3 and persist_2x60s_300s_run_06_fold_3,
+        # with _crop_<crop>, _lr_<lr> and _dataset_<dataset> before the fold when the selection has more than one of them
+        parts = {key: df[key].astype(str) for key in PARTITION_KEYS + ["run", "crop", "lr"]}
+        suffix = "_" + parts["terms"] + "x" + parts["spacing"] + "s_" + parts["horizon"] + "s_run_" + parts["run"]
+        for key in ["crop", "lr", "dataset"]:
+            if df[key].nunique() > 1:
+                suffix = suffix + f"_{key}_" + parts[key]
+        suffix = suffix + "_fold_" + parts["fold"]
+        df = df.assign(model_col=parts["model"] + suffix, persist_col="persist" + suffix)
+        duplicated = df.duplicated(["predicted_time", "model_col"])
+        if duplicated.any():
+            raise ValueError(f"{duplicated.sum()} rows share a time and column name, eg. {df.loc[duplicated, 'model_col'].iloc[0]}, narrow the selection")
+        if df["dataset"].nunique() > 1 and (df.groupby("predicted_time")["actual"].nunique() > 1).any():
+            raise ValueError(f"The datasets {sorted(df['dataset'].unique())} have different actual values at the same time, select one dataset")
+        wide = pd.concat([df.groupby("predicted_time")["actual"].first(),
+                          df.pivot_table(index="predicted_time", columns="model_col", values="prediction", aggfunc="first"),
+                          df.pivot_table(index="predicted_time", columns="persist_col", values="persist", aggfunc="first")], axis=1)
+        wide.columns.name = None
+        wide.index.name = "datetime"
+        return wide.sort_index()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest run results into a partitioned store, and query it")
+    parser.add_argument('store', type=Path, help="Root directory of the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="Ingest new and changed results files")
+    ingest.add_argument('paths', type=Path, nargs='+', help="Wide results parquet files, raw *_out.csv.gz files, or directories of them")
+    ingest.add_argument('--processes', type=int, default=None, help="Number of worker processes, defaults to the number of CPUs")
+    ingest.add_argument('--force', action='store_true', help="Re-ingest unchanged files")
+    for name, help_text in [("runs", "List the ingested runs"), ("query", "Read the rows of the selected runs")]:
+        command = commands.add_parser(name, help=help_text)
+        for key in PARTITION_KEYS + ["run", "crop", "lr"]:
+            command.add_argument(f'--{key}', type=str, nargs='+', default=None, help=f"Only runs with this {key}")
+        command.add_argument('--start', type=str, default=None, help="Inclusive start of a predicted-time window")
+        command.add_argument('--end', type=str, default=None, help="Inclusive end of a predicted-time window")
+        command.add_argument('--output', type=Path, default=None, help="Csv or parquet to write, printed if not given")
+    commands.choices["query"].add_argument('--wide', action='store_true', help="Write the wide results format instead of one row per run and time")
+    return parser.parse_args()
+
+
+def main(args):
+    store = ResultsStore(args.store)
+    if args.command == "ingest":
+        store.ingest(args.paths, args.processes, args.force)
+        return
+    filters = {key: getattr(args, key) for key in PARTITION_KEYS + ["run", "crop", "lr"]}
+    if args.command == "runs":
+        df = store.runs(args.start, args.end, **filters)
+    elif args.wide:
+        df = store.wide(args.start, args.end, **filters)
+    else:
+        df = store.query(args.start, args.end, **filters)
+    if args.output is None:
+        print(df.to_string())
+    elif args.output.suffix == ".parquet":
+        df.to_parquet(args.output)
+    else:
+        df.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    import logging.config
+    with open(Path(__file__).with_name("logging_config.json")) as f:
+        logging.config.dictConfig(json.load(f))
+    main(parse_args())
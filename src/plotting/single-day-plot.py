@@ -3,13 +3,16 @@ Plot single day with metrics
 """
 # Standard Library Modules
 from pathlib import Path
-from datetime import datetime
-import math
+import argparse
 
 # External Modules
 import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
+
+# Local Modules
+import forecast_metrics
+import irradiance_store
+import results_loader
 
 def line_timeseries(timeline, actual, left_model, left_label, right_model, right_label, ax_title="", fig_title="", filebase="plot", output_dir=Path("")):
     fig, ax = plt.subplots()
@@ -25,25 +28,25 @@ def line_timeseries(timeline, actual, left_model, left_label, right_model, right
     fig.savefig(output_dir / f"{filebase}.png")
     plt.close(fig)
 
-def read_df_date(path, date):
-    dt_parser = lambda x: datetime.strptime(x, "%Y-%m-%d_%H-%M-%S")
-    df = pd.read_csv(path, parse_dates=["time"], date_parser=dt_parser)
-    df["date"] = df["time"].dt.strftime("%Y-%m-%d")
-    df = df.set_index("time")
-    df = df[df["date"] == date]
-    df = df.drop(columns=["date"])
+def read_df_date(path, date, store=None, actual="actual"):
+    df = results_loader.load_csv_results(path, date=date)
+    if store is not None:
+        # Measured GHI at each predicted time from the irradiance store, the file's own copy where the store has no row
+        measured = store.lookup(df.index, irradiance_store.GHI_COL)
+        df[actual] = df[actual].mask(pd.notna(measured), measured)
     return df
     
 
-def plot_day(left_file, right_file, actual="actual", date="2015-06-19", left_model="fully-conv_16x60s_420s_run_01", right_model="sunset_16x60s_7m_run_00"):
+def plot_day(left_file, right_file, actual="actual", date="2015-06-19", left_model="fully-conv_16x60s_420s_run_01", right_model="sunset_16x60s_7m_run_00", store_dir=None):
     print(f"Plotting from {left_file} {right_file} for date {date}")
     
-    df1 = read_df_date(left_file, date)
-    df2 = read_df_date(right_file, date)
+    store = None if store_dir is None else irradiance_store.IrradianceStore(store_dir)
+    df1 = read_df_date(left_file, date, store, actual)
+    df2 = read_df_date(right_file, date, store, actual)
 
     df = df1.join(df2, rsuffix="right", sort=True)
-    rmse_left = math.sqrt(metrics.mean_squared_error(df[actual], df[left_model]))
-    rmse_right = math.sqrt(metrics.mean_squared_error(df[actual], df[right_model]))
+    rmse_left = forecast_metrics.rmse(df[actual], df[left_model])
+    rmse_right = forecast_metrics.rmse(df[actual], df[right_model])
 
     line_timeseries(df.index, df[actual], df[left_model], left_model, df[right_model], right_model, ax_title=f"MyConv RMSE: {rmse_left:.1f} Sunset RMSE: {rmse_right:.1f}", fig_title=f"GHI vs Time for {date} at BlackMountain", filebase=date)
 
@@ -71,15 +74,21 @@ def plot_dir(basedir="/work/processed-runs/blackmountain", outdir="/work", title
 
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plot a day of two models' forecasts")
+    parser.add_argument('--store', type=Path, default=None, help="irradiance_store directory to take the measured GHI from, the results files' actual if not given")
+    return parser.parse_args()
+
+def main(args):
     plot_dir("/work/processed-runs/blackmountain-round_2_blackmountain-ramp-round/wide", "/work/processed-runs/blackmountain-round_2_blackmountain-ramp-round/plots", "bmr-2-bmrr_")
     # plot_day(left_file="/work/processed-runs/blackmountain-round/wide/16x60s_420s_fully-conv_run_00_fold_0_wide.csv.gz", 
     #         right_file="/work/processed-runs/blackmountain-round/wide/16x60s_420s_sunset_run_00_fold_0_wide.csv.gz",
     #         actual="actual",
     #         date="2015-06-19",
     #         left_model="fully-conv_16x60s_420s_run_00_fold_0",
-    #         right_model="sunset_16x60s_420s_run_00_fold_0")
+    #         right_model="sunset_16x60s_420s_run_00_fold_0",
+    #         store_dir=args.store)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file
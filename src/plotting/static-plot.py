@@ -9,14 +9,13 @@ from multiprocessing import Pool
 # External Modules
 import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
 
 #Logging
 import logging
 import logging.config
 import json
 
-with open("logging_config.json") as f:
+with open(Path(__file__).with_name("logging_config.json")) as f:
     log_config = json.load(f)
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
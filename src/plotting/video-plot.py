@@ -3,18 +3,21 @@ Plot single day with metrics
 """
 # Standard Library Modules
 from pathlib import Path
-from datetime import datetime
+import argparse
 from datetime import timedelta
-import math
 import tempfile
 import shutil
 
 # External Modules
 import pandas as pd
 import matplotlib.pyplot as plt
-import sklearn.metrics as metrics
 from PIL import Image
 
+# Local Modules
+import forecast_metrics
+import irradiance_store
+import results_loader
+
 #https://stackoverflow.com/questions/59587603/matplotlib-dashed-line-between-points-if-one-condition-is-met
 #https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.vlines.html
 #https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.between_time.html
@@ -42,8 +45,8 @@ def line_timeseries(day_df, current_time, img_base, actual, left_model, right_mo
 
     df = day_df.between_time(context_start.to_pydatetime().time(), context_end.to_pydatetime().time(), include_start=True, include_end=True, axis=None)
     pred_df = day_df.between_time(current_time.to_pydatetime().time(), context_end.to_pydatetime().time(), include_start=True, include_end=True, axis=None)
-    rmse_left = math.sqrt(metrics.mean_squared_error(df[actual], df[left_model]))
-    rmse_right = math.sqrt(metrics.mean_squared_error(df[actual], df[right_model]))
+    rmse_left = forecast_metrics.rmse(df[actual], df[left_model])
+    rmse_right = forecast_metrics.rmse(df[actual], df[right_model])
 
     ymin = df[[actual, left_model, right_model]].min().min()
     ymax = df[[actual, left_model, right_model]].max().max()
@@ -64,25 +67,25 @@ def line_timeseries(day_df, current_time, img_base, actual, left_model, right_mo
     fig.savefig(output_dir / f"{filebase}.png")
     plt.close(fig)
 
-def read_df_date(path, date):
-    dt_parser = lambda x: datetime.strptime(x, "%Y-%m-%d_%H-%M-%S")
-    df = pd.read_csv(path, parse_dates=["time"], date_parser=dt_parser)
-    df["date"] = df["time"].dt.strftime("%Y-%m-%d")
-    df = df.set_index("time")
-    df = df[df["date"] == date]
-    df = df.drop(columns=["date"])
+def read_df_date(path, date, store=None, actual="actual"):
+    df = results_loader.load_csv_results(path, date=date)
+    if store is not None:
+        # Measured GHI at each predicted time from the irradiance store, the file's own copy where the store has no row
+        measured = store.lookup(df.index, irradiance_store.GHI_COL)
+        df[actual] = df[actual].mask(pd.notna(measured), measured)
     return df
     
 
-def plot_day(left_file, right_file, actual="actual", date="2015-06-19", left_model="fully-conv_16x60s_420s_run_01", right_model="sunset_16x60s_7m_run_00"):
+def plot_day(left_file, right_file, actual="actual", date="2015-06-19", left_model="fully-conv_16x60s_420s_run_01", right_model="sunset_16x60s_7m_run_00", store_dir=None):
     print(f"Plotting from {left_file} {right_file} for date {date}")
     zip_file = f"/data/blackmountain/images/2015/{date}.zip"
     with tempfile.TemporaryDirectory() as td:
         shutil.unpack_archive(zip_file, td)
         print(f"Extracted to {td}")
         img_base = f"{td}/{date}"
-        df1 = read_df_date(left_file, date)
-        df2 = read_df_date(right_file, date)
+        store = None if store_dir is None else irradiance_store.IrradianceStore(store_dir)
+        df1 = read_df_date(left_file, date, store, actual)
+        df2 = read_df_date(right_file, date, store, actual)
 
         day_df = df1.join(df2, rsuffix="right", sort=True)
 
@@ -93,14 +96,20 @@ def plot_day(left_file, right_file, actual="actual", date="2015-06-19", left_mod
             line_timeseries(day_df, index, img_base, actual, left_model, right_model, filebase=f"frame-{counter:04d}", output_dir=out_path)
             counter = counter + 1
     
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plot a day of two models' forecasts frame by frame next to the sky images")
+    parser.add_argument('--store', type=Path, default=None, help="irradiance_store directory to take the measured GHI from, the results files' actual if not given")
+    return parser.parse_args()
+
+def main(args):
     plot_day(left_file="/work/processed-runs/blackmountain-round/wide/16x60s_420s_fully-conv_run_00_fold_0_wide.csv.gz", 
             right_file="/work/processed-runs/blackmountain-round/wide/16x60s_420s_sunset_run_00_fold_0_wide.csv.gz",
             actual="actual",
             date="2015-06-19",
             left_model="fully-conv_16x60s_420s_run_00_fold_0",
-            right_model="sunset_16x60s_420s_run_00_fold_0")
+            right_model="sunset_16x60s_420s_run_00_fold_0",
+            store_dir=args.store)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file
@@ -95,6 +95,8 @@
                          {:option "crop-size" :as "crop size" :type :string :default "full"}
                          {:option "lr-list" :as "Learning rate list" :type :edn :default :present}
                          {:option "num-workers" :as "Number of workers" :type :int :default 5}
+                         {:option "accelerator" :as "Lightning accelerator, cpu for cpu only nodes" :type :string :default "gpu"}
+                         {:option "precision" :as "Lightning precision, bf16 for mixed precision on cpu" :type :string :default "16"}
                          ]
                   }
                  {:command "clean"
@@ -11,7 +11,8 @@
 
 (defn make-python-command
   "Create the python command to invoke"
-  [{:keys [out-file input-terms script-name model-name train-ds val-ds test-ds img-width learning-rate job-cpus]}]
+  [{:keys [out-file input-terms script-name model-name train-ds val-ds test-ds img-width learning-rate job-cpus accelerator precision]
+    :or {accelerator "gpu" precision "16"}}]
   (str
    "python3 " script-name " "
    "--model_name " model-name " "
@@ -21,13 +22,13 @@
    "--img_width " img-width " "
    "--max_epochs -1 "
    "--batch_size 8 "
-   "--accelerator gpu "
+   "--accelerator " accelerator " "
    "--learning_rate " learning-rate " "
    "--test_output " out-file " "
    "--input_terms " input-terms " "
    "--benchmark True "
    "--num_workers " job-cpus " "
-   "--precision 16 "
+   "--precision " precision " "
    "$@"))
 
 (defn make-scripts!
@@ -76,7 +77,8 @@
                     (let [args {:launcher-path (file/resolve-path [host-basedir launcher-path])
                                 :checkpoint-file (file/resolve-path [host-basedir run-folder "latest_best.ckpt"])
                                 :output-file (file/resolve-path [host-basedir run-folder out-file])
-                                :test-started-file (file/resolve-path [host-basedir run-folder "started_testing.json"])}
+                                :test-started-file (file/resolve-path [host-basedir run-folder "started_testing.json"])
+                                :pruned-file (file/resolve-path [host-basedir run-folder "prune.json"])}
                           command (case engine
                                     "local" (local/determine-script args)
                                     "slurm" (slurm/determine-script args))]
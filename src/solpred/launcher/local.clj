@@ -30,9 +30,12 @@
 
 (defn determine-script
   "Determine which script to launch based on filesystem checks"
-  [{:keys [launcher-path checkpoint-file output-file test-started-file force-test]}]
+  [{:keys [launcher-path checkpoint-file output-file test-started-file pruned-file force-test]}]
   (cond
     (file/exists? output-file)     (str "echo " output-file " already exists, doing nothing")
+    (and pruned-file
+         (file/exists? pruned-file)
+         (not force-test))         (str "echo " pruned-file " exists, run was pruned by asha.py, doing nothing")
     (or (file/exists? test-started-file) 
         force-test)                (str launcher-path " --load_checkpoint " (file/filename checkpoint-file) " --test")
     (file/exists? checkpoint-file) (str launcher-path " --load_checkpoint " (file/filename checkpoint-file) " --resume_train")
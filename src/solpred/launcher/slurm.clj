@@ -55,9 +55,12 @@
 
 (defn determine-script
   "Determine which script to launch based on filesystem checks"
-  [{:keys [launcher-path checkpoint-file output-file test-started-file force-test]}]
+  [{:keys [launcher-path checkpoint-file output-file test-started-file pruned-file force-test]}]
   (cond
     (file/exists? output-file)     (str "echo " output-file " already exists, doing nothing")
+    (and pruned-file
+         (file/exists? pruned-file)
+         (not force-test))         (str "echo " pruned-file " exists, run was pruned by asha.py, doing nothing")
     (or (file/exists? test-started-file) 
         force-test)                (str "sbatch " launcher-path " --enable_progress_bar False" " --load_checkpoint " (file/filename checkpoint-file) " --test")
     (file/exists? checkpoint-file) (str "sbatch " launcher-path " --enable_progress_bar False" " --load_checkpoint " (file/filename checkpoint-file) " --resume_train")
@@ -6,7 +6,6 @@
    [clojure.edn :as edn]
    [clojure.math :as math]
    [clojure.set :as set]
-   [clojure.java.io :as io]
    [clojure.data.json :as json]
    [solpred.reports.metrics :as metrics]
    [solpred.util.pprint-edn :as edn-out]
@@ -255,10 +254,10 @@
         skip-jobs
         (->> (:skip group)
              (map (fn [{:keys [ensemble-name]}] #(log/debug (str "Skipping plotting " ensemble-name " because it exists")))))
-        proc-jobs
+        python-instr-files
         (->> (:process group)
-             (map (fn [{:keys [paths ensemble-name tmp-dir] :as ensemble}]
-                    #(let [python-instr-file (file/resolve-path [tmp-dir (str ensemble-name "_" (rand-int 1000) ".json")])
+             (mapv (fn [{:keys [paths ensemble-name tmp-dir] :as ensemble}]
+                     (let [python-instr-file (file/resolve-path [tmp-dir (str ensemble-name "_" (rand-int 1000) ".json")])
                            python-args
                            {:title ensemble-name
                             :out-dir (file/parent (:plot-path paths))
@@ -266,12 +265,8 @@
                        (file/make-dirs (file/parent (:plot-path paths)))
                        (file/make-dirs (:tmp-dir ensemble))
                        (spit python-instr-file (json/write-str python-args))
-                       (-> (extern/make-executor ["python3" "/app/src/plotting/json-to-interact.py" python-instr-file])
-                           (.exitValue (int 0))
-                           (.directory (io/file "/app/src/plotting/"))
-                           (.execute))
-                       (file/delete python-instr-file)
-                       ))))]
+                       python-instr-file))))
+        proc-jobs (extern/instruction-batch-jobs "/app/src/plotting/json-to-interact.py" python-instr-files)]
     (runner/run-jobs! {:jobs (into skip-jobs proc-jobs)})))
 
 (defn main
@@ -4,7 +4,6 @@
    [clojure.string :as str]
    [clojure.edn :as edn]
    [clojure.tools.logging :as log]
-   [clojure.java.io :as io]
    [clojure.data.json :as json]
    [solpred.util.file :as file]
    [solpred.util.runner :as runner]
@@ -227,10 +226,10 @@
         skip-jobs
         (->> (:skip group)
              (map (fn [{:keys [plot-path]}] #(log/debug (str "Skipping " plot-path " because it exists")))))
-        proc-jobs
+        python-instr-files
         (->> (:process group)
-             (map (fn [{:keys [plot-path run-description-string metric-dataset-path tmp-dir] :as run}]
-                    #(let [python-instr-file (file/resolve-path [tmp-dir (str run-description-string "_" (rand-int 1000) ".json")])
+             (mapv (fn [{:keys [plot-path run-description-string metric-dataset-path tmp-dir] :as run}]
+                     (let [python-instr-file (file/resolve-path [tmp-dir (str run-description-string "_" (rand-int 1000) ".json")])
                            python-args
                            {:title (str run-description-string "_rmse="  (format "%.2f" (get-in run [:model-metrics :rmse])))
                             :out-dir (file/parent plot-path)
@@ -240,12 +239,8 @@
                        (file/make-dirs (file/parent plot-path))
                        (file/make-dirs tmp-dir)
                        (spit python-instr-file (json/write-str python-args))
-                       (-> (extern/make-executor ["python3" "/app/src/plotting/json-to-static.py" python-instr-file])
-                           (.exitValue (int 0))
-                           (.directory (io/file "/app/src/plotting/"))
-                           (.execute))
-                       (file/delete python-instr-file)
-                       ))))]
+                       python-instr-file))))
+        proc-jobs (extern/instruction-batch-jobs "/app/src/plotting/json-to-static.py" python-instr-files)]
    (runner/run-jobs! {:jobs (into skip-jobs proc-jobs)})))
 
 (defn main
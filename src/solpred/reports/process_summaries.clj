@@ -5,7 +5,6 @@
    [clojure.edn :as edn]
    [clojure.data.json :as json]
    [clojure.tools.logging :as log]
-   [clojure.java.io :as io]
    [solpred.util.time :as time]
    [solpred.util.file :as file]
    [solpred.util.runner :as runner]
@@ -241,10 +240,10 @@
         skip-jobs
         (->> (:skip group)
              (map (fn [{:keys [run-description-string]}] #(log/debug (str "Skipping " run-description-string " because it exists")))))
-        proc-jobs
+        python-instr-files
         (->> (:process group)
-             (map (fn [{:keys [plots-dir run-description-string wide-dataset-path tmp-dir] :as run}]
-                    #(do
+             (mapv (fn [{:keys [plots-dir run-description-string wide-dataset-path tmp-dir] :as run}]
+                     (do
                        (runtime-check/map-contains? run [:plots-dir :run-description-string :wide-dataset-path :tmp-dir])
                        (log/debug (str "Making " plots-dir))
                        (file/make-dirs plots-dir)
@@ -255,13 +254,8 @@
                               :path wide-dataset-path}]
                          (file/make-dirs (:tmp-dir run))
                          (spit python-instr-file (json/write-str python-args))
-                         (-> (extern/make-executor ["python3" "/app/src/plotting/json-to-interact.py" python-instr-file])
-                             (.exitValue (int 0))
-                             (.directory (io/file "/app/src/plotting/"))
-                             (.execute))
-                         (file/delete python-instr-file)
-                         )
-                       ))))
+                         python-instr-file)))))
+        proc-jobs (extern/instruction-batch-jobs "/app/src/plotting/json-to-interact.py" python-instr-files)
         ]
     (runner/run-jobs! {:jobs (into skip-jobs proc-jobs)})))
 
@@ -1,5 +1,7 @@
 (ns solpred.util.external
-  (:require [clojure.tools.logging :as log])
+  (:require [clojure.tools.logging :as log]
+            [clojure.java.io :as io]
+            [solpred.util.file :as file])
   (:import org.zeroturnaround.exec.stream.slf4j.Slf4jStream)
   (:import org.zeroturnaround.exec.ProcessExecutor))
 
@@ -63,3 +65,22 @@
   [command]
   (-> (make-executor command)
       (.getFuture)))
+
+(defn instruction-batch-jobs
+  #_(instruction-batch-jobs "/app/src/plotting/json-to-static.py" ["/tmp/solpred/a.json" "/tmp/solpred/b.json"])
+  "Jobs that each run a json instruction script (json-to-static.py, json-to-interact.py) on a batch of instruction files
+  and then delete them, so python and the plotting imports start once per batch instead of once per plot.
+  The files are split into one batch per processor so the batches still run in parallel"
+  [script instr-files]
+  (let [num-batches (. (. Runtime getRuntime) availableProcessors)
+        batch-size (max 1 (int (Math/ceil (/ (count instr-files) num-batches))))]
+    (->> instr-files
+         (partition-all batch-size)
+         (map (fn [batch]
+                #(do
+                   (log/debug (str "Running " script " on " (count batch) " instruction files"))
+                   (-> (make-executor (into ["python3" script] (map str batch)))
+                       (.exitValue (int 0))
+                       (.directory (.getParentFile (io/file script)))
+                       (.execute))
+                   (run! file/delete batch)))))))